@@ -1,24 +1,57 @@
 import os
+import sys
+import csv
 import json
-import pandas as pd
-from tqdm import tqdm
-from git import Repo
+import random
+from commit_extraction import (
+    iter_commit_records, iter_commit_records_parallel,
+    resolve_head, read_high_water_mark, write_high_water_mark, incremental_rev_range
+)
+from commit_index import load_commit_index, select_commits
+from git_log_engine import iter_commit_records_git_log
+from commit_warehouse import CommitWarehouseWriter, WAREHOUSE_DIR
+from diff_store import DiffStore, DIFF_STORE_DIR
+from diff_budget import apply_diff_budget, DiffBudgetReport
+from diff_features import DiffFeatureWriter, DIFF_FEATURES_PATH
+from prompt_builder import ALL_CATEGORIES, batch_request_line, write_batch_requests, open_jsonl
+from jsonl_shards import ShardedJsonlWriter, manifest_path_for, read_manifest
+from result_cache import ResultCache, RequestKeyWriter, request_key, read_model_resource_name, REQUEST_KEYS_CSV
 
 
 REPO_URL = "https://gitlab.gnome.org/GNOME/libxml2.git"
 LOCAL_REPO_PATH = "./repos/c/libxml2"
+# Number of worker processes used to diff the history. 1 keeps the original
+# serial GitPython walk; anything higher shards the rev-list across a pool.
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "1"))
+# "gitpython" diffs each commit through GitPython (the original path);
+# "gitlog" streams the whole history from a single `git log -p` process.
+EXTRACTION_ENGINE = os.getenv("EXTRACTION_ENGINE", "gitpython")
+# Set INCREMENTAL_EXTRACTION=1 to only extract the commits added since the last run.
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION") == "1"
+# "csv" writes only the commit table CSV; "parquet" also writes the columnar
+# warehouse (see commit_warehouse.py) that stages 05 and 06 can read from.
+WAREHOUSE_FORMAT = os.getenv("WAREHOUSE_FORMAT", "csv")
+# Set WRITE_DIFF_STORE=1 to also index every diff in the content-addressed diff store (diff_store.py).
+WRITE_DIFF_STORE = os.getenv("WRITE_DIFF_STORE") == "1"
+# Per-request token budget for the code diff in each prompt (see diff_budget.py).
+# 0 disables budgeting and sends the full diff, as before.
+DIFF_TOKEN_BUDGET = int(os.getenv("DIFF_TOKEN_BUDGET", "0"))
+# Optional sharding of the batch JSONL (see jsonl_shards.py); 0 = no cap.
+# With either cap set, numbered shards and a manifest replace the single file.
+JSONL_SHARD_MAX_LINES = int(os.getenv("JSONL_SHARD_MAX_LINES", "0"))
+JSONL_SHARD_MAX_MB = float(os.getenv("JSONL_SHARD_MAX_MB", "0"))
+JSONL_GZIP = os.getenv("JSONL_GZIP") == "1"
+# Set RESULT_CACHE=1 to leave commits whose prompt was already classified by the
+# current model out of the batch JSONL (see result_cache.py).
+RESULT_CACHE = os.getenv("RESULT_CACHE") == "1"
 # /filename
 full_commit_set = "full_commit_with_author_data/full_commit_libxml2.csv"
 FULL_COMMIT_JSONL = "full_commit_jsonl/FULL_commit_toclassify.jsonl"
+HIGH_WATER_MARK_FILE = "full_commit_with_author_data/last_processed_head" # HEAD the commit table is up to date with
 GOLD_STANDARD_CSV = "gold_standard_sample/labeled_commits.csv" # CSV with commit_hash and its true JSON label
-ALL_CATEGORIES = [
-    "Parser Logic", "Memory", "General Logic Error", "API Logic",
-    "Security Vulnerability (CVE)", "Integer", "Error Handling",
-    "Concurrency", "Type System", "State Management", "Performance",
-    "Incorrect Output/Calculation", "Standard Library Misuse",
-    "Build/CI/Tests", "Refactoring", "Documentation",
-    "Feature/Enhancement", "Non-Maintenance"
-]
+GOLD_SAMPLE_FRACTION = 0.1
+GOLD_SAMPLE_SEED = 42
+COMMIT_COLUMNS = ["commit_id", "message", "diff", "author_name", "authored_datetime"]
 INSTRUCTION_PROMPT = (
     "You are a world-class software engineering analyst specializing in C code. "
     "Your primary evidence must be the code_diff. Analyze it to determine the bug's root cause. "
@@ -27,85 +60,231 @@ INSTRUCTION_PROMPT = (
 )
 
 
-def get_commit_diff_only(commit):
-    # This correctly handles the root commit (Case 3)
-    if not commit.parents:
-        return "" 
-    output_parts = []
-    
-    # always compare to main [0]
-    diff_index = commit.diff(commit.parents[0], create_patch=True)
-    for diff_item in diff_index:
-        patch = diff_item.diff.decode('utf-8',errors='replace')
-        output_parts.append(patch)
-        # Join all the parts into a single string
-    return "\n".join(output_parts)
-        
-
-
-
 def create_jsonl_from_df(df, output_filename):
     """Converts a DataFrame to a JSONL file in the required format."""
-   
-    with open(output_filename, 'w') as f:
-        for index, row in df.iterrows():
-            commit_id = row['commit_id']
-            commit_message = row['message']
-            diff_text = row['diff']
-
-            prompt_template = (
-       "You are a world-class software engineering analyst specializing in the libxml2 library. "
-            "Analyze the following commit message and code diff, then classify it. "
-            "Respond ONLY with a valid JSON object containing 'is_bug_fix', 'category', and 'reasoning'.\n\n"
-             f"AVAILABLE CATEGORIES:\n{json.dumps(ALL_CATEGORIES)}\n\n"
-            f"--- COMMIT MESSAGE ---\n{commit_message}"
-            f"--- CODE DIFF ---\n{diff_text}"
-    )
-
-            final_line_object = {
-                "request":{
-                "contents": [{
-                    "role": "user",
-                    "parts": [{
-                        "text": prompt_template
-                    }]
-                }]
-                }, 
-                "key": commit_id
-            }
-            f.write(json.dumps(final_line_object) + "\n")
+    write_batch_requests(df, output_filename)
     print(f"Successfully created {output_filename}")
 
-if __name__ == "__main__":
 
-    
-    # 2. Extract Diffs and Messages from Git
-    if os.path.exists(full_commit_set):
-        commits_df = pd.read_csv(full_commit_set)
+def open_batch_jsonl(jsonl_path):
+    """The batch JSONL output: one file, or size-capped shards plus a manifest."""
+    if JSONL_SHARD_MAX_LINES or JSONL_SHARD_MAX_MB or JSONL_GZIP:
+        if os.path.exists(jsonl_path):
+            os.remove(jsonl_path)  # the shards replace the single file
+        return ShardedJsonlWriter(jsonl_path, JSONL_SHARD_MAX_LINES, int(JSONL_SHARD_MAX_MB * 1e6), JSONL_GZIP)
+    if os.path.exists(manifest_path_for(jsonl_path)):
+        # Shards from an earlier sharded run would otherwise be uploaded instead of the new file.
+        for shard in read_manifest(manifest_path_for(jsonl_path))["shards"]:
+            if os.path.exists(shard["local_path"]):
+                os.remove(shard["local_path"])
+        os.remove(manifest_path_for(jsonl_path))
+    return open_jsonl(jsonl_path)
+
+
+def iter_extracted_commits(commit_index, rev="HEAD"):
+    """
+    Streams every commit reachable from rev (a sha or an 'a..b' range) from git.
+    The GitPython engines take the commit list from the commit index instead
+    of walking the history again.
+    """
+    if EXTRACTION_ENGINE == "gitlog":
+        return iter_commit_records_git_log(LOCAL_REPO_PATH, rev=rev)
+    shas = select_commits(commit_index, LOCAL_REPO_PATH, rev)['commit_id'].tolist()
+    if EXTRACTION_WORKERS > 1:
+        return iter_commit_records_parallel(LOCAL_REPO_PATH, EXTRACTION_WORKERS, rev=rev, shas=shas)
+    return iter_commit_records(LOCAL_REPO_PATH, rev=rev, shas=shas)
+
+
+def iter_commit_table(table_path):
+    """Streams the rows of an existing commit table one at a time."""
+    with open(table_path, 'r', newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def _drop_stale_request_keys():
+    """A sidecar left by an earlier run would make 05 file this batch's results under that run's keys."""
+    if os.path.exists(REQUEST_KEYS_CSV):
+        print(f"Removing the request keys of the previous batch: {REQUEST_KEYS_CSV}")
+        os.remove(REQUEST_KEYS_CSV)
+
+
+def open_result_cache():
+    """(model name, cached request keys, sidecar writer), or None when the cache is off."""
+    if not RESULT_CACHE:
+        _drop_stale_request_keys()
+        return None
+    model_name = read_model_resource_name()
+    if model_name is None:
+        print("Note: RESULT_CACHE=1 but no model resource name is recorded yet; sending every commit.")
+        _drop_stale_request_keys()
+        return None
+    with ResultCache() as cache:
+        cached_keys = cache.keys()
+    print(f"Result cache: {len(cached_keys)} cached results for lookups against {model_name}")
+    return model_name, cached_keys, RequestKeyWriter(REQUEST_KEYS_CSV)
+
+
+def stream_commits_to_outputs(records, table_path, jsonl_path, sample_size=0, append=False, sinks=()):
+    """
+    Writes each commit to the commit table (unless table_path is None), to the
+    batch JSONL and to every extra sink (anything with add(record) and close(),
+    e.g. the Parquet warehouse or the diff store) as soon as it arrives, so
+    only one commit is held in memory at a time. A reservoir of sample_size commit ids is drawn along the way for
+    the gold sample. With RESULT_CACHE=1, requests already classified are
+    left out of the JSONL. Returns (number of commits written, sampled commit ids).
+    """
+    rng = random.Random(GOLD_SAMPLE_SEED)
+    reservoir = []
+    written = 0
+    cache_hits = 0
+    result_cache = open_result_cache()
+    budget_report = DiffBudgetReport(DIFF_TOKEN_BUDGET) if DIFF_TOKEN_BUDGET > 0 else None
+
+    table_file = None
+    if table_path is not None:
+        columns = COMMIT_COLUMNS
+        if append:
+            # Keep the column order of the existing table when appending.
+            with open(table_path, 'r', newline='', encoding='utf-8') as f:
+                columns = next(csv.reader(f))
+        table_file = open(table_path, 'a' if append else 'w', newline='', encoding='utf-8')
+        table_writer = csv.DictWriter(table_file, fieldnames=columns, extrasaction='ignore', lineterminator='\n')
+        if not append:
+            table_writer.writeheader()
+
+    try:
+        with open_batch_jsonl(jsonl_path) as jsonl_file:
+            for record in records:
+                if table_file is not None:
+                    table_writer.writerow(record)
+                for sink in sinks:
+                    sink.add(record)
+                prompt_diff = record['diff']
+                if budget_report is not None:
+                    # The table keeps the full diff; only the prompt is budgeted.
+                    prompt_diff = apply_diff_budget(prompt_diff, record.get('diff_files'), DIFF_TOKEN_BUDGET, budget_report)
+                cached = False
+                if result_cache is not None:
+                    model_name, cached_keys, key_writer = result_cache
+                    key = request_key(model_name, record['message'], prompt_diff)
+                    key_writer.write(record['commit_id'], key, model_name)
+                    cached = key in cached_keys
+                    cache_hits += cached
+                if not cached:
+                    jsonl_file.write(batch_request_line(record['commit_id'], record['message'], prompt_diff))
+
+                # Reservoir sampling (Algorithm R): every commit seen so far has
+                # the same sample_size / written chance of being in the reservoir.
+                if written < sample_size:
+                    reservoir.append(record['commit_id'])
+                else:
+                    slot = rng.randrange(written + 1)
+                    if slot < sample_size:
+                        reservoir[slot] = record['commit_id']
+                written += 1
+    finally:
+        if table_file is not None:
+            table_file.close()
+        for sink in sinks:
+            sink.close()
+        if result_cache is not None:
+            result_cache[2].close()
+
+    if isinstance(jsonl_file, ShardedJsonlWriter):
+        print(f"Successfully created {len(jsonl_file.shards)} shard(s) of {jsonl_path}; manifest: {manifest_path_for(jsonl_path)}")
     else:
-        repo = Repo(LOCAL_REPO_PATH)
-        diff_data = []
-        for commit in tqdm(repo.iter_commits(), desc="Extracting Commits & Diffs"):
-            diff_text = get_commit_diff_only( commit)
-            diff_data.append({
-                "commit_id": commit.hexsha,
-                "message" : commit.message,
-                "diff": diff_text,
-                 "author_name": commit.author.name,
-                "authored_datetime": commit.authored_datetime 
-            })
-        commits_df = pd.DataFrame(diff_data)
-        commits_df.to_csv(full_commit_set,index=False)
+        print(f"Successfully created {jsonl_path}")
+    if result_cache is not None:
+        print(f"Result cache: {cache_hits} of {written} commits already classified; {written - cache_hits} requests written.")
+    if budget_report is not None:
+        budget_report.print_summary()
+    return written, set(reservoir)
+
+
+def write_gold_sample(table_path, sampled_ids, output_filename):
+    """Copies the sampled commits out of the commit table with a second streaming pass."""
+    with open(output_filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['commit_id', 'message', 'diff'])
+        for row in iter_commit_table(table_path):
+            if row['commit_id'] in sampled_ids:
+                writer.writerow([row['commit_id'], row['message'], row['diff']])
+
+
+def open_sinks(append):
+    """
+    The per-commit diff features (diff_features.py), plus the optional extra
+    outputs enabled by WAREHOUSE_FORMAT and WRITE_DIFF_STORE.
+    """
+    sinks = [DiffFeatureWriter(DIFF_FEATURES_PATH, append=append)]
+    if WAREHOUSE_FORMAT == "parquet":
+        sinks.append(CommitWarehouseWriter(WAREHOUSE_DIR, append=append))
+    if WRITE_DIFF_STORE:
+        sinks.append(DiffStore(DIFF_STORE_DIR))
+    return sinks
 
 
-    # 6. Create JSONL files
-    create_jsonl_from_df(commits_df, FULL_COMMIT_JSONL)
+def seed_high_water_mark():
+    """
+    Tables written before the high-water mark existed are newest-first, so
+    their first row is the HEAD they were extracted at.
+    """
+    first_row = next(iter_commit_table(full_commit_set), None)
+    return first_row['commit_id'] if first_row else None
 
 
-    # create sample 
-    gold_sample = commits_df.sample(frac=0.1, random_state=42)
-    gold_sample[['commit_id', 'message','diff']].to_csv(GOLD_STANDARD_CSV, index=False)
-    print(f"Successfully saved a sample of {GOLD_STANDARD_CSV} commits to '{GOLD_STANDARD_CSV}'")
-   
+if __name__ == "__main__":
+
+    csv.field_size_limit(sys.maxsize) # diff cells can be many megabytes
+
+    # 2. Extract Diffs and Messages from Git
+    # Only the branches that extract need the clone and the commit index;
+    # re-reading an existing table needs neither.
+    if INCREMENTAL_EXTRACTION and os.path.exists(full_commit_set):
+        head_sha = resolve_head(LOCAL_REPO_PATH)
+        commit_index = load_commit_index(LOCAL_REPO_PATH, rev=head_sha)
+        last_head = read_high_water_mark(HIGH_WATER_MARK_FILE) or seed_high_water_mark()
+        if last_head == head_sha:
+            print(f"Commit table is already up to date with HEAD {head_sha}. Nothing to extract.")
+            rev_range = f"{head_sha}..{head_sha}"
+        else:
+            rev_range = incremental_rev_range(LOCAL_REPO_PATH, last_head, head_sha)
+            print(f"Incremental extraction of {rev_range}")
+
+        # Only the new commits go into the batch file; the gold sample is left as labelled.
+        # If history was rewritten (no '..' range) the old table cannot be appended to.
+        appending = ".." in rev_range
+        new_commits, _ = stream_commits_to_outputs(
+            iter_extracted_commits(commit_index, rev=rev_range), full_commit_set, FULL_COMMIT_JSONL,
+            append=appending, sinks=open_sinks(appending)
+        )
+        write_high_water_mark(HIGH_WATER_MARK_FILE, head_sha)
+        print(f"Added {new_commits} new commits to {full_commit_set}")
+
+    else:
+        # 6. Create JSONL files (and the commit table, if it does not exist yet)
+        if os.path.exists(full_commit_set):
+            total_commits = sum(1 for _ in iter_commit_table(full_commit_set))
+            records, table_path, sinks = iter_commit_table(full_commit_set), None, []
+            if WAREHOUSE_FORMAT == "parquet" and not os.path.exists(WAREHOUSE_DIR):
+                print(f"Note: no warehouse at {WAREHOUSE_DIR}. Run 'python commit_warehouse.py' to convert {full_commit_set}.")
+            if WRITE_DIFF_STORE and not os.path.exists(DIFF_STORE_DIR):
+                print(f"Note: no diff store at {DIFF_STORE_DIR}. Run 'python diff_store.py build' to index {full_commit_set}.")
+        else:
+            head_sha = resolve_head(LOCAL_REPO_PATH)
+            commit_index = load_commit_index(LOCAL_REPO_PATH, rev=head_sha)
+            total_commits = len(commit_index)
+            records, table_path = iter_extracted_commits(commit_index, rev=head_sha), full_commit_set
+            sinks = open_sinks(append=False)
+
+        sample_size = round(total_commits * GOLD_SAMPLE_FRACTION)
+        _, sampled_ids = stream_commits_to_outputs(
+            records, table_path, FULL_COMMIT_JSONL, sample_size=sample_size, sinks=sinks
+        )
+        if table_path is not None:
+            write_high_water_mark(HIGH_WATER_MARK_FILE, head_sha)
 
 
+        # create sample 
+        write_gold_sample(full_commit_set, sampled_ids, GOLD_STANDARD_CSV)
+        print(f"Successfully saved a sample of {len(sampled_ids)} commits to '{GOLD_STANDARD_CSV}'")
@@ -2,7 +2,9 @@ import os
 import json
 import pandas as pd
 from dotenv import load_dotenv
-from google.cloud import storage
+from storage_backends import get_backend, upload_many, STORAGE_BACKEND
+from prompt_builder import ALL_CATEGORIES, write_training_contents
+from jsonl_shards import read_manifest, manifest_path_for, shard_blob_names
 
 # --- Configuration ---
 load_dotenv()
@@ -18,9 +20,10 @@ FULL_COMMIT_JSONL = "full_commit_jsonl/FULL_commit_toclassify.jsonl"
 
 
 # --- ADD THIS VALIDATION BLOCK ---
-if not PROJECT_ID:
+# The local backend (STORAGE_BACKEND=local) only needs the bucket name and destinations.
+if not PROJECT_ID and STORAGE_BACKEND == "gcs":
     raise ValueError("FATAL: Environment variable PROJECT_ID is not set.")
-if not REGION:
+if not REGION and STORAGE_BACKEND == "gcs":
     raise ValueError("FATAL: Environment variable REGION is not set.")
 if not GCS_BUCKET_NAME:
     raise ValueError("FATAL: Environment variable GCS_BUCKET_NAME is not set.")
@@ -32,12 +35,6 @@ if not BLOB_BATCHING_TO_CLASSIFY_DESTINATION:
 # for use in my human in the loop classifcation
 
 # The "decoupled" prompt for the general model
-ALL_CATEGORIES = [
-    "Parser Logic", "Memory", "General Logic Error", "API Logic", "Security Vulnerability (CVE)",
-    "Integer", "Error Handling", "Concurrency", "Type System", "State Management", "Performance",
-    "Incorrect Output/Calculation", "Standard Library Misuse", "Build/CI/Tests", "Refactoring",
-    "Documentation", "Feature/Enhancement", "Non-Maintenance"
-]
 INSTRUCTION_PROMPT = (
     "You are a world-class software engineering analyst specializing in C code. "
     "Your primary evidence must be the code_diff. Analyze it to determine the bug's root cause. "
@@ -46,52 +43,42 @@ INSTRUCTION_PROMPT = (
 )
 
 
-def upload_to_gcs(project_id,bucket_name, source_file_name, destination_blob_name):
-    """Uploads a file to the bucket."""
-    storage_client = storage.Client(project_id)
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(source_file_name)
-    print(f"File {source_file_name} uploaded to gs://{bucket_name}/{destination_blob_name}")
-    return f"gs://{bucket_name}/{destination_blob_name}"
+def upload_to_gcs(backend, source_file_name, destination_blob_name):
+    """Uploads a file to the bucket, unless an identical copy is already there."""
+    summary = upload_many(backend, [(source_file_name, destination_blob_name)], max_workers=1)
+    if summary["failed"]:
+        raise IOError(f"Upload of {source_file_name} failed: {summary['failed'][destination_blob_name]}")
+    return backend.uri(destination_blob_name)
+
+def upload_shards_to_gcs(backend, manifest_path, destination_blob_name):
+    """
+    Uploads every shard listed in a jsonl_shards manifest (and the manifest
+    itself) next to destination_blob_name, several at a time. Shards whose
+    remote copy already matches the manifest md5 are skipped, so a re-run
+    after a partial failure only sends what is missing.
+    Returns the URIs of the uploaded shards.
+    """
+    manifest = read_manifest(manifest_path)
+    names = shard_blob_names(manifest, destination_blob_name)
+    files = [(shard["local_path"], name, shard["md5"]) for shard, name in zip(manifest["shards"], names)]
+    summary = upload_many(backend, files)
+    if summary["failed"]:
+        raise IOError(f"{len(summary['failed'])} shard upload(s) failed; re-run to upload the rest.")
+    # The manifest goes last so its presence means every shard is in place.
+    # It is named after the destination so consumers can find it from BLOB_BATCHING_TO_CLASSIFY_DESTINATION.
+    # Batch jobs (04_model_evaluation.py, job_orchestrator.py) take their input list from it.
+    upload_to_gcs(backend, manifest_path, manifest_path_for(destination_blob_name))
+    return [backend.uri(name) for name in names]
+
 
 def create_jsonl_from_df_training(df, output_filename):
     """Converts a DataFrame to a JSONL file in the required format."""
-    prompt_template = (
-       "You are a world-class software engineering analyst specializing in the libxml2 library. "
-            "Analyze the following commit message and code diff, then classify it. "
-            "Respond ONLY with a valid JSON object containing 'is_bug_fix', 'category', and 'reasoning'.\n\n"
-             f"AVAILABLE CATEGORIES:\n{json.dumps(ALL_CATEGORIES)}\n\n"
-            "--- COMMIT MESSAGE ---\n{commit_message}"
-            "--- CODE DIFF ---\n{diff_text}"
+    # One "contents" tuning example per row, mirroring the Gemini API
+    # 'GenerateContent' request format (see prompt_builder.py).
+    write_training_contents(
+        df, output_filename, message_col='message_x', category_col='category_v2_general_model',
+        reasoning_col='reasoning_v2', diff_col='diff'
     )
-    with open(output_filename, 'w') as f:
-        for index, row in df.iterrows():
-            commit_message = row['message_x']
-            diff_text = row['diff']
-            is_bug = bool(row['is_bug_fix'])
-            
-            # The structure for the fine-tuning job
-            assistant_output_dict = {
-                "is_bug_fix": is_bug,
-                "category": row['category_v2_general_model'],
-                "reasoning": row['reasoning_v2']
-            }
-            # This is the final structure for a single training example,
-            # mirroring the Gemini API 'GenerateContent' request format.
-            training_example = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [{"text": prompt_template.format(commit_message=commit_message,diff_text=diff_text)}]
-                    },
-                    {
-                        "role": "model",  # Use 'model' for the assistant's role
-                        "parts": [{"text": json.dumps(assistant_output_dict)}]
-                    }
-                ]
-            }
-            f.write(json.dumps(training_example) + "\n")
     print(f"Successfully created {output_filename}")
 
 
@@ -110,8 +97,19 @@ if __name__ == "__main__":
     
     #create_jsonl_from_df_training(df_gold_sample,OUTPUT_FOR_REVIEW_JSONL)
 
-    #upload_to_gcs(PROJECT_ID,GCS_BUCKET_NAME,OUTPUT_FOR_REVIEW_JSONL,BLOB_TRAINING_DESTINATION)
-    upload_to_gcs(PROJECT_ID,GCS_BUCKET_NAME,FULL_COMMIT_JSONL,BLOB_BATCHING_TO_CLASSIFY_DESTINATION)
+    # One backend (and so one storage client) serves every upload in this run.
+    backend = get_backend(PROJECT_ID, GCS_BUCKET_NAME)
+
+    #upload_to_gcs(backend,OUTPUT_FOR_REVIEW_JSONL,BLOB_TRAINING_DESTINATION)
+    # 01_data_prepare.py writes a manifest instead of one file when sharding is enabled.
+    shard_manifest = manifest_path_for(FULL_COMMIT_JSONL)
+    if os.path.exists(shard_manifest):
+        shard_uris = upload_shards_to_gcs(backend, shard_manifest, BLOB_BATCHING_TO_CLASSIFY_DESTINATION)
+        print(f"Batch prediction input: {len(shard_uris)} shard(s) listed in {backend.uri(manifest_path_for(BLOB_BATCHING_TO_CLASSIFY_DESTINATION))}")
+    else:
+        # A manifest from an earlier sharded upload would still point batch jobs at the old shards.
+        backend.delete(manifest_path_for(BLOB_BATCHING_TO_CLASSIFY_DESTINATION))
+        upload_to_gcs(backend,FULL_COMMIT_JSONL,BLOB_BATCHING_TO_CLASSIFY_DESTINATION)
     
     print("\n--- Success! ---")
     print(f"Created review file: {OUTPUT_FOR_REVIEW_JSONL}")
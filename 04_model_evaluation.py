@@ -2,6 +2,8 @@
 import os
 from google.cloud import aiplatform
 from dotenv import load_dotenv
+from storage_backends import get_backend
+from jsonl_shards import batch_source_uris
 
 load_dotenv()
 
@@ -17,7 +19,6 @@ TUNED_MODEL_ID = f"FINETUNED_RESOURCENAME/{CURRENT_LANGUAGE_REPO}" # This is the
 
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 BLOB_BATCHING_TO_CLASSIFY_DESTINATION = os.getenv("BLOB_BATCHING_TO_CLASSIFY_DESTINATION")
-FULL_COMMIT_DATA_RETRIEVAL_URI = f"gs://{GCS_BUCKET_NAME}/{BLOB_BATCHING_TO_CLASSIFY_DESTINATION}"
 FULL_COMMIT_DATA_RESULTS = os.getenv("BLOB_BATCHING_RESULTS")
 # The GCS path where you want the results to be saved
 GCS_OUTPUT_URI_PREFIX = f"gs://{GCS_BUCKET_NAME}/{FULL_COMMIT_DATA_RESULTS}"
@@ -34,12 +35,16 @@ def launch_batch_prediction_job():
         return
     model = aiplatform.Model(model_name=model_resource_name)
 
+    # The single uploaded file, or every shard listed in the uploaded manifest (JSONL_SHARD_MAX_LINES/MB).
+    source_uris = batch_source_uris(get_backend(PROJECT_ID, GCS_BUCKET_NAME, kind="gcs"), BLOB_BATCHING_TO_CLASSIFY_DESTINATION)
+    print(f"Batch input: {len(source_uris)} file(s), starting with {source_uris[0]}")
+
     print("Launching batch prediction job...")
     
     # Launch the job. This is the key function.
     batch_prediction_job = model.batch_predict(
         job_display_name="libxml2_full_classification",
-        gcs_source=FULL_COMMIT_DATA_RETRIEVAL_URI,
+        gcs_source=source_uris,
         gcs_destination_prefix=GCS_OUTPUT_URI_PREFIX,
         sync=False # Make it asynchronous
     )
@@ -1,10 +1,16 @@
 import os
 import json
+import shutil
 import pandas as pd
 from tqdm import tqdm
-from google.cloud import storage
 from dotenv import load_dotenv
-import re
+from commit_warehouse import write_classified, WAREHOUSE_DIR
+from result_cache import store_and_reattach, REQUEST_KEYS_CSV
+from storage_backends import backend_from_env, download_many, STORAGE_BACKEND, PARTIAL_SUFFIX, READ_BUFFER_SIZE
+from prediction_parser import parse_predictions
+from prediction_watcher import ShardIngestor, ledger_path_for
+from metadata_join import load_metadata_index
+from retry_queue import retry_until_converged, print_retry_summary
 
 # --- Configuration ---
 load_dotenv()
@@ -15,31 +21,71 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 # Make sure it ends with a slash '/'.
 GCS_RESULTS_PATH = os.getenv("BLOB_BATCHING_RESULTS") 
 LOCAL_DOWNLOAD_PATH = "CLASSIFED_FULL_JSONL/c_libxml2_batching_results_prediction-libxml2_classifier_with_diffs_v2-2025-11-04T04_15_46.422719Z_predictions.jsonl"
+RESULT_SHARDS_DIR = "CLASSIFED_FULL_JSONL/result_shards" # every downloaded shard; concatenated into LOCAL_DOWNLOAD_PATH
 CURRENT_LANGUAGE_REPO= os.getenv("CURRENT_LANGUAGE_REPO")
+WAREHOUSE_FORMAT = os.getenv("WAREHOUSE_FORMAT", "csv") # "parquet" also writes the classified output to the warehouse
+WATCH_RESULTS = os.getenv("WATCH_RESULTS") == "1" # ingest result shards while the batch job is still running
+RETRY_FAILED = os.getenv("RETRY_FAILED") == "1" # re-classify failed and missing commits afterwards (see retry_queue.py)
 
 # Input/Output for the final merge
 FULL_METADATA_CSV = "full_commit_with_author_data/full_commit_libxml2.csv"
 FINAL_CLASSIFIED_CSV = f"FINAL_CLASSIFIED_FULL_DATA/{CURRENT_LANGUAGE_REPO}/final_classified_commits_batch.csv"
+OUTPUT_FILE = 'FINAL_CLASSIFIED_FULL_DATA/c/fully_classified.csv'
 
-def download_batch_results():
-    """Downloads the prediction results from the correct GCS folder."""
-    storage_client = storage.Client(project=PROJECT_ID)
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+def download_batch_results(backend=None):
+    """
+    Downloads every prediction.results shard of the batch job from the results
+    folder (GCS or the local stand-in) in parallel and concatenates them, in
+    shard order, into LOCAL_DOWNLOAD_PATH.
+    """
+    backend = backend or backend_from_env()
     
-    print(f"Searching for results in: gs://{GCS_BUCKET_NAME}/{GCS_RESULTS_PATH}")
+    print(f"Searching for results in: {backend.uri(GCS_RESULTS_PATH)}")
     
-    # Batch jobs create a subfolder. We need to find the prediction file inside it.
-    blobs = list(bucket.list_blobs(prefix=GCS_RESULTS_PATH))
-    results_blob = next((blob for blob in blobs if "prediction.results" in blob.name and blob.name.endswith(".jsonl")), None)
+    # Batch jobs create a subfolder and write one or more shards into it.
+    objects = backend.list(GCS_RESULTS_PATH)
+    shards = [obj for obj in objects if "prediction.results" in obj["name"] and obj["name"].endswith(".jsonl")]
+
+    if not shards:
+        raise FileNotFoundError(f"Could not find a 'prediction.results...jsonl' file in {backend.uri(GCS_RESULTS_PATH)}. Please check the path and job status.")
+
+    job_folders = sorted({obj["name"].rsplit("/", 1)[0] for obj in shards})
+    if len(job_folders) > 1:
+        # Folder names end in the job's timestamp; mixing runs would duplicate commits.
+        print(f"Found results of {len(job_folders)} jobs; using the latest: {job_folders[-1]}")
+        shards = [obj for obj in shards if obj["name"].rsplit("/", 1)[0] == job_folders[-1]]
+
+    print(f"Found {len(shards)} result shard(s), {sum(obj['size'] for obj in shards) / 1e6:.1f} MB")
+    files = [(obj["name"], os.path.join(RESULT_SHARDS_DIR, os.path.basename(obj["name"]))) for obj in shards]
+    # Shards already on disk are skipped and interrupted ones resumed, so a re-run only fetches what is missing.
+    summary = download_many(backend, files)
+    if summary["failed"]:
+        raise IOError(f"{len(summary['failed'])} result shard(s) failed to download: {', '.join(sorted(summary['failed']))}")
+
+    print(f"Concatenating {len(files)} shard(s) into: {LOCAL_DOWNLOAD_PATH}")
+    os.makedirs(os.path.dirname(LOCAL_DOWNLOAD_PATH) or ".", exist_ok=True)
+    partial = LOCAL_DOWNLOAD_PATH + PARTIAL_SUFFIX
+    expected_bytes = sum(obj["size"] for obj in shards)
+    with open(partial, 'wb') as out:
+        for _, local_path in files:
+            with open(local_path, 'rb') as f:
+                shutil.copyfileobj(f, out, READ_BUFFER_SIZE)
+            if out.tell() and not _ends_with_newline(local_path):
+                out.write(b"\n")  # keep the last line of a shard apart from the next shard's first
+                expected_bytes += 1
+        if out.tell() != expected_bytes:
+            raise IOError(f"Concatenated results are {out.tell()} bytes, expected {expected_bytes}.")
+    os.replace(partial, LOCAL_DOWNLOAD_PATH)
+    print("  -> Download successful.")
 
-    if not results_blob:
-        raise FileNotFoundError(f"Could not find a 'prediction.results...jsonl' file in gs://{GCS_BUCKET_NAME}/{GCS_RESULTS_PATH}. Please check the path and job status.")
 
-    print(f"Found results file: {results_blob.name}")
-    print(f"Downloading to: {LOCAL_DOWNLOAD_PATH}")
-    os.makedirs(os.path.dirname(LOCAL_DOWNLOAD_PATH), exist_ok=True)
-    results_blob.download_to_filename(LOCAL_DOWNLOAD_PATH)
-    print("  -> Download successful.")
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
 
 
 def process_and_merge():
@@ -86,9 +132,9 @@ def process_and_merge():
     print("Merging predictions with full commit metadata...")
     predictions_df = pd.DataFrame(all_predictions)
     
-    metadata_df = pd.read_csv(FULL_METADATA_CSV)
-    
-    final_df = pd.merge(metadata_df, predictions_df, on='commit_hash', how='left')
+    # Every commit, with its metadata (all columns but the diff) and its prediction if there is one.
+    index = load_metadata_index(FULL_METADATA_CSV)
+    final_df = index.attach(predictions_df, 'commit_id', index.columns)
     
     final_df.to_csv(FINAL_CLASSIFIED_CSV, index=False)
     
@@ -96,107 +142,94 @@ def process_and_merge():
     print(f"Saved the final, complete, and classified dataset to: {FINAL_CLASSIFIED_CSV}")
 
 
+def parse_prediction_file(path=LOCAL_DOWNLOAD_PATH):
+    """
+    Parses a batch prediction results file into one record per line (see
+    prediction_parser.py). Returns (records DataFrame, error_summary), where
+    error_summary counts the failed lines by exception type.
+    """
+    print(f"Reading from: {path}")
+    return parse_predictions([path])
+
+
+def merge_results(prediction_files, output_file=OUTPUT_FILE, request_keys_path=REQUEST_KEYS_CSV):
+    """
+    Parses the prediction files, adds the results 01_data_prepare.py served
+    from the result cache instead of sending them (when its request key
+    sidecar exists) and saves the classified output. Returns
+    (processed_data, error_summary); job_orchestrator.py merges every
+    repository through here.
+    """
+    print(f"Reading from: {', '.join(prediction_files)}")
+    processed_data, error_summary = parse_predictions(prediction_files)
+
+    # --- Result cache: remember the new results and re-attach the cached ones ---
+    # 01_data_prepare.py (RESULT_CACHE=1) left already-classified commits out of the batch.
+    if os.path.exists(request_keys_path):
+        processed_data = store_and_reattach(processed_data, request_keys_path)
+
+    save_classified(processed_data, output_file)
+    return processed_data, error_summary
+
+
+def save_classified(processed_data, output_file=OUTPUT_FILE):
+    """Writes the classified records to CSV (and to the warehouse when WAREHOUSE_FORMAT=parquet)."""
+    output_dir = os.path.dirname(output_file)
+    if not os.path.exists(output_dir):
+        print(f"Creating output directory: {output_dir}")
+        os.makedirs(output_dir)
+    print(f"\nSaving {len(processed_data)} processed records to: {output_file}")
+    final_classified_data = pd.DataFrame(processed_data)  # records DataFrame or list of dicts
+    final_classified_data.to_csv(output_file,index=False)
+    if os.path.exists(ledger_path_for(output_file)):
+        os.remove(ledger_path_for(output_file))  # the file no longer matches what the shard watcher appended
+    if WAREHOUSE_FORMAT == "parquet":
+        write_classified(final_classified_data, WAREHOUSE_DIR)
+
+
+def print_summary(processed_data, error_summary):
+    successful_parses = len(processed_data) - sum(error_summary.values())
+    failed_parses = sum(error_summary.values())
+
+    print("\n====================")
+    print("Processing Complete.")
+    print(f"Successfully processed records: {successful_parses}")
+    print(f"Records with parsing errors: {failed_parses}")
+    print("\nError Summary:")
+    if not error_summary:
+        print("No errors found!")
+    else:
+        for error, count in sorted(error_summary.items()):
+            print(f"- {error}: {count} times")
+    print("====================")
+
+
 if __name__ == "__main__":
-    if not all([PROJECT_ID, GCS_BUCKET_NAME, os.getenv('BLOB_BATCHING_RESULTS')]):
+    # The local backend (STORAGE_BACKEND=local) does not need a project.
+    if not all([PROJECT_ID or STORAGE_BACKEND == "local", GCS_BUCKET_NAME, os.getenv('BLOB_BATCHING_RESULTS')]):
          raise ValueError("FATAL: One or more required environment variables are not set.")
     
-    #download_batch_results()
-    #process_and_merge()
-    successful_parses = 0
-    failed_parses = 0
-    error_summary = {}
-
-OUTPUT_FILE = 'FINAL_CLASSIFIED_FULL_DATA/c/fully_classified.csv'
-output_dir = os.path.dirname(OUTPUT_FILE)
-if not os.path.exists(output_dir):
-    print(f"Creating output directory: {output_dir}")
-    os.makedirs(output_dir)
-processed_data = []
-error_summary = {}
-
-print(f"Reading from: {LOCAL_DOWNLOAD_PATH}")
-
-with open(LOCAL_DOWNLOAD_PATH, 'r') as f:
-    lines = list(f)
-    for i, line in enumerate(tqdm(lines, desc="Processing Lines")):
-        
-        # --- Initialize a dictionary with default/empty values ---
-        # This ensures all our records have the same keys
-        record = {
-            'original_line_num': i + 1,
-            'key': None,
-            'request_text': None,
-            'is_bug_fix': None,
-            'category': None,
-            'reasoning': None,
-            'parsing_error_type': None,
-            'parsing_error_payload': None,
-        }
-
-        try:
-            # 1. Parse the main JSONL line
-            data = json.loads(line)
-            
-            # --- Populate the keys we know should exist ---
-            record['key'] = data.get('key')
-            if 'request' in data and 'contents' in data['request'] and data['request']['contents']:
-                record['request_text'] = data['request']['contents'][0]['parts'][0].get('text')
-
-            # 2. Safely access and parse the nested text
-            if 'response' in data and 'candidates' in data['response'] and data['response']['candidates']:
-                raw_text = data['response']['candidates'][0]['content']['parts'][0]['text']
-                
-                match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                if not match:
-                    raise ValueError("Could not find a JSON object within the text.")
-                
-                json_string = match.group(0)
-                parsed_text = json.loads(json_string, strict=False)
-                
-                # --- Populate the successfully parsed data ---
-                record['is_bug_fix'] = parsed_text.get('is_bug_fix')
-                record['category'] = parsed_text.get('category')
-                record['reasoning'] = parsed_text.get('reasoning')
-
-            else:
-                # This handles cases where the 'response' or 'candidates' keys are missing
-                raise KeyError("Path to 'response' or 'candidates' not found.")
-
-        except Exception as e:
-            # --- If anything fails, log the error and save the raw text ---
-            error_type = type(e).__name__
-            record['parsing_error_type'] = error_type
-            
-            # Try to get the problematic text if it exists, otherwise store the whole line
-            try:
-                record['parsing_error_payload'] = data['response']['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError, NameError):
-                record['parsing_error_payload'] = line.strip()
-
-            error_summary[error_type] = error_summary.get(error_type, 0) + 1
-        
-        # --- Add the fully populated record to our results ---
-        processed_data.append(record)
-
-
-# --- Save the results to a new JSONL file ---
-print(f"\nSaving {len(processed_data)} processed records to: {OUTPUT_FILE}")
-final_classified_data = pd.DataFrame(processed_data)
-final_classified_data.to_csv(OUTPUT_FILE,index=False)
-
-
-# --- Final Summary ---
-successful_parses = len(processed_data) - sum(error_summary.values())
-failed_parses = sum(error_summary.values())
-
-print("\n====================")
-print("Processing Complete.")
-print(f"Successfully processed records: {successful_parses}")
-print(f"Records with parsing errors: {failed_parses}")
-print("\nError Summary:")
-if not error_summary:
-    print("No errors found!")
-else:
-    for error, count in sorted(error_summary.items()):
-        print(f"- {error}: {count} times")
-print("====================")
\ No newline at end of file
+    if WATCH_RESULTS:
+        # Shards are appended to OUTPUT_FILE as they land; see prediction_watcher.py.
+        # The watch ends once every prediction.results-*-of-NNNNN shard is in the ledger.
+        ingestor = ShardIngestor(OUTPUT_FILE)
+        totals = ingestor.watch(GCS_RESULTS_PATH, is_done=ingestor.complete)
+        processed_data, error_summary = pd.read_csv(OUTPUT_FILE), totals["errors"]
+        if os.path.exists(REQUEST_KEYS_CSV):
+            combined = store_and_reattach(processed_data, REQUEST_KEYS_CSV)
+            if len(combined) > len(processed_data):
+                ingestor.append_rows(combined.iloc[len(processed_data):], f"result_cache:{len(ingestor.ledger['shards'])}")
+            processed_data = combined
+        if WAREHOUSE_FORMAT == "parquet":
+            write_classified(processed_data, WAREHOUSE_DIR)
+    else:
+        if not os.path.exists(LOCAL_DOWNLOAD_PATH):
+            download_batch_results()
+        #process_and_merge()
+        processed_data, error_summary = merge_results([LOCAL_DOWNLOAD_PATH])
+
+    print_summary(processed_data, error_summary)
+
+    if RETRY_FAILED:
+        # Only the failed and missing commits are sent again; OUTPUT_FILE is patched in place.
+        print_retry_summary(retry_until_converged(OUTPUT_FILE, FULL_METADATA_CSV))
@@ -1,115 +1,75 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
 import os
+from commit_warehouse import WAREHOUSE_DIR
+from diff_features import load_diff_features, extension_mask, lines_changed, DIFF_FEATURES_PATH
+from commit_cube import update_from_csv, update_from_warehouse, period_view
+from chart_renderer import distribution_jobs, render_charts, print_render_summary
 
 # --- 1. Configuration: Update these file paths ---
 CLASSIFIED_DATA_PATH = 'FINAL_CLASSIFIED_FULL_DATA/c/fully_classified.csv'
 # Replace with the actual path to your full commit data CSV
 FULL_COMMIT_DATA_PATH = 'full_commit_with_author_data/full_commit_libxml2.csv' 
 OUTPUT_DIR = 'visualizations'
+# "parquet" reads from the columnar warehouse instead of the CSVs.
+WAREHOUSE_FORMAT = os.getenv("WAREHOUSE_FORMAT", "csv")
+# Optional year range (inclusive) of the charts.
+START_YEAR = os.getenv("START_YEAR")
+END_YEAR = os.getenv("END_YEAR")
+YEARS = range(int(START_YEAR), int(END_YEAR) + 1) if START_YEAR and END_YEAR else None
+# Optional diff-size / file-type filters, applied with the precomputed diff
+# features (diff_features.py) instead of scanning the diff text.
+MAX_LINES_CHANGED = int(os.getenv("MAX_LINES_CHANGED", "0"))  # 0 = no limit
+TOUCHES_EXTENSIONS = [ext for ext in os.getenv("TOUCHES_EXTENSIONS", "").split(",") if ext]  # e.g. ".c,.h"
 
 # --- Create output directory if it doesn't exist ---
 if not os.path.exists(OUTPUT_DIR):
     print(f"Creating output directory: {OUTPUT_DIR}")
     os.makedirs(OUTPUT_DIR)
 
-# --- 2. Load the Datasets ---
+# --- 2. Load the Commit Cube ---
+# Counts per (day, category, is_bug_fix, author) kept by commit_cube.py; it only
+# catches up with classified commits that are new or changed since the last run.
 print("Loading data...")
 try:
-    classified_df = pd.read_csv(CLASSIFIED_DATA_PATH)
-    commits_df = pd.read_csv(FULL_COMMIT_DATA_PATH)
+    if WAREHOUSE_FORMAT == "parquet":
+        cube = update_from_warehouse(WAREHOUSE_DIR)
+    else:
+        cube = update_from_csv(CLASSIFIED_DATA_PATH, FULL_COMMIT_DATA_PATH)
     print("Data loaded successfully.")
 except FileNotFoundError as e:
     print(f"Error loading files: {e}")
     print("Please make sure the file paths in the 'Configuration' section are correct.")
     exit()
 
-# --- 3. Prepare and Merge the Data ---
-print("Preparing and merging datasets...")
-classified_df.rename(columns={'key': 'commit_id'}, inplace=True)
-merged_df = pd.merge(commits_df, classified_df, on='commit_id', how='left')
+cells = cube.cells
+if MAX_LINES_CHANGED or TOUCHES_EXTENSIONS:
+    features = load_diff_features(DIFF_FEATURES_PATH)
+    keep = np.ones(len(features['commit_id']), dtype=bool)
+    if MAX_LINES_CHANGED:
+        keep &= lines_changed(features) <= MAX_LINES_CHANGED
+    if TOUCHES_EXTENSIONS:
+        keep &= extension_mask(features, TOUCHES_EXTENSIONS)
+    cells = cube.filtered(features['commit_id'][keep])
+    print(f"Diff feature filters kept {keep.sum()} of {len(keep)} commits.")
+print(f"Classified commits with a date: {cells['commits'].sum()} in {len(cells)} cube cells.")
 
-# --- 4. Select and Clean the Final Columns ---
-final_df = merged_df[['is_bug_fix', 'category', 'authored_datetime']].copy()
-final_df.dropna(subset=['category', 'authored_datetime'], inplace=True)
-print(f"Merge complete. Shape of the final cleaned data: {final_df.shape}")
 
-
-# --- 5. Create Yearly Time Steps ---
-print("Creating yearly time steps...")
-final_df['authored_datetime'] = pd.to_datetime(final_df['authored_datetime'], errors='coerce', utc=True)
-final_df.dropna(subset=['authored_datetime'], inplace=True)
-
-# <-- THIS IS THE PRIMARY CHANGE HERE
-final_df['year'] = final_df['authored_datetime'].dt.to_period('Y').astype(str)
-
-
-# --- 6. Prepare Data for Stacked Bar Chart ---
+# --- 3. Prepare Data for Stacked Bar Chart ---
 print("Reshaping data for visualization...")
 
-top_categories = final_df['category'].value_counts().nlargest(10).index
-final_df['category_plot'] = final_df['category'].apply(lambda x: x if x in top_categories else 'Other')
-
-# <-- UPDATED TO GROUP BY 'year'
-pivot_df = final_df.groupby(['year', 'category_plot']).size().unstack(fill_value=0)
-
-if 'Other' in pivot_df.columns:
-    pivot_df = pivot_df[[col for col in pivot_df.columns if col != 'Other'] + ['Other']]
+# Year x category counts with the 10 largest categories; the rest are 'Other'.
+pivot_df = period_view(cells, 'Y', top_n=10, years=YEARS)
 
 print("Data successfully pivoted. Preview:")
 print(pivot_df.tail())
 
 
-# --- 7. Plot 1: Standard Stacked Bar Chart (Counts) ---
-print("\nGenerating standard stacked bar chart...")
-fig, ax = plt.subplots(figsize=(20, 10))
-pivot_df.plot(
-    kind='bar', 
-    stacked=True, 
-    ax=ax,
-    colormap='viridis'
-)
-
-# <-- UPDATED TITLES AND LABELS
-ax.set_title('Yearly Distribution of Commit Categories', fontsize=18)
-ax.set_xlabel('Year', fontsize=14)
-ax.set_ylabel('Number of Commits', fontsize=14)
-ax.tick_params(axis='x', rotation=45, labelsize=12) # Increased label size for readability
-ax.grid(axis='y', linestyle='--', alpha=0.7)
-ax.legend(title='Category', bbox_to_anchor=(1.02, 1), loc='upper left')
-
-plt.tight_layout()
-# <-- UPDATED FILENAME
-plt.savefig(os.path.join(OUTPUT_DIR, 'yearly_commit_distribution_counts.png'))
-plt.close()
-print("Saved: yearly_commit_distribution_counts.png")
-
-
-# --- 8. Plot 2: 100% Stacked Bar Chart (Proportions) ---
-print("\nGenerating 100% stacked bar chart...")
-pivot_normalized_df = pivot_df.div(pivot_df.sum(axis=1), axis=0) * 100
-
-fig, ax = plt.subplots(figsize=(20, 10))
-pivot_normalized_df.plot(
-    kind='bar', 
-    stacked=True, 
-    ax=ax,
-    colormap='viridis'
-)
-
-# <-- UPDATED TITLES AND LABELS
-ax.set_title('Yearly Proportion of Commit Categories', fontsize=18)
-ax.set_xlabel('Year', fontsize=14)
-ax.set_ylabel('Percentage of Commits (%)', fontsize=14)
-ax.tick_params(axis='x', rotation=45, labelsize=12)
-ax.legend(title='Category', bbox_to_anchor=(1.02, 1), loc='upper left')
-
-plt.tight_layout()
-# <-- UPDATED FILENAME
-plt.savefig(os.path.join(OUTPUT_DIR, 'yearly_commit_distribution_proportions.png'))
-plt.close()
-print("Saved: yearly_commit_distribution_proportions.png")
+# --- 4. Render Charts ---
+# Yearly/quarterly summaries plus one chart per month and quarter, drawn in
+# parallel by chart_renderer.py; charts whose data has not changed since the
+# last run are skipped.
+print("\nRendering charts...")
+print_render_summary(render_charts(distribution_jobs(cells, years=YEARS), OUTPUT_DIR))
 
 
 print("\nAll visualizations have been saved to the 'visualizations' directory.")
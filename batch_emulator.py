@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import random
+import hashlib
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from prompt_builder import ALL_CATEGORIES
+from jsonl_check import plan_chunks, read_chunk, input_files
+from storage_backends import backend_from_env
+
+try:
+    import orjson
+    _loads, _dumps = orjson.loads, orjson.dumps
+except ImportError:
+    import json
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj).encode('utf-8')
+
+# --- Local batch prediction emulator ---
+# Stands in for a Vertex AI batch prediction job. It reads the same
+# {"request": ..., "key": ...} JSONL that 01_data_prepare.py writes (a single
+# file, .gz shards, or a jsonl_shards manifest) and writes
+#
+#   <output_prefix>prediction.results-00000-of-000NN.jsonl
+#
+# through a storage backend. Each output line has the layout that
+# 05_data_merge_analysis.py parses: key, request, status, processed_time and
+# response.candidates[0].content.parts[0].text.
+#
+# Answers are a pure function of (EMULATOR_SEED, key), and the failure draws
+# are seeded per shard, so reruns over the same input give the same results.
+# The failure model is applied per request:
+#   EMULATOR_MALFORMED_RATE  the answer text is truncated, invalid JSON
+#   EMULATOR_ERROR_RATE      no response at all, only an error status
+#   EMULATOR_DROP_RATE       the request is missing from the output
+#   EMULATOR_FENCED_RATE     the valid answer is wrapped in a ```json fence
+#
+# Latency: every request draws an exponential latency with mean
+# EMULATOR_MEAN_LATENCY_MS, and EMULATOR_CONCURRENCY requests are served at
+# once across the whole job. The resulting job time is reported. With
+# EMULATOR_TIME_SCALE > 0 (1 = real time) shard i is published once the
+# scaled service time of shards 0..i has elapsed since the job started, so
+# shards appear one by one and the job takes its modelled time however many
+# emulator workers there are. With 0 every shard is written as soon as it is
+# ready.
+MEAN_LATENCY_MS = float(os.getenv("EMULATOR_MEAN_LATENCY_MS", "800"))
+SERVICE_CONCURRENCY = int(os.getenv("EMULATOR_CONCURRENCY", "64"))
+TIME_SCALE = float(os.getenv("EMULATOR_TIME_SCALE", "0"))
+MALFORMED_RATE = float(os.getenv("EMULATOR_MALFORMED_RATE", "0.01"))
+ERROR_RATE = float(os.getenv("EMULATOR_ERROR_RATE", "0.005"))
+DROP_RATE = float(os.getenv("EMULATOR_DROP_RATE", "0"))
+FENCED_RATE = float(os.getenv("EMULATOR_FENCED_RATE", "0.5"))
+SEED = os.getenv("EMULATOR_SEED", "0")
+NUM_WORKERS = int(os.getenv("EMULATOR_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_BYTES = 32 * 1024 * 1024  # one output shard per input chunk
+MODEL_VERSION = "emulated-batch-prediction"
+NON_BUG_CATEGORIES = {"Build/CI/Tests", "Refactoring", "Documentation", "Feature/Enhancement", "Non-Maintenance"}
+
+
+def results_name(output_prefix, shard_index, shard_count):
+    return f"{output_prefix}prediction.results-{shard_index:05d}-of-{shard_count:05d}.jsonl"
+
+
+def emulated_answer(key):
+    """The model's JSON answer for one commit, a pure function of the key."""
+    digest = hashlib.sha1(f"{SEED}:{key}".encode('utf-8')).digest()
+    category = ALL_CATEGORIES[digest[0] % len(ALL_CATEGORIES)]
+    return _dumps({
+        "is_bug_fix": category not in NON_BUG_CATEGORIES,
+        "category": category,
+        "reasoning": f"Emulated classification of {key[:12]}.",
+    }).decode('utf-8')
+
+
+def emulate_line(line, rng, processed_time):
+    """Returns (output line bytes or None when dropped, outcome)."""
+    data = _loads(line)
+    key = data.get("key")
+    record = {"key": key, "request": data.get("request"), "status": "", "processed_time": processed_time}
+    draw = rng.random()
+    if draw < DROP_RATE:
+        return None, "dropped"
+    draw -= DROP_RATE
+    if draw < ERROR_RATE:
+        record["status"] = "Bad Request: emulated prediction failure"
+        return _dumps(record) + b"\n", "error"
+    draw -= ERROR_RATE
+
+    text = emulated_answer(key)
+    if draw < MALFORMED_RATE:
+        text, outcome = text[:rng.randint(1, len(text) - 2)], "malformed"  # cut off mid-object
+    elif rng.random() < FENCED_RATE:
+        text, outcome = f"```json\n{text}\n```", "ok"
+    else:
+        outcome = "ok"
+    record["response"] = {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "modelVersion": MODEL_VERSION,
+    }
+    return _dumps(record) + b"\n", outcome
+
+
+def _emulate_chunk(task):
+    """
+    Worker: turns one input chunk into one output shard. Publishes it, or
+    with publish=False returns its bytes for the driver to publish on time.
+    """
+    backend, chunk, name, shard_index, job_start, publish = task
+    rng = random.Random(f"{SEED}:{shard_index}")
+    counts = {"ok": 0, "malformed": 0, "error": 0, "dropped": 0}
+    service_seconds = 0.0
+    output = bytearray()
+    for line in read_chunk(*chunk).split(b"\n"):
+        if not line.strip():
+            continue
+        latency = rng.expovariate(1000.0 / MEAN_LATENCY_MS) if MEAN_LATENCY_MS > 0 else 0.0
+        service_seconds += latency
+        finished = job_start + timedelta(seconds=service_seconds / SERVICE_CONCURRENCY)
+        out_line, outcome = emulate_line(line, rng, finished.isoformat())
+        counts[outcome] += 1
+        if out_line is not None:
+            output += out_line
+    if not publish:
+        return counts, service_seconds, bytes(output)
+    with backend.open_write(name) as f:
+        f.write(bytes(output))
+    return counts, service_seconds, None
+
+
+def run_emulator(input_path, output_prefix, backend=None, num_workers=NUM_WORKERS):
+    """
+    Emulates a batch prediction job over input_path (file, shard manifest or
+    a list of files), writing the result shards under output_prefix. Returns
+    the outcome counts.
+    """
+    backend = backend or backend_from_env()
+    if output_prefix and not output_prefix.endswith("/"):
+        output_prefix += "/"
+    input_paths = [input_path] if isinstance(input_path, str) else input_path
+    chunks = [chunk for source in input_paths for path in input_files(source) for chunk in plan_chunks(path, CHUNK_BYTES)]
+    job_start = datetime.now(timezone.utc)
+    timed = TIME_SCALE > 0
+    tasks = [(backend, chunk, results_name(output_prefix, i, len(chunks)), i, job_start, not timed)
+             for i, chunk in enumerate(chunks)]
+    print(f"Emulating batch prediction: {len(chunks)} shard(s) -> {backend.uri(output_prefix)}")
+
+    start = time.perf_counter()
+    totals = {"ok": 0, "malformed": 0, "error": 0, "dropped": 0}
+    service_seconds = 0.0
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for task, (counts, seconds, output) in zip(tasks, pool.map(_emulate_chunk, tasks)):
+            for outcome, count in counts.items():
+                totals[outcome] += count
+            service_seconds += seconds
+            if output is not None:
+                # The shards share the job's concurrency, so this one is done
+                # when the service time of every shard up to it is worked off.
+                delay = start + service_seconds / SERVICE_CONCURRENCY * TIME_SCALE - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                with backend.open_write(task[2]) as f:
+                    f.write(output)
+    elapsed = time.perf_counter() - start
+
+    requests = sum(totals.values())
+    print(f"Emulated {requests} requests in {elapsed:.2f}s ({requests / max(elapsed, 1e-9):.0f} requests/s).")
+    print(f"Modelled job time at concurrency {SERVICE_CONCURRENCY}: {service_seconds / SERVICE_CONCURRENCY:.1f}s")
+    print("Outcomes: " + ", ".join(f"{outcome} {count}" for outcome, count in totals.items()))
+    return totals
+
+
+if __name__ == "__main__":
+    # Usage: python batch_emulator.py <requests.jsonl | shards.manifest.json> <output prefix>
+    # The output goes through STORAGE_BACKEND (set STORAGE_BACKEND=local for a directory).
+    if len(sys.argv) != 3:
+        exit("Usage: python batch_emulator.py <requests.jsonl | shards.manifest.json> <output prefix>")
+    run_emulator(sys.argv[1], sys.argv[2])
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import hashlib
+import resource
+from multiprocessing import Process, Queue
+from commit_extraction import iter_commit_records
+from git_log_engine import iter_commit_records_git_log
+
+# --- Configuration ---
+# Benchmarks the GitPython extraction path against the streaming `git log -p`
+# engine on the same repository. Each engine runs in its own process so the
+# peak RSS numbers are not polluted by the other run.
+LOCAL_REPO_PATH = os.getenv("BENCH_REPO_PATH", "./repos/c/libxml2")
+ENGINES = {
+    "gitpython": iter_commit_records,
+    "gitlog": iter_commit_records_git_log,
+}
+
+
+def _run_engine(engine_name, repo_path, results):
+    start = time.perf_counter()
+    commits = 0
+    diff_bytes = 0
+    checksum = hashlib.sha256()
+    for record in ENGINES[engine_name](repo_path):
+        commits += 1
+        diff_bytes += len(record["diff"])
+        for field in ("commit_id", "message", "diff", "author_name"):
+            checksum.update(record[field].encode('utf-8', errors='replace'))
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    results.put((engine_name, commits, diff_bytes, checksum.hexdigest(), elapsed, peak_rss_mb))
+
+
+def run_benchmark(repo_path):
+    """Runs every engine once and prints time, throughput and peak RSS."""
+    results = Queue()
+    rows = []
+    for engine_name in ENGINES:
+        print(f"Running '{engine_name}' engine on {repo_path}...")
+        proc = Process(target=_run_engine, args=(engine_name, repo_path, results))
+        proc.start()
+        rows.append(results.get())
+        proc.join()
+
+    print("\n--- Extraction Engine Benchmark ---")
+    print(f"{'engine':<10} {'commits':>8} {'diff MB':>9} {'seconds':>9} {'commits/s':>10} {'peak RSS MB':>12}")
+    for engine_name, commits, diff_bytes, _, elapsed, peak_rss_mb in rows:
+        print(f"{engine_name:<10} {commits:>8} {diff_bytes / 1e6:>9.1f} {elapsed:>9.2f} "
+              f"{commits / elapsed:>10.1f} {peak_rss_mb:>12.1f}")
+
+    baseline, candidate = rows[0], rows[1]
+    print(f"\nSpeedup of '{candidate[0]}' over '{baseline[0]}': {baseline[4] / candidate[4]:.1f}x")
+    if baseline[3] != candidate[3]:
+        print("Warning: the engines produced different records for this repository.")
+    else:
+        print("Both engines produced identical records.")
+
+
+if __name__ == "__main__":
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else LOCAL_REPO_PATH)
@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import pandas as pd
+import prompt_builder
+from prompt_builder import ALL_CATEGORIES, write_batch_requests, write_training_contents
+
+# --- Configuration ---
+# Rows/second for building the batch-request JSONL (and the diff-prompt
+# training format) from the full commit table: the old per-row
+# iterrows() + json.dumps(dict) writer against prompt_builder.py with the
+# stdlib encoder and with orjson. Output goes to a scratch file so disk
+# writes are part of the measurement.
+FULL_COMMIT_DATA_PATH = "full_commit_with_author_data/full_commit_libxml2.csv"
+
+
+def _legacy_batch_requests(df, output_filename):
+    with open(output_filename, 'w') as f:
+        for index, row in df.iterrows():
+            prompt_template = (
+                "You are a world-class software engineering analyst specializing in the libxml2 library. "
+                "Analyze the following commit message and code diff, then classify it. "
+                "Respond ONLY with a valid JSON object containing 'is_bug_fix', 'category', and 'reasoning'.\n\n"
+                f"AVAILABLE CATEGORIES:\n{json.dumps(ALL_CATEGORIES)}\n\n"
+                f"--- COMMIT MESSAGE ---\n{row['message']}"
+                f"--- CODE DIFF ---\n{row['diff']}"
+            )
+            line = {"request": {"contents": [{"role": "user", "parts": [{"text": prompt_template}]}]}, "key": row['commit_id']}
+            f.write(json.dumps(line) + "\n")
+
+
+def _training_contents(df, output_filename):
+    labelled = df.assign(is_bug_fix=True, category="Memory", reasoning="Benchmark label.")
+    write_training_contents(labelled, output_filename, diff_col='diff')
+
+
+def _time_writer(name, writer, df, output_filename, use_orjson=True):
+    saved_orjson = prompt_builder.orjson
+    if not use_orjson:
+        prompt_builder.orjson = None
+    try:
+        start = time.perf_counter()
+        writer(df, output_filename)
+        elapsed = time.perf_counter() - start
+    finally:
+        prompt_builder.orjson = saved_orjson
+    size_mb = os.path.getsize(output_filename) / 1e6
+    return name, elapsed, size_mb
+
+
+if __name__ == "__main__":
+    table_path = sys.argv[1] if len(sys.argv) > 1 else FULL_COMMIT_DATA_PATH
+    if not os.path.exists(table_path):
+        exit(f"Error: commit table not found at '{table_path}'. Run 01_data_prepare.py first.")
+
+    print(f"Loading {table_path}...")
+    df = pd.read_csv(table_path, usecols=['commit_id', 'message', 'diff'], keep_default_na=False)
+    print(f"Loaded {len(df)} commits.")
+
+    runs = [
+        ("legacy iterrows + json.dumps", _legacy_batch_requests, True),
+        ("prompt_builder (stdlib json)", write_batch_requests, False),
+    ]
+    if prompt_builder.orjson is not None:
+        runs.append(("prompt_builder (orjson)", write_batch_requests, True))
+        runs.append(("training contents (orjson)", _training_contents, True))
+    else:
+        print("Note: orjson is not installed; only the stdlib encoder is measured.")
+        runs.append(("training contents (stdlib)", _training_contents, False))
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        output_filename = os.path.join(scratch, "bench.jsonl")
+        for name, writer, use_orjson in runs:
+            print(f"Running: {name}...")
+            results.append(_time_writer(name, writer, df, output_filename, use_orjson))
+
+    print("\n--- Prompt/JSONL Builder Benchmark ---")
+    print(f"{'writer':<32} {'seconds':>9} {'rows/s':>10} {'MB/s':>8}")
+    for name, elapsed, size_mb in results:
+        print(f"{name:<32} {elapsed:>9.3f} {len(df) / elapsed:>10.0f} {size_mb / elapsed:>8.1f}")
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import resource
+from multiprocessing import Process, Queue
+import pandas as pd
+from commit_warehouse import read_commits, WAREHOUSE_DIR
+
+# --- Configuration ---
+# Compares what 06_data_analysis.py pays to get commit dates out of the CSV
+# commit table against the Parquet warehouse. Every loader runs in a fresh
+# process so peak RSS is measured in isolation; "baseline" is the cost of the
+# interpreter and imports alone.
+FULL_COMMIT_DATA_PATH = "full_commit_with_author_data/full_commit_libxml2.csv"
+BENCH_YEAR = os.getenv("BENCH_YEAR")  # optional single year for the partition-skipping case
+
+
+def _load_baseline():
+    return 0
+
+
+def _load_csv_full():
+    return len(pd.read_csv(FULL_COMMIT_DATA_PATH))
+
+
+def _load_csv_usecols():
+    return len(pd.read_csv(FULL_COMMIT_DATA_PATH, usecols=['commit_id', 'authored_datetime']))
+
+
+def _load_parquet_projected():
+    return len(read_commits(WAREHOUSE_DIR, columns=['commit_id', 'authored_datetime']))
+
+
+def _load_parquet_one_year():
+    return len(read_commits(WAREHOUSE_DIR, columns=['commit_id', 'authored_datetime'], years=[int(BENCH_YEAR)]))
+
+
+LOADERS = {
+    "baseline": _load_baseline,
+    "csv (full table)": _load_csv_full,
+    "csv (usecols)": _load_csv_usecols,
+    "parquet (projected)": _load_parquet_projected,
+}
+if BENCH_YEAR:
+    LOADERS[f"parquet (year={BENCH_YEAR})"] = _load_parquet_one_year
+
+
+def _run_loader(name, results):
+    start = time.perf_counter()
+    rows = LOADERS[name]()
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+    results.put((name, rows, elapsed, peak_rss_mb))
+
+
+if __name__ == "__main__":
+    if not os.path.exists(WAREHOUSE_DIR):
+        exit(f"Error: no warehouse at '{WAREHOUSE_DIR}'. Run 'python commit_warehouse.py' first.")
+
+    results = Queue()
+    rows = []
+    for name in LOADERS:
+        print(f"Running loader: {name}...")
+        proc = Process(target=_run_loader, args=(name, results))
+        proc.start()
+        rows.append(results.get())
+        proc.join()
+
+    print("\n--- Commit Table Load Benchmark ---")
+    print(f"{'loader':<24} {'rows':>9} {'seconds':>9} {'peak RSS MB':>12}")
+    for name, row_count, elapsed, peak_rss_mb in rows:
+        print(f"{name:<24} {row_count:>9} {elapsed:>9.3f} {peak_rss_mb:>12.1f}")
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # no GUI backend: workers only ever write PNGs
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from commit_cube import CommitCube, day_category_counts, period_view
+
+# --- Incremental chart rendering ---
+# Each chart is a job: output file name, chart spec (kind, titles) and the
+# small aggregate it draws, taken from the commit cube. A job's hash covers
+# its spec, its data and RENDER_VERSION. render_charts() compares it with the
+# manifest in the output directory (file name -> hash of the last render) and
+# only draws charts that are new, changed or missing on disk. Adding a month
+# of data changes that month's chart, its quarter's chart and the summary
+# charts; every other monthly/quarterly chart is skipped.
+#
+# Charts are drawn in a process pool on the Agg backend. Figures are created
+# through matplotlib.figure.Figure, not pyplot, so no global figure state is
+# involved. Each worker keeps one figure and axes per figure size and clears
+# them between charts instead of building a new figure every time.
+#
+# Bump RENDER_VERSION whenever the drawing code changes, so every chart is
+# rendered again.
+RENDER_VERSION = "1"
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+MANIFEST_NAME = "render_manifest.json"
+SUMMARY_FIGSIZE = (20, 10)
+PERIOD_FIGSIZE = (12, 8)
+
+
+def chart_hash(job):
+    """Hash of everything that decides how a chart looks."""
+    digest = hashlib.sha256()
+    digest.update(RENDER_VERSION.encode())
+    digest.update(json.dumps(job["spec"], sort_keys=True).encode())
+    data = job["data"]
+    digest.update(json.dumps([str(data.index.name)] + [str(value) for value in data.index]).encode())
+    if isinstance(data, pd.DataFrame):
+        digest.update(json.dumps([str(column) for column in data.columns]).encode())
+    digest.update(np.ascontiguousarray(data.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def distribution_jobs(cells, years=None, top_n=10):
+    """
+    Jobs for the standard distribution charts: yearly and quarterly stacked
+    bars (counts and proportions) plus one bar chart per month and quarter.
+    """
+    jobs = []
+    for freq, label in (("Y", "Year"), ("Q", "Quarter")):
+        pivot = period_view(cells, freq, top_n=top_n, years=years)
+        name = {"Y": "yearly", "Q": "quarterly"}[freq]
+        adjective = {"Y": "Yearly", "Q": "Quarterly"}[freq]
+        xlabel = label if freq == "Y" else "Quarterly Time Step"
+        jobs.append({"file": f"{name}_commit_distribution_counts.png", "data": pivot, "spec": {
+            "kind": "stacked", "title": f"{adjective} Distribution of Commit Categories",
+            "xlabel": xlabel, "ylabel": "Number of Commits", "grid": True}})
+        jobs.append({"file": f"{name}_commit_distribution_proportions.png",
+                     "data": pivot.div(pivot.sum(axis=1), axis=0) * 100, "spec": {
+            "kind": "stacked", "title": f"{adjective} Proportion of Commit Categories",
+            "xlabel": xlabel, "ylabel": "Percentage of Commits (%)", "grid": False}})
+
+    # One chart per month / quarter with every category that occurs in it.
+    matrix = day_category_counts(cells, years)
+    for freq, prefix, adjective in (("M", "monthly", "Monthly"), ("Q", "quarterly", "Quarterly")):
+        periods = matrix.groupby(matrix.index.to_period(freq).astype(str)).sum()
+        for period, counts in periods.iterrows():
+            counts = counts[counts > 0].sort_values(ascending=False, kind="stable")
+            if counts.empty:
+                continue
+            counts.index.name = "category"
+            jobs.append({"file": f"{prefix}_distribution_{period}.png", "data": counts, "spec": {
+                "kind": "period_bars", "title": f"{adjective} Distribution of Commit Categories for {period}",
+                "xlabel": "Number of Commits", "ylabel": "Category"}})
+    return jobs
+
+
+# --- Worker side ---
+
+_FIGURES = {}  # figsize -> (figure, axes), one set per worker process
+
+
+def _axes_for(figsize):
+    if figsize not in _FIGURES:
+        figure = Figure(figsize=figsize)
+        _FIGURES[figsize] = (figure, figure.add_subplot())
+    figure, ax = _FIGURES[figsize]
+    ax.clear()
+    # tight_layout starts from the current margins, so start every chart
+    # from the defaults or it would come out slightly different from a
+    # freshly created figure.
+    figure.subplots_adjust(**{side: matplotlib.rcParams[f"figure.subplot.{side}"]
+                              for side in ("left", "right", "bottom", "top", "wspace", "hspace")})
+    return figure, ax
+
+
+def _viridis(n):
+    """n viridis colours sampled the way seaborn's "viridis" palette does."""
+    return matplotlib.colormaps["viridis"](np.linspace(0, 1, n + 2)[1:-1])
+
+
+def _draw_stacked(ax, data, spec):
+    data.plot(kind='bar', stacked=True, ax=ax, colormap='viridis')
+    ax.set_title(spec["title"], fontsize=18)
+    ax.set_xlabel(spec["xlabel"], fontsize=14)
+    ax.set_ylabel(spec["ylabel"], fontsize=14)
+    ax.tick_params(axis='x', rotation=45, labelsize=12)
+    if spec["grid"]:
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+    ax.legend(title='Category', bbox_to_anchor=(1.02, 1), loc='upper left')
+
+
+def _draw_period_bars(ax, data, spec):
+    positions = np.arange(len(data))
+    ax.barh(positions, data.to_numpy(), color=_viridis(len(data)))
+    ax.set_yticks(positions, [str(category) for category in data.index])
+    ax.set_ylim(len(data) - 0.5, -0.5)  # largest category on top
+    ax.set_title(spec["title"], fontsize=16)
+    ax.set_xlabel(spec["xlabel"], fontsize=12)
+    ax.set_ylabel(spec["ylabel"], fontsize=12)
+    ax.tick_params(axis='x', rotation=45)
+
+
+DRAW = {
+    "stacked": (_draw_stacked, SUMMARY_FIGSIZE),
+    "period_bars": (_draw_period_bars, PERIOD_FIGSIZE),
+}
+
+
+def _render(task):
+    """Draws one chart; returns (file name, hash, error or None)."""
+    job, output_dir, digest = task
+    try:
+        draw, figsize = DRAW[job["spec"]["kind"]]
+        figure, ax = _axes_for(figsize)
+        draw(ax, job["data"], job["spec"])
+        figure.tight_layout()
+        path = os.path.join(output_dir, job["file"])
+        figure.savefig(path + ".tmp.png")
+        os.replace(path + ".tmp.png", path)
+        return job["file"], digest, None
+    except Exception as e:
+        return job["file"], digest, f"{type(e).__name__}: {e}"
+
+
+# --- Driver ---
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def render_charts(jobs, output_dir, num_workers=RENDER_WORKERS, force=False):
+    """
+    Renders the jobs whose hash differs from the manifest (or whose file is
+    gone). Returns {"rendered": n, "skipped": n, "failed": {file: error}}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    tasks = []
+    for job in jobs:
+        digest = chart_hash(job)
+        if not force and manifest.get(job["file"]) == digest and os.path.exists(os.path.join(output_dir, job["file"])):
+            continue
+        tasks.append((job, output_dir, digest))
+    summary = {"rendered": 0, "skipped": len(jobs) - len(tasks), "failed": {}}
+    if not tasks:
+        return summary
+
+    num_workers = max(1, min(num_workers, len(tasks)))
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+    try:
+        if num_workers == 1:
+            results = map(_render, tasks)
+        else:
+            # Forked workers: 06_data_analysis.py has no __main__ guard, so a
+            # spawned worker would run the whole script again on import.
+            context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+            pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=context)
+            results = pool.map(_render, tasks, chunksize=chunksize)
+        for file_name, digest, error in tqdm(results, total=len(tasks), desc="Rendering Charts"):
+            if error is None:
+                manifest[file_name] = digest
+                summary["rendered"] += 1
+            else:
+                manifest.pop(file_name, None)
+                summary["failed"][file_name] = error
+    finally:
+        if num_workers > 1:
+            pool.shutdown()
+        save_manifest(output_dir, manifest)  # keep what was rendered even if a later chart failed
+    return summary
+
+
+def print_render_summary(summary):
+    print(f"Charts rendered: {summary['rendered']}, unchanged: {summary['skipped']}, failed: {len(summary['failed'])}")
+    for file_name, error in sorted(summary["failed"].items()):
+        print(f"- {file_name}: {error}")
+
+
+if __name__ == "__main__":
+    # Usage: python chart_renderer.py <output dir> [--force]
+    # Renders the distribution charts from the commit cube in CUBE_DIR.
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != "--force"):
+        exit("Usage: python chart_renderer.py <output dir> [--force]")
+    start = time.perf_counter()
+    summary = render_charts(distribution_jobs(CommitCube().cells), sys.argv[1], force=len(sys.argv) == 3)
+    print_render_summary(summary)
+    print(f"Done in {time.perf_counter() - start:.2f}s")
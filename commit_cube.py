@@ -0,0 +1,284 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from metadata_join import load_metadata_index
+
+# --- Pre-aggregated commit cube ---
+# Commit counts keyed by (day, category, is_bug_fix, author_name), kept on
+# disk so charts never re-read, re-merge or re-parse the raw commit data:
+#
+#   commit_cube/<name>.cube.parquet     day, category, is_bug_fix, author_name, commits
+#   commit_cube/<name>.commits.parquet  commit_id, day, category, is_bug_fix, author_name
+#
+# The second file is the per-commit ledger behind the counts (no messages,
+# no diffs). An update compares the classified output with it and applies
+# only the difference: new commits are added to their cell, commits whose
+# classification changed (e.g. patched by retry_queue.py) move from their old
+# cell to the new one, and commits that disappeared are subtracted. Dates and
+# authors are looked up for the new commits only. The sources' size and
+# mtime are stored with the cube, so an update with unchanged sources returns
+# at once.
+#
+# day is the UTC date of authored_datetime, so yearly/quarterly/monthly views
+# match what 06_data_analysis.py computed from the raw tables. Commits without
+# a category or a date are left out, as before.
+CUBE_DIR = "commit_cube"
+CELL_COLUMNS = ["day", "category", "is_bug_fix", "author_name"]
+LEDGER_COLUMNS = ["commit_id"] + CELL_COLUMNS
+
+
+def _fingerprint(paths):
+    """size:mtime of every file under the given files or directories."""
+    parts = []
+    for path in paths:
+        files = [path] if os.path.isfile(path) else sorted(
+            os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(path) for filename in filenames)
+        for file_path in files:
+            stat = os.stat(file_path)
+            parts.append(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def _empty(columns):
+    frame = pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    frame["day"] = pd.Series(dtype="datetime64[s]")
+    if "commits" in frame:
+        frame["commits"] = pd.Series(dtype=np.int64)
+    return frame
+
+
+def _utc_days(values):
+    """authored_datetime strings (or UTC timestamps) -> UTC calendar day (NaT when unparseable)."""
+    if isinstance(getattr(values, "dtype", None), pd.DatetimeTZDtype):  # the warehouse stores UTC timestamps
+        return values.dt.tz_convert("UTC").dt.tz_localize(None).dt.floor("D").to_numpy()
+    values = pd.Series(values, dtype=object).where(pd.notna(values), None)
+    # Arrow parses the usual "YYYY-MM-DD HH:MM:SS+HH:MM" form far faster than
+    # pd.to_datetime does with mixed offsets; anything else falls back to pandas.
+    parsed = pc.strptime(pa.array(values.tolist(), type=pa.string()), format="%Y-%m-%d %H:%M:%S%z", unit="s", error_is_null=True)
+    days = pd.Series(parsed.to_pandas(), dtype="datetime64[s, UTC]")
+    retry = days.isna().to_numpy() & values.notna().to_numpy()
+    if retry.any():
+        days[retry] = pd.to_datetime(values[retry], errors="coerce", utc=True).astype("datetime64[s, UTC]").to_numpy()
+    return days.dt.tz_localize(None).dt.floor("D").to_numpy()
+
+
+def _normalize_bug_flag(values):
+    """True/False/missing from bools or their CSV spellings."""
+    return values.map({True: True, False: False, "True": True, "False": False, "true": True, "false": False}).astype("boolean")
+
+
+def _count(ledger):
+    """Cells of a ledger (or part of one)."""
+    return ledger.groupby(CELL_COLUMNS, dropna=False, observed=True).size().rename("commits").reset_index()
+
+
+def _stored_fingerprint(table):
+    return (table.schema.metadata or {}).get(b"source_fingerprint", b"").decode() or None
+
+
+class CommitCube:
+    """The persisted cube and ledger for one repository."""
+
+    def __init__(self, cube_dir=CUBE_DIR, name="libxml2"):
+        self.cube_path = os.path.join(cube_dir, f"{name}.cube.parquet")
+        self.ledger_path = os.path.join(cube_dir, f"{name}.commits.parquet")
+        self.source_fingerprint = None
+        if os.path.exists(self.cube_path) and os.path.exists(self.ledger_path):
+            cells, ledger = pq.read_table(self.cube_path), pq.read_table(self.ledger_path)
+            self.source_fingerprint = _stored_fingerprint(cells)
+            self.cells = cells.to_pandas()
+            self.ledger = ledger.to_pandas()
+            if _stored_fingerprint(ledger) != self.source_fingerprint:
+                # A save was interrupted between the two files; the ledger is the newer one.
+                self.cells = _count(self.ledger)
+                self.source_fingerprint = None
+        else:
+            self.cells = _empty(CELL_COLUMNS + ["commits"])
+            self.ledger = _empty(LEDGER_COLUMNS)
+
+    def __len__(self):
+        return int(self.cells["commits"].sum())
+
+    def update(self, classified, lookup_metadata):
+        """
+        Brings the cube in line with classified (commit_id, is_bug_fix,
+        category; the last row of a commit wins). lookup_metadata(commit_ids)
+        returns authored_datetime and author_name aligned with its input.
+        Returns {"added", "changed", "removed"}.
+        """
+        current = classified[classified["category"].notna()].drop_duplicates("commit_id", keep="last")
+        commit_ids = current["commit_id"].to_numpy(dtype=object)
+        categories = current["category"].to_numpy(dtype=object)
+        bug_flags = _normalize_bug_flag(current["is_bug_fix"].astype(object))
+
+        # Hash lookups of the current commits in the ledger (a sorted merge of 1M string keys is far slower).
+        positions = pd.Index(self.ledger["commit_id"].to_numpy(dtype=object)).get_indexer(commit_ids)
+        known = positions >= 0
+        gone = np.ones(len(self.ledger), dtype=bool)
+        gone[positions[known]] = False
+        changed = np.zeros(len(current), dtype=bool)
+        old_categories = self.ledger["category"].to_numpy(dtype=object)[positions[known]]
+        old_flags = self.ledger["is_bug_fix"].astype(object).fillna("?").to_numpy(dtype=object)[positions[known]]
+        changed[known] = (old_categories != categories[known]) | (old_flags != bug_flags.astype(object).fillna("?").to_numpy(dtype=object)[known])
+
+        leaving = gone.copy()
+        leaving[positions[changed]] = True
+        old = self.ledger[leaving]
+        moved = self.ledger.iloc[positions[changed]].reset_index(drop=True)
+        moved["category"] = categories[changed]
+        moved["is_bug_fix"] = bug_flags[changed].to_numpy()
+
+        is_new = ~known
+        added = pd.DataFrame({"commit_id": commit_ids[is_new], "category": categories[is_new]})
+        added["is_bug_fix"] = bug_flags[is_new].to_numpy()
+        metadata = lookup_metadata(pd.Series(added["commit_id"]))
+        added["day"] = _utc_days(metadata["authored_datetime"])
+        added["author_name"] = pd.Series(metadata["author_name"].to_numpy(), dtype=object).fillna("")
+        added = added[added["day"].notna()]  # commits without a known date are not charted
+
+        # Ledger: drop what left or moved, then add the moved and new commits back.
+        self.ledger = pd.concat([self.ledger[~leaving], moved[LEDGER_COLUMNS], added[LEDGER_COLUMNS]], ignore_index=True)
+
+        delta = pd.concat([
+            old[CELL_COLUMNS].assign(commits=-1),
+            moved[CELL_COLUMNS].assign(commits=1),
+            added[CELL_COLUMNS].assign(commits=1),
+        ], ignore_index=True)
+        if len(delta):
+            cells = pd.concat([self.cells, delta], ignore_index=True)
+            cells = cells.groupby(CELL_COLUMNS, dropna=False, sort=False, observed=True)["commits"].sum().reset_index()
+            self.cells = cells[cells["commits"] != 0].reset_index(drop=True)
+        return {"added": len(added), "changed": int(changed.sum()), "removed": int(gone.sum())}
+
+    def save(self, source_fingerprint=None):
+        os.makedirs(os.path.dirname(self.cube_path) or ".", exist_ok=True)
+        self.source_fingerprint = source_fingerprint
+        metadata = {b"source_fingerprint": (source_fingerprint or "").encode()}
+        # Ledger first: after a crash in between, the fingerprints differ and the cells are recounted from the ledger.
+        for frame, columns, path in ((self.ledger, LEDGER_COLUMNS, self.ledger_path), (self.cells, CELL_COLUMNS + ["commits"], self.cube_path)):
+            table = pa.Table.from_pandas(frame[columns], preserve_index=False).replace_schema_metadata(metadata)
+            pq.write_table(table, path + ".tmp")
+            os.replace(path + ".tmp", path)
+
+    def filtered(self, commit_ids):
+        """Cells recounted over the given commits only (for per-commit filters such as diff features)."""
+        return _count(self.ledger[self.ledger["commit_id"].isin(commit_ids)])
+
+
+# --- Updating from the pipeline's outputs ---
+
+def update_from_csv(classified_csv, table_path, cube_dir=CUBE_DIR, name="libxml2"):
+    """Updates the cube from the classified CSV, with dates and authors from the commit table's index."""
+    cube = CommitCube(cube_dir, name)
+    fingerprint = _fingerprint([classified_csv, table_path])
+    if cube.source_fingerprint == fingerprint:
+        return cube
+    start = time.perf_counter()
+    classified = pd.read_csv(classified_csv, usecols=["key", "is_bug_fix", "category"], dtype={"is_bug_fix": object})
+    classified = classified.rename(columns={"key": "commit_id"})
+    index = load_metadata_index(table_path)
+    stats = cube.update(classified, lambda commit_ids: index.lookup(commit_ids, ["authored_datetime", "author_name"]))
+    cube.save(fingerprint)
+    print(f"Commit cube updated in {time.perf_counter() - start:.2f}s: {stats['added']} added, "
+          f"{stats['changed']} reclassified, {stats['removed']} removed; {len(cube.cells)} cells.")
+    return cube
+
+
+def update_from_warehouse(root, cube_dir=CUBE_DIR, name="libxml2"):
+    """Updates the cube from the warehouse's classified and commits datasets (WAREHOUSE_FORMAT=parquet)."""
+    from commit_warehouse import read_commits, read_classified, CLASSIFIED_DIR, COMMITS_DIR
+    cube = CommitCube(cube_dir, name)
+    fingerprint = _fingerprint([os.path.join(root, CLASSIFIED_DIR), os.path.join(root, COMMITS_DIR)])
+    if cube.source_fingerprint == fingerprint:
+        return cube
+    start = time.perf_counter()
+    classified = read_classified(root, columns=["commit_id", "is_bug_fix", "category"])
+
+    def lookup_metadata(commit_ids):
+        commits = read_commits(root, columns=["commit_id", "authored_datetime", "author_name"]).drop_duplicates("commit_id")
+        return pd.DataFrame({"commit_id": commit_ids.to_numpy()}).merge(commits, on="commit_id", how="left")
+
+    stats = cube.update(classified, lookup_metadata)
+    cube.save(fingerprint)
+    print(f"Commit cube updated in {time.perf_counter() - start:.2f}s: {stats['added']} added, "
+          f"{stats['changed']} reclassified, {stats['removed']} removed; {len(cube.cells)} cells.")
+    return cube
+
+
+# --- Views ---
+
+def _in_years(cells, years):
+    if years is None:
+        return cells
+    return cells[cells["day"].dt.year.isin(list(years))]
+
+
+def _period_name(freq):
+    return {"Y": "year", "Q": "quarter", "M": "month"}.get(freq, "period")
+
+
+def day_category_counts(cells, years=None, bug_fixes_only=False):
+    """day x category matrix of commit counts (days sorted, categories alphabetical)."""
+    cells = _in_years(cells, years)
+    if bug_fixes_only:
+        cells = cells[cells["is_bug_fix"].fillna(False).astype(bool)]
+    # Factorized codes and one bincount instead of a groupby over string keys.
+    day_codes, days = pd.factorize(cells["day"], sort=True)
+    category_codes, categories = pd.factorize(cells["category"], sort=True)
+    counts = np.bincount(day_codes * len(categories) + category_codes, weights=cells["commits"].to_numpy(),
+                         minlength=len(days) * len(categories))
+    return pd.DataFrame(counts.reshape(len(days), len(categories)).astype(np.int64),
+                        index=pd.DatetimeIndex(days, name="day"), columns=pd.Index(categories, name="category"))
+
+
+def period_view(cells, freq="Y", top_n=10, years=None, bug_fixes_only=False):
+    """
+    period x category commit counts (freq "Y", "Q" or "M"). Categories outside
+    the top_n most frequent are summed as "Other", which comes last.
+    """
+    matrix = day_category_counts(cells, years, bug_fixes_only)
+    top = matrix.sum().nlargest(top_n).index
+    pivot = matrix[[column for column in matrix.columns if column in top]]
+    if len(top) < len(matrix.columns):
+        pivot = pivot.assign(Other=matrix.drop(columns=top).sum(axis=1))
+    pivot = pivot.groupby(matrix.index.to_period(freq).astype(str).rename(_period_name(freq))).sum()
+    pivot.columns.name = "category_plot"
+    return pivot
+
+
+def rolling_view(cells, window_days=90, years=None):
+    """Daily series of commits per category summed over the trailing window_days."""
+    matrix = day_category_counts(cells, years)
+    if matrix.empty:
+        return matrix
+    matrix = matrix.reindex(pd.date_range(matrix.index.min(), matrix.index.max(), freq="D"), fill_value=0)
+    return matrix.rolling(window_days, min_periods=1).sum()
+
+
+def author_view(cells, freq="Y", top_n=10, years=None):
+    """period x author commit counts for the top_n authors."""
+    cells = _in_years(cells, years)
+    top = cells.groupby("author_name")["commits"].sum().nlargest(top_n).index
+    cells = cells[cells["author_name"].isin(top)]
+    periods = cells["day"].dt.to_period(freq).astype(str)
+    return cells.groupby([periods.rename(_period_name(freq)), "author_name"])["commits"].sum().unstack(fill_value=0)
+
+
+if __name__ == "__main__":
+    # Usage: python commit_cube.py update <classified.csv> <commit table.csv>
+    #        python commit_cube.py view <Y|Q|M>
+    if len(sys.argv) == 4 and sys.argv[1] == "update":
+        cube = update_from_csv(sys.argv[2], sys.argv[3])
+        print(f"{len(cube)} commits in {len(cube.cells)} cells.")
+    elif len(sys.argv) == 3 and sys.argv[1] == "view":
+        start = time.perf_counter()
+        view = period_view(CommitCube().cells, sys.argv[2])
+        print(view.to_string())
+        print(f"({time.perf_counter() - start:.3f}s)")
+    else:
+        exit("Usage: python commit_cube.py update <classified.csv> <commit table.csv> | view <Y|Q|M>")
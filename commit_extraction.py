@@ -0,0 +1,190 @@
+import os
+import time
+from multiprocessing import Pool
+from tqdm import tqdm
+from git import Repo, GitCommandError
+
+# --- Configuration ---
+# Number of commits handed to a worker at a time. Small shards keep the
+# workers evenly loaded (merge commits and vendored imports are much more
+# expensive to diff than ordinary commits) while keeping the in-order merge
+# buffer small.
+SHARD_SIZE = 250
+
+
+def get_commit_file_patches(commit):
+    """Returns [(path, patch_text)] for every file the commit touches, diffed against parents[0]."""
+    # This correctly handles the root commit (Case 3)
+    if not commit.parents:
+        return []
+
+    # always compare to main [0]
+    diff_index = commit.diff(commit.parents[0], create_patch=True)
+    # commit.diff(parent) puts the commit on the "a" side, so a_path is the
+    # file's path in this commit (b_path only for files the commit deleted).
+    return [
+        (diff_item.a_path or diff_item.b_path, diff_item.diff.decode('utf-8',errors='replace'))
+        for diff_item in diff_index
+    ]
+
+
+def get_commit_diff_only(commit):
+    # Join all the parts into a single string
+    return "\n".join(patch for _, patch in get_commit_file_patches(commit))
+
+
+def join_file_patches(file_patches):
+    """
+    Joins [(path, patch_text)] into the commit's diff and returns it with
+    [(path, start, end)]: where each file's patch sits in that diff.
+    """
+    spans, offset = [], 0
+    for path, patch in file_patches:
+        spans.append((path, offset, offset + len(patch)))
+        offset += len(patch) + 1
+    return "\n".join(patch for _, patch in file_patches), spans
+
+
+def commit_to_record(commit):
+    """
+    Builds the row written to the commit table for a single commit. The extra
+    'diff_files' entry locates each file's patch in 'diff' (path, start, end)
+    for later in-memory stages (diff budgeting, diff features), so records
+    sent back from worker processes carry the diff text only once; it is not
+    written to the table.
+    """
+    diff, diff_files = join_file_patches(get_commit_file_patches(commit))
+    return {
+        "commit_id": commit.hexsha,
+        "message": commit.message,
+        "diff": diff,
+        "author_name": commit.author.name,
+        "authored_datetime": commit.authored_datetime,
+        "diff_files": diff_files
+    }
+
+
+def iter_commit_records(repo_path, rev="HEAD", shas=None):
+    """
+    Serial extraction: yields one record per commit, newest first. Pass shas
+    (e.g. from the commit index) to skip walking rev with GitPython.
+    """
+    repo = Repo(repo_path)
+    commits = repo.iter_commits(rev) if shas is None else (repo.commit(sha) for sha in shas)
+    for commit in tqdm(commits, total=None if shas is None else len(shas), desc="Extracting Commits & Diffs"):
+        yield commit_to_record(commit)
+
+
+# --- Incremental extraction (high-water mark) ---
+
+def resolve_head(repo_path):
+    """Returns the full SHA that HEAD currently points to."""
+    return Repo(repo_path).head.commit.hexsha
+
+
+def read_high_water_mark(state_path):
+    """Returns the last processed HEAD recorded at state_path, or None."""
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        return f.read().strip() or None
+
+
+def write_high_water_mark(state_path, head_sha):
+    """Records head_sha as the last processed HEAD."""
+    state_dir = os.path.dirname(state_path)
+    if state_dir:
+        os.makedirs(state_dir, exist_ok=True)
+    with open(state_path, 'w') as f:
+        f.write(head_sha)
+
+
+def incremental_rev_range(repo_path, last_head, head_sha):
+    """
+    Returns the rev range covering only the commits added since last_head.
+    Falls back to the full history when there is no mark or when last_head is
+    no longer an ancestor of HEAD (e.g. the branch was force-pushed).
+    """
+    if not last_head:
+        return head_sha
+    repo = Repo(repo_path)
+    try:
+        repo.git.merge_base("--is-ancestor", last_head, head_sha)
+    except GitCommandError:
+        print(f"Warning: last processed HEAD {last_head} is not an ancestor of {head_sha}. Re-walking the full history.")
+        return head_sha
+    return f"{last_head}..{head_sha}"
+
+
+# --- Sharded multi-process extraction ---
+
+# Each worker process opens its own Repo handle once (GitPython keeps
+# long-running `git cat-file` processes per handle, so they cannot be shared).
+_worker_repo = None
+
+
+def _init_worker(repo_path):
+    global _worker_repo
+    _worker_repo = Repo(repo_path)
+
+
+def _extract_shard(task):
+    shard_index, shas = task
+    start = time.perf_counter()
+    records = [commit_to_record(_worker_repo.commit(sha)) for sha in shas]
+    return shard_index, os.getpid(), records, time.perf_counter() - start
+
+
+def list_commit_shas(repo, rev="HEAD"):
+    """Returns the rev-list in the same order as repo.iter_commits(rev)."""
+    return repo.git.rev_list(rev).split()
+
+
+def count_commits(repo_path, rev="HEAD"):
+    """Counts the commits reachable from rev without loading them."""
+    return int(Repo(repo_path).git.rev_list("--count", rev))
+
+
+def split_into_shards(shas, shard_size=SHARD_SIZE):
+    """Splits the rev-list into contiguous shards, preserving order."""
+    return [shas[i:i + shard_size] for i in range(0, len(shas), shard_size)]
+
+
+def report_worker_throughput(worker_stats):
+    """Prints commits/second for every worker process that took part."""
+    print("\n--- Extraction Throughput per Worker ---")
+    for worker_num, (pid, stats) in enumerate(sorted(worker_stats.items()), start=1):
+        rate = stats["commits"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"Worker {worker_num} (pid {pid}): {stats['shards']} shards, "
+              f"{stats['commits']} commits in {stats['seconds']:.1f}s ({rate:.1f} commits/s)")
+
+
+def iter_commit_records_parallel(repo_path, num_workers, rev="HEAD", shard_size=SHARD_SIZE, shas=None):
+    """
+    Extracts commits with a pool of worker processes. The rev-list (or the
+    given shas) is split into contiguous shards and the shards are yielded
+    back in rev-list order, so the output is identical to iter_commit_records().
+    """
+    if shas is None:
+        shas = list_commit_shas(Repo(repo_path), rev)
+    shards = split_into_shards(shas, shard_size)
+    worker_stats = {}
+    print(f"Extracting {len(shas)} commits in {len(shards)} shards with {num_workers} workers...")
+
+    start = time.perf_counter()
+    with Pool(num_workers, initializer=_init_worker, initargs=(repo_path,)) as pool:
+        with tqdm(total=len(shas), desc="Extracting Commits & Diffs") as progress:
+            # imap (not imap_unordered) hands shards back in submission order,
+            # which is what keeps the merged output deterministic.
+            for shard_index, pid, records, elapsed in pool.imap(_extract_shard, enumerate(shards)):
+                stats = worker_stats.setdefault(pid, {"shards": 0, "commits": 0, "seconds": 0.0})
+                stats["shards"] += 1
+                stats["commits"] += len(records)
+                stats["seconds"] += elapsed
+                progress.update(len(records))
+                yield from records
+
+    total_seconds = time.perf_counter() - start
+    report_worker_throughput(worker_stats)
+    if total_seconds:
+        print(f"Total: {len(shas)} commits in {total_seconds:.1f}s ({len(shas) / total_seconds:.1f} commits/s)")
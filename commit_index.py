@@ -0,0 +1,99 @@
+import os
+import sys
+import glob
+import hashlib
+import subprocess
+from datetime import datetime
+import pandas as pd
+
+# --- Cached commit index ---
+# One metadata-only walk of the history (`git log` without -p), cached per
+# HEAD so every stage that only needs hashes, authors, dates or messages reads
+# a small Parquet file instead of re-walking the repository with GitPython:
+#
+#   commit_index/<repo name>-<path hash>/<HEAD sha>.parquet
+#
+# The path hash (of the clone's resolved absolute path) keeps two clones with
+# the same directory name from evicting each other's index.
+#
+# Rows are newest first (the order of `git log` / repo.iter_commits()).
+# Timestamps are stored as the ISO strings git prints, so each commit keeps
+# its own UTC offset; parse_datetimes() turns them back into datetimes.
+
+COMMIT_INDEX_DIR = "commit_index"
+INDEX_COLUMNS = [
+    "commit_id", "parents", "author_name", "author_email",
+    "authored_datetime", "committed_datetime", "message",
+]
+# One field per column above (parents is space separated), \x1e after every commit.
+INDEX_LOG_FORMAT = "%H%x1f%P%x1f%an%x1f%ae%x1f%aI%x1f%cI%x1f%B%x1e"
+
+
+def _git(repo_path, *args):
+    return subprocess.run(["git", "-C", repo_path, *args], check=True, capture_output=True).stdout
+
+
+def resolve_rev(repo_path, rev="HEAD"):
+    return _git(repo_path, "rev-parse", "--verify", f"{rev}^{{commit}}").decode().strip()
+
+
+def commit_index_path(repo_path, head_sha, index_dir=COMMIT_INDEX_DIR):
+    real_path = os.path.realpath(repo_path)
+    repo_key = f"{os.path.basename(real_path)}-{hashlib.md5(real_path.encode()).hexdigest()[:8]}"
+    return os.path.join(index_dir, repo_key, f"{head_sha}.parquet")
+
+
+def walk_history(repo_path, rev="HEAD"):
+    """Runs the metadata-only history walk and returns it as a DataFrame."""
+    output = _git(repo_path, "log", f"--format={INDEX_LOG_FORMAT}", rev, "--")
+    rows = []
+    for entry in output.split(b"\x1e"):
+        entry = entry.lstrip(b"\n")
+        if not entry:
+            continue
+        fields = [field.decode('utf-8', errors='replace') for field in entry.split(b"\x1f", len(INDEX_COLUMNS) - 1)]
+        rows.append(fields)
+    return pd.DataFrame(rows, columns=INDEX_COLUMNS)
+
+
+def load_commit_index(repo_path, rev="HEAD", index_dir=COMMIT_INDEX_DIR):
+    """
+    Returns the commit index for everything reachable from rev, building and
+    caching it on first use. Indexes cached for older HEADs of the same
+    repository are removed when a new one is written.
+    """
+    head_sha = resolve_rev(repo_path, rev)
+    path = commit_index_path(repo_path, head_sha, index_dir)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    print(f"Building commit index for {repo_path} at {head_sha}...")
+    index = walk_history(repo_path, head_sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for stale in glob.glob(os.path.join(os.path.dirname(path), "*.parquet")):
+        os.remove(stale)
+    index.to_parquet(path, index=False)
+    print(f"Cached {len(index)} commits to {path}")
+    return index
+
+
+def select_commits(index, repo_path, rev_range):
+    """
+    Narrows an index to the commits in a rev range such as 'last..head'
+    (incremental runs). Order is preserved.
+    """
+    if ".." not in rev_range:
+        return index
+    shas = set(_git(repo_path, "rev-list", rev_range, "--").decode().split())
+    return index[index['commit_id'].isin(shas)].reset_index(drop=True)
+
+
+def parse_datetimes(series):
+    """ISO timestamp strings -> timezone-aware datetimes, keeping each commit's own offset."""
+    return series.map(datetime.fromisoformat)
+
+
+if __name__ == "__main__":
+    # Usage: python commit_index.py [repo_path]
+    index = load_commit_index(sys.argv[1] if len(sys.argv) > 1 else "./repos/c/libxml2")
+    print(f"{len(index)} commits, newest {index['commit_id'].iloc[0] if len(index) else '-'}")
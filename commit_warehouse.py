@@ -0,0 +1,193 @@
+import os
+import sys
+import shutil
+import time
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# --- Columnar commit warehouse ---
+# Parquet alternative to full_commit_libxml2.csv and fully_classified.csv.
+# Layout under a warehouse root (hive-style year partitions):
+#
+#   commits/year=YYYY/part-*.parquet     commit_id, message, author_name, authored_datetime, authored_utc_offset
+#   diffs/year=YYYY/part-*.parquet       commit_id, diff
+#   classified/year=YYYY/part-*.parquet  one row per prediction, keyed by commit_id
+#
+# Diffs live in their own dataset so stages that only need metadata never
+# read them, and every dataset can skip whole years with a partition filter.
+
+WAREHOUSE_DIR = "commit_warehouse/libxml2"
+COMMITS_DIR = "commits"
+DIFFS_DIR = "diffs"
+CLASSIFIED_DIR = "classified"
+# Commits buffered per write. Each flush writes one file per year touched.
+WAREHOUSE_BATCH_SIZE = 5000
+
+COMMITS_SCHEMA = pa.schema([
+    ("commit_id", pa.string()),
+    ("message", pa.string()),
+    ("author_name", pa.string()),
+    ("authored_datetime", pa.timestamp("us", tz="UTC")),
+    ("authored_utc_offset", pa.int16()),  # minutes east of UTC, so the local time can be rebuilt
+    ("year", pa.int32()),
+])
+DIFFS_SCHEMA = pa.schema([
+    ("commit_id", pa.string()),
+    ("diff", pa.string()),
+    ("year", pa.int32()),
+])
+
+
+def _utc_offset_minutes(value):
+    """Offset of a datetime (or its ISO string as written to the CSV) in minutes."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value is None or pd.isna(value) or value.utcoffset() is None:
+        return None
+    return int(value.utcoffset().total_seconds() // 60)
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([("year", pa.int32())]), flavor="hive")
+
+
+def _write_partitioned(table, base_dir, basename_template):
+    ds.write_dataset(
+        table, base_dir, format="parquet",
+        partitioning=_partitioning(),
+        basename_template=basename_template,
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def _open_dataset(base_dir):
+    return ds.dataset(base_dir, format="parquet", partitioning=_partitioning())
+
+
+def _year_filter(years):
+    return ds.field("year").isin(list(years)) if years is not None else None
+
+
+class CommitWarehouseWriter:
+    """
+    Buffers extracted commit records and writes them to the warehouse in
+    year-partitioned Parquet batches. Use append=True for incremental runs;
+    otherwise any existing commits/diffs datasets are replaced.
+    """
+
+    def __init__(self, root=WAREHOUSE_DIR, batch_size=WAREHOUSE_BATCH_SIZE, append=False):
+        self.root = root
+        self.batch_size = batch_size
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.batch_num = 0
+        self.buffer = []
+        if not append:
+            for sub_dir in (COMMITS_DIR, DIFFS_DIR):
+                shutil.rmtree(os.path.join(root, sub_dir), ignore_errors=True)
+
+    def add(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        df = pd.DataFrame(self.buffer)
+        self.buffer = []
+
+        authored = pd.to_datetime(df['authored_datetime'].astype(str), errors='coerce', utc=True)
+        years = authored.dt.year.astype("Int32")
+        offsets = df['authored_datetime'].map(_utc_offset_minutes).astype("Int16")
+
+        commits = pa.Table.from_pandas(pd.DataFrame({
+            "commit_id": df['commit_id'],
+            "message": df['message'],
+            "author_name": df['author_name'],
+            "authored_datetime": authored,
+            "authored_utc_offset": offsets,
+            "year": years,
+        }), schema=COMMITS_SCHEMA, preserve_index=False)
+        diffs = pa.Table.from_pandas(pd.DataFrame({
+            "commit_id": df['commit_id'],
+            "diff": df['diff'],
+            "year": years,
+        }), schema=DIFFS_SCHEMA, preserve_index=False)
+
+        basename_template = f"part-{self.run_id}-{self.batch_num:05d}-{{i}}.parquet"
+        _write_partitioned(commits, os.path.join(self.root, COMMITS_DIR), basename_template)
+        _write_partitioned(diffs, os.path.join(self.root, DIFFS_DIR), basename_template)
+        self.batch_num += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_commits(root=WAREHOUSE_DIR, columns=None, years=None):
+    """
+    Loads commit metadata as a DataFrame. Only the requested columns are read
+    and partitions outside `years` are skipped entirely.
+    """
+    dataset = _open_dataset(os.path.join(root, COMMITS_DIR))
+    return dataset.to_table(columns=columns, filter=_year_filter(years)).to_pandas()
+
+
+def read_diffs(root=WAREHOUSE_DIR, commit_ids=None, years=None):
+    """Loads (commit_id, diff) rows, optionally restricted to some commits and years."""
+    dataset = _open_dataset(os.path.join(root, DIFFS_DIR))
+    row_filter = _year_filter(years)
+    if commit_ids is not None:
+        id_filter = ds.field("commit_id").isin(list(commit_ids))
+        row_filter = id_filter if row_filter is None else row_filter & id_filter
+    return dataset.to_table(columns=["commit_id", "diff"], filter=row_filter).to_pandas()
+
+
+def write_classified(classified_df, root=WAREHOUSE_DIR, key_column='key'):
+    """
+    Writes the classified output, partitioned by the authored year of each
+    commit (looked up from the commits dataset). Replaces any previous output.
+    """
+    dates = read_commits(root, columns=["commit_id", "year"])
+    df = classified_df.rename(columns={key_column: 'commit_id'})
+    df = df.merge(dates, on='commit_id', how='left')
+    df['year'] = df['year'].astype("Int32")
+
+    base_dir = os.path.join(root, CLASSIFIED_DIR)
+    shutil.rmtree(base_dir, ignore_errors=True)
+    _write_partitioned(pa.Table.from_pandas(df, preserve_index=False), base_dir, "part-{i}.parquet")
+    print(f"Saved {len(df)} classified records to warehouse: {base_dir}")
+
+
+def read_classified(root=WAREHOUSE_DIR, columns=None, years=None):
+    """Loads the classified output, projecting columns and skipping years like read_commits."""
+    dataset = _open_dataset(os.path.join(root, CLASSIFIED_DIR))
+    return dataset.to_table(columns=columns, filter=_year_filter(years)).to_pandas()
+
+
+def convert_csv_to_warehouse(csv_path, root=WAREHOUSE_DIR, chunksize=WAREHOUSE_BATCH_SIZE):
+    """One-off migration of an existing commit table CSV into the warehouse."""
+    converted = 0
+    with CommitWarehouseWriter(root) as writer:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, keep_default_na=False):
+            for record in chunk.to_dict('records'):
+                writer.add(record)
+            converted += len(chunk)
+            print(f"  -> converted {converted} commits")
+    print(f"Successfully converted {csv_path} into warehouse at {root}")
+
+
+if __name__ == "__main__":
+    # Usage: python commit_warehouse.py [commit_table.csv] [warehouse_root]
+    source_csv = sys.argv[1] if len(sys.argv) > 1 else "full_commit_with_author_data/full_commit_libxml2.csv"
+    convert_csv_to_warehouse(source_csv, sys.argv[2] if len(sys.argv) > 2 else WAREHOUSE_DIR)
@@ -0,0 +1,243 @@
+import os
+import re
+
+# --- Token-aware diff budgeting ---
+# Trims the code diff that goes into a classification prompt so huge merges,
+# vendored imports and regenerated files do not blow up the batch file or hit
+# request limits. The commit table always keeps the full diff; only the
+# prompt sees the budgeted version.
+#
+#   1. Files that are binary, generated or test fixtures are dropped.
+#   2. The remaining hunks are ranked (C sources first, then other code and
+#      build files, then docs, then everything else) and kept greedily until
+#      the per-request token budget is spent. The hunk that crosses the budget
+#      is cut line-wise.
+#   3. Kept hunks are emitted in their original order. Every place content was
+#      removed gets a marker line saying how much was dropped. Markers are paid
+#      for out of the same budget; when more than MAX_FILE_MARKERS whole files
+#      are left out, they are folded into one summary line instead of a
+#      marker each.
+
+CHARS_PER_TOKEN = 4  # rough estimate for code with Gemini-style tokenizers
+MIN_PARTIAL_TOKENS = 64  # don't bother keeping a stub of a hunk smaller than this
+MAX_FILE_MARKERS = 5  # more omitted files than this get one summary line
+OVER_BUDGET = "over budget"  # omission reason for files none of whose hunks fit
+
+C_SOURCE_EXTENSIONS = ('.c', '.h', '.cc', '.cpp', '.hpp', '.in.h')
+CODE_AND_BUILD_EXTENSIONS = ('.py', '.pyx', '.sh', '.am', '.ac', '.m4', '.cmake', '.build', '.txt', '.pl', '.rs', '.go', '.java', '.js')
+DOC_EXTENSIONS = ('.md', '.rst', '.texi', '.xsl', '.3', '.1', '.docbook')
+GENERATED_FILE_RE = re.compile(
+    r'(^|/)(configure|aclocal\.m4|ltmain\.sh|config\.(guess|sub)|install-sh|depcomp|missing|'
+    r'Makefile\.in|[^/]*\.min\.js|[^/]*\.lock|[^/]*-lock\.json|[^/]*\.pb\.[ch]|ChangeLog|NEWS)$'
+)
+# Expected-output and input corpora under the test directories (libxml2 keeps
+# thousands of them under result/ and test/).
+TEST_FIXTURE_RE = re.compile(r'(^|/)(result|results|test|tests|testdata|fuzz/seed|fixtures?)/')
+HUNK_START_RE = re.compile(r'^(?=@@ |Binary files )', re.MULTILINE)
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used for budgeting and reporting."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _size_summary(*texts):
+    lines = sum(text.count("\n") for text in texts)
+    size = sum(len(text.encode('utf-8')) for text in texts)
+    tokens = sum(estimate_tokens(text) for text in texts)
+    return f"{lines} lines, {size} bytes, ~{tokens} tokens"
+
+
+def _dropped_hunks_marker(dropped_hunks, label):
+    return f"[diff budget: dropped {len(dropped_hunks)} hunks from {label} ({_size_summary(*dropped_hunks)})]\n"
+
+
+def _omitted_files_marker(omitted, diff_files):
+    counts = {}
+    for reason in omitted.values():
+        counts[reason] = counts.get(reason, 0) + 1
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(counts.items()))
+    patches = (diff_files[file_idx][1] for file_idx in omitted)
+    return f"[diff budget: {len(omitted)} files skipped ({reasons}; {_size_summary(*patches)})]\n"
+
+
+# Upper bounds on the size of a marker line, reserved before content is kept.
+_BIG = 9999999999
+
+
+def _marker_tokens(label):
+    return estimate_tokens(f"[diff budget: dropped {_BIG} hunks from {label} ({_BIG} lines, {_BIG} bytes, ~{_BIG} tokens)]\n")
+
+
+_SUMMARY_MARKER_TOKENS = estimate_tokens(
+    f"[diff budget: {_BIG} files skipped (binary: {_BIG}, generated: {_BIG}, test fixture: {_BIG}, "
+    f"{OVER_BUDGET}: {_BIG}; {_BIG} lines, {_BIG} bytes, ~{_BIG} tokens)]\n"
+)
+
+
+def skip_reason(path, patch):
+    """Why a whole file is dropped from the prompt, or None to keep it."""
+    # A bare "Binary files ... differ" line is already as small as it gets and
+    # is left alone; only patches that actually carry binary content are dropped.
+    if "\x00" in patch:
+        return "binary"
+    if GENERATED_FILE_RE.search(path):
+        return "generated"
+    if TEST_FIXTURE_RE.search(path) and not path.endswith(C_SOURCE_EXTENSIONS + CODE_AND_BUILD_EXTENSIONS):
+        return "test fixture"
+    return None
+
+
+def file_rank(path):
+    """Lower ranks are kept first when the budget runs out."""
+    if not path:
+        return 3
+    if path.endswith(C_SOURCE_EXTENSIONS):
+        return 0
+    if path.endswith(CODE_AND_BUILD_EXTENSIONS) or os.path.basename(path) in ('Makefile', 'CMakeLists.txt', 'meson.build'):
+        return 1
+    if path.endswith(DOC_EXTENSIONS) or path.startswith('doc/'):
+        return 2
+    return 3
+
+
+def split_hunks(patch):
+    """Splits one file's patch (or a whole diff without file headers) at '@@' lines."""
+    return [hunk for hunk in HUNK_START_RE.split(patch) if hunk]
+
+
+def _truncate_hunk(hunk, token_budget):
+    """Keeps the leading lines of a hunk that fit in token_budget."""
+    kept, used = [], 0
+    lines = hunk.splitlines(keepends=True)
+    for line in lines:
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        kept.append(line)
+        used += cost
+    dropped = "".join(lines[len(kept):])
+    return "".join(kept), dropped
+
+
+class DiffBudgetReport:
+    """Accumulates before/after sizes across a run and prints the reduction."""
+
+    def __init__(self, token_budget):
+        self.token_budget = token_budget
+        self.commits = 0
+        self.commits_trimmed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.files_skipped = {}
+
+    def record(self, original, budgeted, skipped_reasons):
+        self.commits += 1
+        self.commits_trimmed += budgeted != original
+        self.bytes_in += len(original.encode('utf-8'))
+        self.bytes_out += len(budgeted.encode('utf-8'))
+        self.tokens_in += estimate_tokens(original)
+        self.tokens_out += estimate_tokens(budgeted)
+        for reason in skipped_reasons:
+            self.files_skipped[reason] = self.files_skipped.get(reason, 0) + 1
+
+    def print_summary(self):
+        def reduction(before, after):
+            return f"{(1 - after / before):.1%}" if before else "n/a"
+
+        print("\n--- Diff Budget Summary ---")
+        print(f"Token budget per request: {self.token_budget}")
+        print(f"Commits trimmed: {self.commits_trimmed} of {self.commits}")
+        print(f"Diff bytes:  {self.bytes_in:,} -> {self.bytes_out:,} ({reduction(self.bytes_in, self.bytes_out)} smaller)")
+        print(f"Diff tokens: ~{self.tokens_in:,} -> ~{self.tokens_out:,} ({reduction(self.tokens_in, self.tokens_out)} smaller)")
+        for reason, count in sorted(self.files_skipped.items()):
+            print(f"- {reason} files skipped: {count}")
+
+
+def apply_diff_budget(diff_text, diff_files=None, token_budget=8000, report=None):
+    """
+    Returns the budgeted diff for one commit. diff_files is the per-file
+    [(path, start, end)] list from extraction, locating each file's patch in
+    diff_text; without it (e.g. diffs read back from the commit table) the
+    whole diff is treated as one file of unknown type.
+    """
+    diff_text = diff_text or ""
+    if diff_files is None:
+        diff_files = [("", diff_text)] if diff_text else []
+    else:
+        diff_files = [(path, diff_text[start:end]) for path, start, end in diff_files]
+
+    skipped = {}        # file_idx -> reason
+    hunks = {}          # file_idx -> [hunk text]
+    candidates = []     # (rank, file_idx, hunk_idx, tokens)
+    marker_tokens = [_marker_tokens(path or "diff") for path, _ in diff_files]
+    for file_idx, (path, patch) in enumerate(diff_files):
+        # Without a path (legacy diffs) the type of the content is unknown, so nothing is skipped.
+        reason = skip_reason(path, patch) if path else None
+        if reason:
+            skipped[file_idx] = reason
+            continue
+        hunks[file_idx] = split_hunks(patch)
+        rank = file_rank(path)
+        for hunk_idx, hunk in enumerate(hunks[file_idx]):
+            candidates.append((rank, file_idx, hunk_idx, estimate_tokens(hunk)))
+
+    # Room for the markers of files left out entirely: one each up to
+    # MAX_FILE_MARKERS, or the summary line that replaces them.
+    largest_markers = sorted(marker_tokens, reverse=True)[:MAX_FILE_MARKERS]
+    remaining = token_budget - max(sum(largest_markers), _SUMMARY_MARKER_TOKENS if diff_files else 0)
+    kept = {}           # (file_idx, hunk_idx) -> (kept text, dropped text)
+    kept_files = set()
+    for rank, file_idx, hunk_idx, tokens in sorted(candidates):
+        hunk = hunks[file_idx][hunk_idx]
+        # A kept hunk can add a "dropped hunks" marker after it, and the first
+        # one kept in a file one before it as well.
+        markers = marker_tokens[file_idx] * (1 if file_idx in kept_files else 2)
+        if tokens + markers <= remaining:
+            kept[(file_idx, hunk_idx)] = (hunk, "")
+            remaining -= tokens + markers
+            kept_files.add(file_idx)
+        elif remaining - markers - marker_tokens[file_idx] >= MIN_PARTIAL_TOKENS:
+            # ... plus the "truncated hunk" marker.
+            kept[(file_idx, hunk_idx)] = _truncate_hunk(hunk, remaining - markers - marker_tokens[file_idx])
+            remaining = 0
+            kept_files.add(file_idx)
+
+    omitted = dict(skipped)
+    omitted.update((file_idx, OVER_BUDGET) for file_idx in hunks if hunks[file_idx] and file_idx not in kept_files)
+    # A budget too small even for the per-file markers gets the summary line.
+    fold_omitted = len(omitted) > MAX_FILE_MARKERS or (omitted and remaining < 0)
+
+    parts = []
+    for file_idx, (path, patch) in enumerate(diff_files):
+        label = path or "diff"
+        if fold_omitted and file_idx in omitted:
+            continue
+        if file_idx in skipped:
+            parts.append(f"[diff budget: skipped {skipped[file_idx]} file {label} ({_size_summary(patch)})]\n")
+            continue
+        file_parts, dropped = [], []
+        for hunk_idx, hunk in enumerate(hunks[file_idx]):
+            if (file_idx, hunk_idx) not in kept:
+                dropped.append(hunk)
+                continue
+            if dropped:
+                file_parts.append(_dropped_hunks_marker(dropped, label))
+                dropped = []
+            kept_text, cut = kept[(file_idx, hunk_idx)]
+            file_parts.append(kept_text)
+            if cut:
+                separator = "" if kept_text.endswith("\n") or not kept_text else "\n"
+                file_parts.append(f"{separator}[diff budget: truncated hunk in {label}, dropped {_size_summary(cut)}]\n")
+        if dropped:
+            file_parts.append(_dropped_hunks_marker(dropped, label))
+        parts.append("".join(file_parts))
+    if fold_omitted:
+        parts.append(_omitted_files_marker(omitted, diff_files))
+
+    budgeted = "\n".join(parts)
+    if report is not None:
+        report.record(diff_text, budgeted, skipped.values())
+    return budgeted
@@ -0,0 +1,134 @@
+import os
+import sys
+import numpy as np
+
+# --- Per-commit diff statistics (numstat features) ---
+# A compact numeric table written next to the commit table, computed from the
+# per-file patches while they are extracted (no second pass over the diffs):
+#
+#   commit_id        (n,)    40-char hex ids, in the same order as the commit table
+#   lines_added      (n,)    int32
+#   lines_removed    (n,)    int32
+#   files_touched    (n,)    int32
+#   ext_counts       (n, k)  int32, files touched per extension in `extensions`
+#   extensions       (k,)    column labels for ext_counts
+#
+# Everything lives in one .npz file, so filters by size or file type are
+# plain NumPy boolean masks instead of string scans over the patch text.
+
+DIFF_FEATURES_PATH = "full_commit_with_author_data/diff_features_libxml2.npz"
+# Fixed vocabulary so files written by different runs can be concatenated.
+# Anything else is counted under "(other)"; files without an extension under "(none)".
+FEATURE_EXTENSIONS = (
+    ".c", ".h", ".py", ".pyx", ".sh", ".am", ".ac", ".in", ".m4", ".cmake", ".build", ".txt",
+    ".xml", ".xsd", ".dtd", ".rng", ".xsl", ".html", ".md", ".rst", ".1", ".3", ".def", ".pc",
+)
+NO_EXTENSION = "(none)"
+OTHER_EXTENSION = "(other)"
+EXTENSIONS = FEATURE_EXTENSIONS + (NO_EXTENSION, OTHER_EXTENSION)
+EXTENSION_COLUMN = {ext: i for i, ext in enumerate(EXTENSIONS)}
+DOC_FEATURE_EXTENSIONS = (".md", ".rst", ".html", ".1", ".3")
+
+
+def extension_of(path):
+    ext = os.path.splitext(path)[1].lower()
+    if not ext:
+        return NO_EXTENSION
+    return ext if ext in EXTENSION_COLUMN else OTHER_EXTENSION
+
+
+def patch_line_counts(patch):
+    """(added, removed) for one file's patch; ---/+++ headers are already stripped."""
+    body = "\n" + patch
+    # Extracted patches diff the commit against its parent (see
+    # get_commit_file_patches), so lines the commit added carry a "-".
+    return body.count("\n-"), body.count("\n+")
+
+
+def commit_features(diff, diff_files):
+    """
+    (lines_added, lines_removed, files_touched, ext_count_row) for one commit;
+    diff_files is the [(path, start, end)] list locating each patch in diff.
+    """
+    added = removed = 0
+    ext_row = np.zeros(len(EXTENSIONS), dtype=np.int32)
+    for path, start, end in diff_files:
+        file_added, file_removed = patch_line_counts(diff[start:end])
+        added += file_added
+        removed += file_removed
+        ext_row[EXTENSION_COLUMN[extension_of(path)]] += 1
+    return added, removed, len(diff_files), ext_row
+
+
+class DiffFeatureWriter:
+    """
+    Sink for 01_data_prepare.py: collects features from each extracted record
+    (record['diff_files']) and saves the arrays on close(). With append=True
+    the rows are added after those already in the file.
+    """
+
+    def __init__(self, path=DIFF_FEATURES_PATH, append=False):
+        self.path = path
+        self.append = append
+        self.commit_ids = []
+        self.rows = []          # (added, removed, files)
+        self.ext_rows = []
+
+    def add(self, record):
+        added, removed, files, ext_row = commit_features(record['diff'], record['diff_files'])
+        self.commit_ids.append(record['commit_id'])
+        self.rows.append((added, removed, files))
+        self.ext_rows.append(ext_row)
+
+    def close(self):
+        stats = np.array(self.rows, dtype=np.int32).reshape(-1, 3)
+        features = {
+            "commit_id": np.array(self.commit_ids, dtype="U40"),
+            "lines_added": stats[:, 0],
+            "lines_removed": stats[:, 1],
+            "files_touched": stats[:, 2],
+            "ext_counts": np.array(self.ext_rows, dtype=np.int32).reshape(-1, len(EXTENSIONS)),
+        }
+        if self.append and os.path.exists(self.path):
+            existing = load_diff_features(self.path)
+            features = {name: np.concatenate([existing[name], rows]) for name, rows in features.items()}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        np.savez_compressed(self.path, extensions=np.array(EXTENSIONS), **features)
+        print(f"Saved diff features for {len(features['commit_id'])} commits to {self.path}")
+
+
+def load_diff_features(path=DIFF_FEATURES_PATH):
+    """Loads the feature arrays into a plain dict."""
+    with np.load(path) as data:
+        features = {name: data[name] for name in data.files}
+    if tuple(features["extensions"]) != EXTENSIONS:
+        raise ValueError(f"FATAL: {path} was written with a different extension vocabulary. Re-run extraction.")
+    return features
+
+
+def extension_mask(features, extensions):
+    """Boolean mask of commits that touch at least one file with any of the extensions."""
+    columns = [EXTENSION_COLUMN[ext] for ext in extensions]
+    return features["ext_counts"][:, columns].sum(axis=1) > 0
+
+
+def only_extensions_mask(features, extensions):
+    """Boolean mask of commits whose touched files all have one of the extensions."""
+    columns = [EXTENSION_COLUMN[ext] for ext in extensions]
+    matching = features["ext_counts"][:, columns].sum(axis=1)
+    return (features["files_touched"] > 0) & (matching == features["files_touched"])
+
+
+def lines_changed(features):
+    return features["lines_added"].astype(np.int64) + features["lines_removed"]
+
+
+if __name__ == "__main__":
+    # Usage: python diff_features.py [features.npz]  -- prints a summary
+    features = load_diff_features(sys.argv[1] if len(sys.argv) > 1 else DIFF_FEATURES_PATH)
+    changed = lines_changed(features)
+    print(f"{len(features['commit_id'])} commits, {features['lines_added'].sum()} lines added, "
+          f"{features['lines_removed'].sum()} removed, median {int(np.median(changed)) if len(changed) else 0} lines changed per commit")
+    for ext, count in sorted(zip(EXTENSIONS, features["ext_counts"].sum(axis=0)), key=lambda item: -item[1]):
+        if count:
+            print(f"- {ext}: {count} file changes")
@@ -0,0 +1,179 @@
+import os
+import sys
+import csv
+import mmap
+import struct
+import hashlib
+
+# --- Content-addressed diff store ---
+# Random access to the diff of any commit without re-diffing through git or
+# scanning the commit table CSV. Three files live in the store directory:
+#
+#   diffs.bin    append-only concatenation of unique diff texts (UTF-8)
+#   blobs.idx    one record per unique diff:  sha1(content) | offset | length
+#   commits.idx  one record per commit:       commit sha   | offset | length
+#
+# Identical diffs (cherry-picks, reverts of reverts, empty merges) are stored
+# once. Both index files are fixed-width records loaded into dicts when the
+# store is opened, so a lookup is O(1); the diff bytes themselves are served
+# straight out of an mmap of diffs.bin.
+
+DIFF_STORE_DIR = "diff_store/libxml2"
+DATA_FILE = "diffs.bin"
+BLOB_INDEX_FILE = "blobs.idx"
+COMMIT_INDEX_FILE = "commits.idx"
+INDEX_RECORD = struct.Struct("<20sQQ")  # 20-byte key, u64 offset, u64 length
+
+
+def _load_index(path):
+    """Reads a fixed-width index file into {key: (offset, length)}."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % INDEX_RECORD.size  # ignore a torn trailing record
+    return {key: (offset, length) for key, offset, length in INDEX_RECORD.iter_unpack(data[:usable])}
+
+
+class DiffStore:
+    """
+    Opens (or creates) a diff store directory. Use put()/add() to append diffs
+    and get()/get_bytes() for lookups by commit hash. With read_only=True
+    nothing is created or opened for writing, and put() is refused.
+    """
+
+    def __init__(self, store_dir=DIFF_STORE_DIR, read_only=False):
+        self.store_dir = store_dir
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(store_dir, exist_ok=True)
+        self.data_path = os.path.join(store_dir, DATA_FILE)
+        self.blobs = _load_index(os.path.join(store_dir, BLOB_INDEX_FILE))
+        self.commits = _load_index(os.path.join(store_dir, COMMIT_INDEX_FILE))
+
+        if read_only:
+            self.data_file = self.blob_index_file = self.commit_index_file = None
+            self.data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        else:
+            self.data_file = open(self.data_path, 'ab')
+            self.blob_index_file = open(os.path.join(store_dir, BLOB_INDEX_FILE), 'ab')
+            self.commit_index_file = open(os.path.join(store_dir, COMMIT_INDEX_FILE), 'ab')
+            self.data_size = self.data_file.tell()
+        self.mapped = None
+        self.mapped_size = 0
+
+    def __len__(self):
+        return len(self.commits)
+
+    def __contains__(self, commit_hash):
+        return bytes.fromhex(commit_hash) in self.commits
+
+    # --- Writing ---
+
+    def put(self, commit_hash, diff_text):
+        """Stores the diff for commit_hash. Returns True if new content was written."""
+        if self.read_only:
+            raise IOError(f"Diff store {self.store_dir} was opened read-only.")
+        commit_key = bytes.fromhex(commit_hash)
+        if commit_key in self.commits:
+            return False
+
+        content = (diff_text or "").encode('utf-8', errors='replace')
+        digest = hashlib.sha1(content).digest()
+        location = self.blobs.get(digest)
+        is_new_blob = location is None
+        if is_new_blob:
+            location = (self.data_size, len(content))
+            self.data_file.write(content)
+            self.data_size += len(content)
+            self.blob_index_file.write(INDEX_RECORD.pack(digest, *location))
+            self.blobs[digest] = location
+
+        self.commit_index_file.write(INDEX_RECORD.pack(commit_key, *location))
+        self.commits[commit_key] = location
+        return is_new_blob
+
+    def add(self, record):
+        """Sink interface used by 01_data_prepare.py: stores record['diff']."""
+        self.put(record['commit_id'], record['diff'])
+
+    def flush(self):
+        if self.read_only:
+            return
+        # Data is flushed before the indexes so an index never points past the data.
+        self.data_file.flush()
+        self.blob_index_file.flush()
+        self.commit_index_file.flush()
+
+    def close(self):
+        self.flush()
+        # Not closed explicitly: views handed out by get_bytes() may still be
+        # alive, and the map is released once the last of them goes away.
+        self.mapped = None
+        if self.read_only:
+            return
+        self.data_file.close()
+        self.blob_index_file.close()
+        self.commit_index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- Reading ---
+
+    def _view(self, offset, length):
+        if offset + length > self.mapped_size:
+            # The file grew since it was mapped (or was never mapped): remap.
+            # The old map stays valid for any views that still reference it.
+            self.flush()
+            self.mapped_size = os.path.getsize(self.data_path)
+            with open(self.data_path, 'rb') as f:
+                self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if length == 0:
+            return memoryview(b"")
+        return memoryview(self.mapped)[offset:offset + length]
+
+    def get_bytes(self, commit_hash):
+        """Zero-copy view of the stored diff bytes, or None if the commit is unknown."""
+        location = self.commits.get(bytes.fromhex(commit_hash))
+        if location is None:
+            return None
+        return self._view(*location)
+
+    def get(self, commit_hash):
+        """The stored diff text for commit_hash, or None if the commit is unknown."""
+        view = self.get_bytes(commit_hash)
+        return None if view is None else str(view, 'utf-8')
+
+    def stats(self):
+        """Commits indexed, unique diffs and bytes on disk."""
+        return {"commits": len(self.commits), "unique_diffs": len(self.blobs), "data_bytes": self.data_size}
+
+
+def build_from_commit_table(csv_path, store_dir=DIFF_STORE_DIR):
+    """Populates the store from an existing commit table CSV, one row at a time."""
+    csv.field_size_limit(sys.maxsize)
+    with DiffStore(store_dir) as store, open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            store.put(row['commit_id'], row['diff'])
+        stats = store.stats()
+    print(f"Diff store at {store_dir}: {stats['commits']} commits, "
+          f"{stats['unique_diffs']} unique diffs, {stats['data_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    # Usage: python diff_store.py build [commit_table.csv]
+    #        python diff_store.py get <commit_hash>
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        build_from_commit_table(sys.argv[2] if len(sys.argv) > 2 else "full_commit_with_author_data/full_commit_libxml2.csv")
+    elif len(sys.argv) == 3 and sys.argv[1] == "get":
+        with DiffStore() as store:
+            diff = store.get(sys.argv[2])
+        if diff is None:
+            exit(f"Error: commit {sys.argv[2]} is not in the diff store.")
+        print(diff)
+    else:
+        exit("Usage: python diff_store.py build [commit_table.csv] | get <commit_hash>")
@@ -2,11 +2,14 @@ import os
 import re
 import time
 import json
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from dotenv import load_dotenv
 from google.cloud import aiplatform_v1
-from git import Repo
+from commit_index import load_commit_index
+from prompt_builder import render_message_prompt
+from diff_features import load_diff_features, only_extensions_mask, DOC_FEATURE_EXTENSIONS, DIFF_FEATURES_PATH
 import vertexai.preview
 from vertexai.generative_models import GenerativeModel, Part
 
@@ -74,6 +77,20 @@ def classify_commit_heuristically(message):
                 if re.search(r'\b' + topic + r'\b', msg_lower): return {"is_bug_fix": False, "category": category, "reasoning": f"Tier 3 match: topic '{topic}'"}
         return {"is_bug_fix": False, "category": "Feature/Enhancement", "reasoning": "Heuristic miss, assumed non-bug"}
 
+def diff_feature_docs_only(commit_hashes):
+    """
+    Vectorized lookup in the precomputed diff features: True for commits that
+    only touch documentation files. All False if the features were not extracted.
+    """
+    if not os.path.exists(DIFF_FEATURES_PATH):
+        return np.zeros(len(commit_hashes), dtype=bool)
+    features = load_diff_features(DIFF_FEATURES_PATH)
+    if not len(features['commit_id']):
+        return np.zeros(len(commit_hashes), dtype=bool)
+    rows = pd.Index(features['commit_id']).get_indexer(commit_hashes)
+    docs_only = only_extensions_mask(features, DOC_FEATURE_EXTENSIONS)
+    return (rows >= 0) & docs_only[rows]
+
 # --- NEW: Function to Call Your Fine-Tuned Model ---
 
 
@@ -99,16 +116,7 @@ def classify_batch_with_tuned_model(endpoint_id, messages_batch,project_id,regio
     
     for message in messages_batch:
         try:
-            prompt = (
-        "You are a world-class software engineering analyst specializing in the libxml2 library. "
-        "Analyze the following commit message and classify it. Respond ONLY with a valid JSON object "
-        "containing three keys: a boolean 'is_bug_fix', the string 'category', and a one-sentence 'reasoning'.\n\n"
-        "AVAILABLE CATEGORIES:\n"
-        "[\"Parser Logic\", \"Memory\", \"General Logic Error\", \"API Logic\", \"Security Vulnerability (CVE)\", \"Integer\", \"Error Handling\", \"Concurrency\", \"Type System\", \"State Management\", \"Performance\", \"Incorrect Output/Calculation\", \"Standard Library Misuse\", \"Build/CI/Tests\", \"Refactoring\", \"Documentation\", \"Feature/Enhancement\", \"Non-Maintenance\"]\n\n"
-        "--- COMMIT MESSAGE ---\n"
-        f"{message}"
-    )
-
+            prompt = render_message_prompt(message)
 
             response = tuned_model.generate_content([prompt])
             raw_response_str = response.candidates[0].content.parts[0].text
@@ -129,9 +137,7 @@ if __name__ == "__main__":
     except Exception as e:
         exit(f"Error initializing Vertex AI SDK: {e}")
 
-    repo = Repo(LOCAL_REPO_PATH)
-    commits = list(repo.iter_commits())
-    df = pd.DataFrame([{"commit_hash": c.hexsha, "message": c.message} for c in tqdm(commits, desc="Extracting Commits")])
+    df = load_commit_index(LOCAL_REPO_PATH)[['commit_id', 'message']].rename(columns={'commit_id': 'commit_hash'})
     
     
     # --- PHASE 1: SEPARATE HEURISTIC AND MODEL WORK ---
@@ -142,10 +148,13 @@ if __name__ == "__main__":
     model_batch_indices = []                   # Indices of rows that need the model
     model_batch_messages = []                  # Messages for the rows that need the model
     heuristic_count = 0
+    docs_only = diff_feature_docs_only(df['commit_hash'])
 
     for index, row in tqdm(df.iterrows(), total=df.shape[0], desc="Running Heuristics"):
         message = row['message']
         heuristic_result = classify_commit_heuristically(message)
+        if heuristic_result is None and docs_only[index]:
+            heuristic_result = {"is_bug_fix": False, "category": "Documentation", "reasoning": "Diff stats: only documentation files changed"}
         
         if heuristic_result:
             # If heuristic is confident, store its result immediately
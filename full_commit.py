@@ -1,12 +1,16 @@
 import os
+import subprocess
 import pandas as pd
-from tqdm import tqdm
 from dotenv import load_dotenv
-from git import Repo
+from commit_extraction import read_high_water_mark, write_high_water_mark, incremental_rev_range
+from commit_index import load_commit_index, select_commits, parse_datetimes
 
 REPO_URL = "https://gitlab.gnome.org/GNOME/libxml2.git"
 LOCAL_REPO_PATH = "./repos/c/libxml2"
 OUTPUT_CSV_PATH = "full_commit_data.csv"
+HIGH_WATER_MARK_FILE = "full_commit_data_last_processed_head" # HEAD full_commit_data.csv is up to date with
+# Set INCREMENTAL_EXTRACTION=1 to only extract the commits added since the last run.
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION") == "1"
 
 
 
@@ -21,29 +25,35 @@ if __name__ == "__main__":
         # Git().clone(REPO_URL, LOCAL_REPO_PATH)
         # print("Cloning complete.")
     
-    # 2. Open the repository
-    print(f"Opening repository at: {LOCAL_REPO_PATH}")
-    repo = Repo(LOCAL_REPO_PATH)
+    # 2. Load the cached commit index (built once per HEAD, see commit_index.py)
+    print(f"Loading commit index for: {LOCAL_REPO_PATH}")
+    try:
+        index = load_commit_index(LOCAL_REPO_PATH)
+    except subprocess.CalledProcessError as e:
+        exit(f"Error: could not read the history of {LOCAL_REPO_PATH} (no commits yet?): {e.stderr.decode(errors='replace').strip()}")
+    if index.empty:
+        exit(f"Error: no commits found in {LOCAL_REPO_PATH}; nothing to write.")
 
-    # 3. Extract all commits from the default branch's history
-    # This is efficient and correct.
+    # 3. Select the commits to write: everything, or only what is new since the last run
+    head_sha = index['commit_id'].iloc[0]
+    last_head = read_high_water_mark(HIGH_WATER_MARK_FILE) if INCREMENTAL_EXTRACTION and os.path.exists(OUTPUT_CSV_PATH) else None
+    rev_range = incremental_rev_range(LOCAL_REPO_PATH, last_head, head_sha) if last_head != head_sha else f"{head_sha}..{head_sha}"
+    appending = ".." in rev_range
+    if appending:
+        print(f"Incremental extraction of {rev_range}")
 
-    commits = list(repo.iter_commits())
-    
-    # 4. Create a DataFrame using a list comprehension with a tqdm progress bar
-    # This is the best way to do it - fast and provides user feedback.
-    print(f"Found {len(commits)} commits. Extracting full details...")
-    full_commit_data = []
-    for c in tqdm(commits, desc="Extracting Commits"):
-        full_commit_data.append({
-            "commit_id": c.hexsha,
-            "message": c.message,
-            "author_name": c.author.name,
-            "authored_datetime": c.authored_datetime # This is the key timestamp!
-        })
-
-    df = pd.DataFrame(full_commit_data)
-    df.to_csv(OUTPUT_CSV_PATH, index=False)
+    commits = select_commits(index, LOCAL_REPO_PATH, rev_range)
+    print(f"Found {len(commits)} commits.")
+
+    # 4. The table keeps the original columns; authored_datetime is the key timestamp
+    df = commits[["commit_id", "message", "author_name"]].assign(
+        authored_datetime=parse_datetimes(commits['authored_datetime'])
+    )
+    if appending:
+        df.to_csv(OUTPUT_CSV_PATH, mode='a', header=False, index=False)
+    else:
+        df.to_csv(OUTPUT_CSV_PATH, index=False)
+    write_high_water_mark(HIGH_WATER_MARK_FILE, head_sha)
 
     print(f"\nSuccessfully saved {len(df)} commits to {OUTPUT_CSV_PATH}")
 
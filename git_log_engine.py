@@ -0,0 +1,156 @@
+import re
+import subprocess
+import tempfile
+from datetime import datetime
+from tqdm import tqdm
+from commit_extraction import join_file_patches
+
+# --- Streaming `git log -p` extraction engine ---
+# Produces the same records as commit_extraction.iter_commit_records() from a
+# single `git log -p` subprocess instead of building a GitPython diff object
+# graph per commit. Output is parsed line by line, so memory stays flat no
+# matter how large the history is.
+#
+# The diff options mirror what GitPython runs for commit.diff(parent, create_patch=True):
+#   -R                            commit.diff(parent) diffs the commit *against* its parent
+#   --diff-merges=first-parent    merges are diffed against parents[0] only (git >= 2.31)
+#   -M --full-index --no-color    GitPython's default diff arguments
+
+RECORD_SEP = b"\x1e"
+FIELD_SEP = b"\x1f"
+LOG_FORMAT = "%x1e%H%x1f%P%x1f%an%x1f%aI%x1f%B%x1e"
+GIT_LOG_ARGS = [
+    "log", "-p", "-R", "--diff-merges=first-parent",
+    "-M", "--full-index", "--no-color", "--no-ext-diff",
+    f"--format={LOG_FORMAT}",
+]
+
+# Extended header lines git prints between "diff --git" and the patch body.
+# GitPython strips these (and the ---/+++ lines) from diff_item.diff.
+PATCH_HEADER_PREFIXES = (
+    b"old mode ", b"new mode ", b"deleted file mode ", b"new file mode ",
+    b"copy from ", b"copy to ", b"rename from ", b"rename to ",
+    b"similarity index ", b"dissimilarity index ", b"index ",
+)
+
+# Under -R git labels the commit side "b/" and the parent side "a/"; GitPython
+# labels them the other way round in "Binary files ... differ" lines.
+BINARY_LINE_RE = re.compile(rb"^Binary files (?:b/(?P<old>.*)|(?P<old_null>/dev/null)) and (?:a/(?P<new>.*)|(?P<new_null>/dev/null)) differ$")
+
+
+def _relabel_binary_line(line):
+    match = BINARY_LINE_RE.match(line.rstrip(b"\n"))
+    if not match:
+        return line
+    old = b"a/" + match["old"] if match["old"] is not None else match["old_null"]
+    new = b"b/" + match["new"] if match["new"] is not None else match["new_null"]
+    return b"Binary files " + old + b" and " + new + b" differ\n"
+
+
+def _decode_patch(lines):
+    return b"".join(lines).decode('utf-8', errors='replace')
+
+
+def _path_from_diff_line(line):
+    """
+    Path of the file on the commit side of a "diff --git b/<path> a/<old path>"
+    line (labels are swapped by -R). Quoted paths are returned unquoted but not
+    unescaped.
+    """
+    rest = line[len(b"diff --git "):].rstrip(b"\n").replace(b'"', b"")
+    if rest.startswith(b"b/"):
+        rest = rest[2:]
+    return rest.rsplit(b" a/", 1)[0].decode('utf-8', errors='replace')
+
+
+def _parse_header(header):
+    """Splits the --format block into the record's metadata fields."""
+    commit_id, parents, author_name, authored_iso, message = header.split(FIELD_SEP, 4)
+    return {
+        "commit_id": commit_id.decode(),
+        "parents": parents.split(),
+        "message": message.decode('utf-8', errors='replace'),
+        "author_name": author_name.decode('utf-8', errors='replace'),
+        "authored_datetime": datetime.fromisoformat(authored_iso.decode()),
+    }
+
+
+def _build_record(meta, patches):
+    # Root commits have no parent to diff against (same as get_commit_diff_only).
+    file_patches = [(path, _decode_patch(lines)) for path, lines in patches] if meta["parents"] else []
+    diff, diff_files = join_file_patches(file_patches)
+    return {
+        "commit_id": meta["commit_id"],
+        "message": meta["message"],
+        "diff": diff,
+        "author_name": meta["author_name"],
+        "authored_datetime": meta["authored_datetime"],
+        "diff_files": diff_files,
+    }
+
+
+def parse_git_log_stream(lines):
+    """
+    Incrementally parses `git log -p` output (an iterable of byte lines produced
+    with GIT_LOG_ARGS) and yields one record per commit.
+    """
+    meta = None
+    header = None        # bytes of a --format block that is still being read
+    patches = []         # one (path, body lines) pair per file in the current commit
+    in_file_header = False
+
+    for line in lines:
+        if header is not None:
+            header += line
+        elif line.startswith(RECORD_SEP):
+            if meta is not None:
+                yield _build_record(meta, patches)
+            header, meta, patches = line[1:], None, []
+            in_file_header = False
+        elif line.startswith(b"diff --git "):
+            patches.append((_path_from_diff_line(line), []))
+            in_file_header = True
+        elif in_file_header:
+            if line.startswith(b"--- "):
+                continue
+            if line.startswith(b"+++ "):
+                in_file_header = False
+                continue
+            if line.startswith(PATCH_HEADER_PREFIXES):
+                continue
+            in_file_header = False
+            if line.startswith(b"Binary files "):
+                line = _relabel_binary_line(line)
+            patches[-1][1].append(line)
+        elif patches:
+            patches[-1][1].append(line)
+
+        if header is not None and header.rstrip(b"\n").endswith(RECORD_SEP):
+            meta = _parse_header(header.rstrip(b"\n")[:-1])
+            header = None
+
+    if meta is not None:
+        yield _build_record(meta, patches)
+
+
+def iter_commit_records_git_log(repo_path, rev="HEAD"):
+    """
+    Drop-in alternative to commit_extraction.iter_commit_records(): yields the
+    same records (commit_id, message, diff, author_name, authored_datetime,
+    diff_files) in the same newest-first order, streamed from one `git log -p`
+    process.
+    """
+    cmd = ["git", "-C", repo_path, *GIT_LOG_ARGS, rev, "--"]
+    # stderr goes to a file, not a pipe: warnings filling a pipe nobody reads
+    # until stdout ends would block git, and with it this reader.
+    with tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            yield from tqdm(parse_git_log_stream(proc.stdout), desc="Extracting Commits & Diffs (git log)")
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+    if returncode != 0:
+        raise RuntimeError(f"git log failed with exit code {returncode}: {stderr.decode(errors='replace').strip()}")
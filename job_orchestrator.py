@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import asyncio
+import importlib
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from storage_backends import backend_from_env, download_many
+from jsonl_shards import batch_source_uris, manifest_path_for
+from batch_emulator import run_emulator
+from result_cache import REQUEST_KEYS_CSV
+
+# 05_data_merge_analysis.py owns the classified output format.
+data_merge = importlib.import_module("05_data_merge_analysis")
+
+# --- Configuration ---
+# Runs the cloud half of the pipeline for many repositories at once:
+#
+#   tuning job -> batch prediction job -> download predictions -> merge
+#
+# The merge is 05_data_merge_analysis.py's: parse, re-attach the results the
+# result cache served (from the repository's request key sidecar) and save.
+#
+# Each repository is one asyncio task, so a refresh of N repositories takes
+# about as long as its slowest repository rather than the sum of all of them.
+# Job status is polled with exponential backoff (POLL_INITIAL_SECONDS growing
+# by POLL_BACKOFF up to POLL_MAX_SECONDS). Blocking SDK calls run in worker
+# threads.
+#
+# Every stage is recorded in ORCHESTRATOR_STATE together with a run id, a
+# digest of the inputs it ran on (tuning: the uploaded training data; batch,
+# download and merge: the uploaded batch input and the model). After a
+# restart, finished stages with the same run id are skipped and their running
+# jobs are polled again instead of being resubmitted. Once an input is
+# uploaded again with different content, the stage and everything after it
+# run again. Failed stages are retried.
+#
+# Blob paths may contain "{repo}", which is replaced by the repository name,
+# e.g. BLOB_BATCHING_RESULTS="batching/{repo}/results/".
+load_dotenv()
+PROJECT_ID = os.getenv("PROJECT_ID")
+REGION = os.getenv("REGION")
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+BLOB_TRAINING_DESTINATION = os.getenv("BLOB_TRAINING_DESTINATION", "")
+BLOB_BATCHING_TO_CLASSIFY_DESTINATION = os.getenv("BLOB_BATCHING_TO_CLASSIFY_DESTINATION", "")
+BLOB_BATCHING_RESULTS = os.getenv("BLOB_BATCHING_RESULTS", "")
+ORCHESTRATOR_STATE = os.getenv("ORCHESTRATOR_STATE", "job_orchestrator/state.json")
+RUN_TUNING = os.getenv("ORCHESTRATOR_TUNING", "1") == "1"  # 0 = reuse FINETUNED_RESOURCENAME/<repo>
+POLL_INITIAL_SECONDS = float(os.getenv("POLL_INITIAL_SECONDS", "30"))
+POLL_MAX_SECONDS = float(os.getenv("POLL_MAX_SECONDS", "600"))
+POLL_BACKOFF = 1.5
+POLL_ERROR_LIMIT = 5  # consecutive failed status checks before a job is given up on
+BASE_MODEL = "gemini-2.5-flash"  # same as 03_model_training.py
+MODEL_RESOURCE_DIR = "FINETUNED_RESOURCENAME"
+PREDICTIONS_DIR = "CLASSIFED_FULL_JSONL"
+CLASSIFIED_DIR = "FINAL_CLASSIFIED_FULL_DATA"
+# Each repository's request key sidecar (see result_cache.py). The default is
+# where multi_repo_scheduler.py puts a repository's extraction output.
+REQUEST_KEYS_PATH = os.getenv("ORCHESTRATOR_REQUEST_KEYS",
+                              os.path.join(os.getenv("MULTI_REPO_OUTPUT_ROOT", "multi_repo_output"), "{repo}", REQUEST_KEYS_CSV))
+STAGES = ["tuning", "batch", "download", "merge"]
+
+
+def repo_blob(template, repo):
+    return template.replace("{repo}", repo)
+
+
+def repo_job_spec(repo):
+    """Every name and location the jobs of one repository need."""
+    return {
+        "repo": repo,
+        "display_name": f"{repo}_classifier_with_diffs_v2",
+        "training_uri": f"gs://{GCS_BUCKET_NAME}/{repo_blob(BLOB_TRAINING_DESTINATION, repo)}",
+        "training_blob": repo_blob(BLOB_TRAINING_DESTINATION, repo),
+        "source_blob": repo_blob(BLOB_BATCHING_TO_CLASSIFY_DESTINATION, repo),
+        "output_prefix": repo_blob(BLOB_BATCHING_RESULTS, repo),
+        "model_resource_file": os.path.join(MODEL_RESOURCE_DIR, repo),
+        "predictions_dir": os.path.join(PREDICTIONS_DIR, repo),
+        "classified_csv": os.path.join(CLASSIFIED_DIR, repo, "fully_classified.csv"),
+        "request_keys_csv": repo_blob(REQUEST_KEYS_PATH, repo),
+    }
+
+
+class JobFailed(Exception):
+    pass
+
+
+def input_digest(backend, names, *extra):
+    """
+    Run id of a stage: md5 over the stored checksums of the given objects
+    (missing ones count as None) and any extra strings, e.g. the model name.
+    """
+    digest = hashlib.md5()
+    for name in names:
+        info = backend.stat(name)
+        digest.update(f"{name}:{info and (info['md5'] or info['crc32c'])}\n".encode())
+    for value in extra:
+        digest.update(f"{value}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+# --- Job services ---
+# submit(kind, spec) -> job id; poll(kind, job_id) -> {"state": "running" |
+# "succeeded" | "failed", "result": {...}, "error": str}. kind is "tuning" or
+# "batch". Batch results carry the output prefix inside the bucket.
+
+class VertexJobService:
+    """Tuning (vertexai.tuning.sft) and batch prediction (aiplatform) jobs on Vertex AI."""
+
+    def __init__(self, project_id, region):
+        import vertexai
+        from google.cloud import aiplatform
+        vertexai.init(project=project_id, location=region)
+        aiplatform.init(project=project_id, location=region)
+        self.aiplatform = aiplatform
+
+    def submit(self, kind, spec):
+        if kind == "tuning":
+            from vertexai.tuning import sft
+            job = sft.train(source_model=BASE_MODEL, tuned_model_display_name=spec["display_name"],
+                            train_dataset=spec["training_uri"])
+            return job.resource_name
+        model = self.aiplatform.Model(model_name=spec["model"])
+        job = model.batch_predict(
+            job_display_name=f"{spec['repo']}_full_classification",
+            gcs_source=spec["source_uris"],
+            gcs_destination_prefix=f"gs://{GCS_BUCKET_NAME}/{spec['output_prefix']}",
+            sync=False,
+        )
+        job.wait_for_resource_creation()
+        return job.resource_name
+
+    def poll(self, kind, job_id):
+        if kind == "tuning":
+            from vertexai.tuning import sft
+            job = sft.SupervisedTuningJob(job_id)
+            if not job.has_ended:
+                return {"state": "running"}
+            if job.has_succeeded:
+                return {"state": "succeeded", "result": {"tuned_model_name": job.tuned_model_name}}
+            return {"state": "failed", "error": str(job.error)}
+        job = self.aiplatform.BatchPredictionJob(job_id)
+        state = job.state.name
+        if state == "JOB_STATE_SUCCEEDED":
+            output_dir = job.output_info.gcs_output_directory
+            return {"state": "succeeded", "result": {"output_prefix": output_dir.split(f"gs://{GCS_BUCKET_NAME}/", 1)[-1]}}
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return {"state": "failed", "error": f"{state}: {job.error}"}
+        return {"state": "running"}
+
+
+class FakeJobService:
+    """
+    In-process stand-in for offline runs. Jobs finish durations[kind] seconds
+    after submission; (kind, repo) pairs in fail fail instead. on_batch_done,
+    if given, is called as on_batch_done(spec, output_prefix) when a batch job
+    finishes, so a caller can write the prediction files there.
+    """
+
+    def __init__(self, durations=None, fail=(), on_batch_done=None):
+        self.durations = durations or {"tuning": 2.0, "batch": 2.0}
+        self.fail = set(fail)
+        self.on_batch_done = on_batch_done
+        self.jobs = {}
+
+    def submit(self, kind, spec):
+        # Timestamped like Vertex output folders, so a later run never writes into an earlier run's folder.
+        job_id = f"fake-{kind}-{spec['repo']}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{len(self.jobs)}"
+        self.jobs[job_id] = {"kind": kind, "spec": spec, "done_at": time.monotonic() + self.durations[kind], "finished": False}
+        return job_id
+
+    def poll(self, kind, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return {"state": "failed", "error": f"unknown job {job_id} (the fake service does not survive restarts)"}
+        if time.monotonic() < job["done_at"]:
+            return {"state": "running"}
+        spec = job["spec"]
+        if (kind, spec["repo"]) in self.fail:
+            return {"state": "failed", "error": "failure requested by the test"}
+        if kind == "tuning":
+            return {"state": "succeeded", "result": {"tuned_model_name": f"projects/fake/locations/local/models/{spec['repo']}"}}
+        output_prefix = f"{spec['output_prefix'].rstrip('/')}/prediction-{job_id}/"
+        if self.on_batch_done is not None and not job["finished"]:
+            self.on_batch_done(spec, output_prefix)
+        job["finished"] = True
+        return {"state": "succeeded", "result": {"output_prefix": output_prefix}}
+
+
+def emulate_batch(spec, output_prefix, backend):
+    """
+    FakeJobService hook for STORAGE_BACKEND=local: runs batch_emulator.py over
+    the requests 02_jsonl_uploader.py put in the bucket directory.
+    """
+    run_emulator(spec["source_uris"], output_prefix, backend)
+
+
+# --- Persisted state ---
+
+class JobStateStore:
+    """{repo: {stage: {"state", "job_id", "result", "error", "updated_at"}}} in a JSON file."""
+
+    def __init__(self, path=ORCHESTRATOR_STATE):
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.data = json.load(f)
+
+    def get(self, repo, stage):
+        return self.data.get(repo, {}).get(stage, {})
+
+    def update(self, repo, stage, **fields):
+        entry = self.data.setdefault(repo, {}).setdefault(stage, {})
+        entry.update(fields, updated_at=datetime.now(timezone.utc).isoformat())
+        self._save()
+
+    def reset_after(self, repo, stage):
+        """Forgets the stages downstream of stage; they belong to the previous job."""
+        stages = self.data.get(repo, {})
+        for later in STAGES[STAGES.index(stage) + 1:]:
+            stages.pop(later, None)
+        self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)  # a crash mid-write never leaves a truncated state file
+
+
+# --- Chained local steps ---
+
+def download_predictions(spec, output_prefix, backend=None):
+    """Downloads every prediction.results*.jsonl under the job's output prefix."""
+    backend = backend or backend_from_env()
+    names = [obj["name"] for obj in backend.list(output_prefix)
+             if "prediction.results" in obj["name"] and obj["name"].endswith(".jsonl")]
+    if not names:
+        raise FileNotFoundError(f"No prediction.results*.jsonl under {backend.uri(output_prefix)}.")
+    files = [(name, os.path.join(spec["predictions_dir"], os.path.basename(name))) for name in names]
+    summary = download_many(backend, files)
+    if summary["failed"]:
+        raise IOError(f"{len(summary['failed'])} prediction file(s) failed to download.")
+    return [local_path for _, local_path in files]
+
+
+def merge_predictions(spec, prediction_files):
+    """Merges the downloaded prediction files into the repository's classified CSV, as 05 does."""
+    records, error_summary = data_merge.merge_results(prediction_files, spec["classified_csv"], spec["request_keys_csv"])
+    return {"records": len(records), "errors": sum(error_summary.values())}
+
+
+# --- Orchestrator ---
+
+class JobOrchestrator:
+    def __init__(self, service, state=None, backend=None, run_tuning=RUN_TUNING,
+                 poll_initial=POLL_INITIAL_SECONDS, poll_max=POLL_MAX_SECONDS):
+        self.service = service
+        self.state = state or JobStateStore()
+        self.backend = backend
+        self.run_tuning = run_tuning
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+
+    def _current_entry(self, repo, stage, run_id):
+        """The stage's state entry, or {} when it belongs to a run on other inputs."""
+        entry = self.state.get(repo, stage)
+        if entry and entry.get("run_id") != run_id:
+            print(f"[{repo}] {stage}: inputs changed since the last run ({entry.get('run_id')} -> {run_id}), running it again.")
+            return {}
+        return entry
+
+    async def run_job(self, repo, kind, spec, run_id=None):
+        """
+        Submits (or re-attaches to) one job and polls it to completion. Returns
+        its result. A job recorded under a different run_id is not reused.
+        """
+        entry = self._current_entry(repo, kind, run_id)
+        if entry.get("state") == "succeeded":
+            print(f"[{repo}] {kind}: already succeeded, skipping.")
+            return entry["result"]
+        if entry.get("state") == "running" and entry.get("job_id"):
+            job_id = entry["job_id"]
+            print(f"[{repo}] {kind}: resuming poll of {job_id}")
+        else:
+            job_id = await asyncio.to_thread(self.service.submit, kind, spec)
+            self.state.reset_after(repo, kind)
+            self.state.update(repo, kind, state="running", job_id=job_id, result=None, error=None, run_id=run_id)
+            print(f"[{repo}] {kind}: submitted {job_id}")
+
+        delay = self.poll_initial
+        poll_errors = 0
+        while True:
+            try:
+                status = await asyncio.to_thread(self.service.poll, kind, job_id)
+                poll_errors = 0
+            except Exception as e:
+                poll_errors += 1
+                if poll_errors >= POLL_ERROR_LIMIT:
+                    self.state.update(repo, kind, state="failed", error=f"status checks failing: {e}")
+                    raise
+                print(f"[{repo}] {kind}: status check failed ({poll_errors}/{POLL_ERROR_LIMIT}). Error: {e}")
+                status = {"state": "running"}
+            if status["state"] == "succeeded":
+                self.state.update(repo, kind, state="succeeded", result=status["result"])
+                print(f"[{repo}] {kind}: succeeded")
+                return status["result"]
+            if status["state"] == "failed":
+                self.state.update(repo, kind, state="failed", error=status.get("error"))
+                raise JobFailed(f"{kind} job {job_id} failed: {status.get('error')}")
+            # Jitter keeps many repositories from polling in lockstep.
+            await asyncio.sleep(delay * random.uniform(0.9, 1.1))
+            delay = min(delay * POLL_BACKOFF, self.poll_max)
+
+    async def run_step(self, repo, step, func, *args, run_id=None):
+        """Runs a blocking local step in a thread, once per run_id."""
+        entry = self._current_entry(repo, step, run_id)
+        if entry.get("state") == "succeeded":
+            print(f"[{repo}] {step}: already succeeded, skipping.")
+            return entry["result"]
+        try:
+            result = await asyncio.to_thread(func, *args)
+        except Exception as e:
+            self.state.update(repo, step, state="failed", error=str(e), run_id=run_id)
+            raise
+        self.state.update(repo, step, state="succeeded", result=result, error=None, run_id=run_id)
+        print(f"[{repo}] {step}: done")
+        return result
+
+    async def run_repo(self, repo):
+        spec = repo_job_spec(repo)
+        backend = self.backend or backend_from_env()
+        if self.run_tuning:
+            tuning_run = await asyncio.to_thread(input_digest, backend, [spec["training_blob"]], BASE_MODEL)
+            tuning = await self.run_job(repo, "tuning", spec, run_id=tuning_run)
+            model_name = tuning["tuned_model_name"]
+            os.makedirs(os.path.dirname(spec["model_resource_file"]), exist_ok=True)
+            with open(spec["model_resource_file"], 'w') as f:
+                f.write(model_name)
+        else:
+            with open(spec["model_resource_file"], 'r') as f:
+                model_name = f.read().strip()
+
+        # The uploaded file, or every shard in the uploaded manifest when 01 wrote shards.
+        source_uris = await asyncio.to_thread(batch_source_uris, backend, spec["source_blob"])
+        # The manifest lists every shard's md5, so it stands for all of them.
+        batch_run = await asyncio.to_thread(
+            input_digest, backend, [spec["source_blob"], manifest_path_for(spec["source_blob"])], model_name)
+        batch = await self.run_job(repo, "batch", {**spec, "model": model_name, "source_uris": source_uris}, run_id=batch_run)
+        prediction_files = await self.run_step(repo, "download", download_predictions, spec, batch["output_prefix"], self.backend, run_id=batch_run)
+        return await self.run_step(repo, "merge", merge_predictions, spec, prediction_files, run_id=batch_run)
+
+    async def run_all(self, repos):
+        """Runs every repository concurrently; one failing repository does not stop the others."""
+        results = await asyncio.gather(*(self.run_repo(repo) for repo in repos), return_exceptions=True)
+        return dict(zip(repos, results))
+
+
+def print_summary(results, elapsed):
+    print("\n--- Job Orchestrator Summary ---")
+    for repo, result in results.items():
+        if isinstance(result, Exception):
+            print(f"{repo}: FAILED ({type(result).__name__}: {result})")
+        else:
+            print(f"{repo}: {result['records']} records, {result['errors']} parse errors")
+    print(f"Wall-clock time: {elapsed:.1f}s")
+
+
+def repos_from_args(argv):
+    if argv:
+        return argv
+    manifest = os.getenv("REPO_MANIFEST")
+    if manifest and os.path.exists(manifest):
+        multi_repo_scheduler = importlib.import_module("multi_repo_scheduler")
+        return [name for name, _ in multi_repo_scheduler.read_manifest(manifest)]
+    return [os.getenv("CURRENT_LANGUAGE_REPO")]
+
+
+if __name__ == "__main__":
+    # Usage: python job_orchestrator.py [--fake] [repo ...]
+    # Without repo names: the names in REPO_MANIFEST, else CURRENT_LANGUAGE_REPO.
+    # --fake uses FakeJobService and batch_emulator.py; run it with STORAGE_BACKEND=local.
+    args = sys.argv[1:]
+    use_fake = "--fake" in args
+    repos = [arg for arg in args if arg != "--fake"]
+    repos = [repo for repo in repos_from_args(repos) if repo]
+    if not repos:
+        exit("Error: no repositories given (arguments, REPO_MANIFEST or CURRENT_LANGUAGE_REPO).")
+    if not use_fake and not all([PROJECT_ID, REGION, GCS_BUCKET_NAME, BLOB_BATCHING_RESULTS]):
+        raise ValueError("FATAL: One or more required environment variables are not set.")
+
+    if use_fake:
+        backend = backend_from_env()
+        service = FakeJobService(on_batch_done=lambda spec, output_prefix: emulate_batch(spec, output_prefix, backend))
+        orchestrator = JobOrchestrator(service, backend=backend, poll_initial=0.5, poll_max=2.0)
+    else:
+        orchestrator = JobOrchestrator(VertexJobService(PROJECT_ID, REGION))
+    start = time.perf_counter()
+    results = asyncio.run(orchestrator.run_all(repos))
+    print_summary(results, time.perf_counter() - start)
+    sys.exit(1 if any(isinstance(result, Exception) for result in results.values()) else 0)
@@ -1,30 +1,287 @@
+import os
+import sys
+import gzip
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from diff_budget import estimate_tokens
+from prompt_builder import ALL_CATEGORIES
+from jsonl_shards import read_manifest, MANIFEST_SUFFIX
 
-def validate_gemini_jsonl(file_path):
-    line_num = 0
-    with open(file_path, 'r') as f:
-        for line in f:
-            line_num += 1
+try:
+    import orjson
+    _loads = orjson.loads
+    _DecodeError = orjson.JSONDecodeError
+except ImportError:
+    _loads = json.loads
+    _DecodeError = json.JSONDecodeError
+
+# --- Parallel JSONL validator ---
+# Checks a batch-request or tuning JSONL file before it is uploaded. The file
+# is cut into chunks at newline boundaries and the chunks are validated in a
+# process pool; key uniqueness is checked across chunks (and across shards
+# when a jsonl_shards manifest is given) once all chunks are back.
+#
+# Line formats (detected per line):
+#   batch      {"request": {"contents": [user turn]}, "key": "<commit id>"}
+#   contents   {"contents": [user turn, model turn]}          (Gemini tuning)
+#   messages   {"messages": [user message, assistant message]}
+# The model/assistant answer of tuning lines must be JSON with a boolean
+# is_bug_fix, a category from ALL_CATEGORIES and a string reasoning.
+#
+# The result is a JSON report (counts per error code plus the first
+# MAX_REPORTED_ERRORS errors with file, line number and byte offset).
+
+INPUT_JSONL = "full_commit_jsonl/FULL_commit_toclassify.jsonl"
+REPORT_PATH = os.getenv("JSONL_CHECK_REPORT", "jsonl_check_report.json")
+NUM_WORKERS = int(os.getenv("JSONL_CHECK_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_BYTES = 64 * 1024 * 1024
+MAX_LINE_BYTES = int(os.getenv("JSONL_MAX_LINE_BYTES", str(10 * 1024 * 1024)))
+MAX_PROMPT_TOKENS = int(os.getenv("JSONL_MAX_PROMPT_TOKENS", "1000000"))
+MAX_REPORTED_ERRORS = 10000
+CATEGORY_SET = frozenset(ALL_CATEGORIES)
+TURN_ROLES = {"contents": ("user", "model"), "messages": ("user", "assistant")}
+
+
+# --- Line checks ---
+
+class LineError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _check_parts(turn, where):
+    parts = turn.get("parts")
+    if not isinstance(parts, list) or not parts:
+        raise LineError("bad_parts", f"{where}: 'parts' must be a non-empty list.")
+    texts = []
+    for part in parts:
+        if not isinstance(part, dict) or not isinstance(part.get("text"), str):
+            raise LineError("bad_parts", f"{where}: every part needs a string 'text'.")
+        texts.append(part["text"])
+    return "".join(texts)
+
+
+def _check_contents(contents, where):
+    """Validates a Gemini 'contents' list; returns [(role, text)]."""
+    if not isinstance(contents, list) or not contents:
+        raise LineError("bad_contents", f"{where}: 'contents' must be a non-empty list.")
+    turns = []
+    for i, turn in enumerate(contents):
+        if not isinstance(turn, dict):
+            raise LineError("bad_contents", f"{where}[{i}] must be an object.")
+        role = turn.get("role")
+        if role not in ("user", "model"):
+            raise LineError("bad_role", f"{where}[{i}]: role must be 'user' or 'model', got {role!r}.")
+        turns.append((role, _check_parts(turn, f"{where}[{i}]")))
+    return turns
+
+
+def _check_messages(messages):
+    if not isinstance(messages, list) or not messages:
+        raise LineError("bad_messages", "'messages' must be a non-empty list.")
+    turns = []
+    for i, message in enumerate(messages):
+        if not isinstance(message, dict) or not isinstance(message.get("content"), str):
+            raise LineError("bad_messages", f"messages[{i}] needs a string 'content'.")
+        role = message.get("role")
+        if role not in ("system", "user", "assistant"):
+            raise LineError("bad_role", f"messages[{i}]: role must be 'system', 'user' or 'assistant', got {role!r}.")
+        turns.append((role, message["content"]))
+    return [turn for turn in turns if turn[0] != "system"]
+
+
+def _check_answer(text):
+    try:
+        answer = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise LineError("bad_answer", f"answer is not valid JSON: {e}")
+    if not isinstance(answer, dict):
+        raise LineError("bad_answer", "answer must be a JSON object.")
+    if not isinstance(answer.get("is_bug_fix"), bool):
+        raise LineError("bad_answer", "answer 'is_bug_fix' must be a boolean.")
+    if answer.get("category") not in CATEGORY_SET:
+        raise LineError("unknown_category", f"answer category {answer.get('category')!r} is not in ALL_CATEGORIES.")
+    if not isinstance(answer.get("reasoning"), str):
+        raise LineError("bad_answer", "answer 'reasoning' must be a string.")
+
+
+def _check_tuning_turns(turns, line_format):
+    user_role, answer_role = TURN_ROLES[line_format]
+    if len(turns) < 2 or turns[-1][0] != answer_role:
+        raise LineError("bad_turns", f"a {line_format} example must end with a '{answer_role}' turn.")
+    for i, (role, _) in enumerate(turns):
+        if role != (user_role if i % 2 == 0 else answer_role):
+            raise LineError("bad_turns", f"turns must alternate {user_role}/{answer_role}, starting with {user_role}.")
+    _check_answer(turns[-1][1])
+
+
+def check_line(line):
+    """Validates one JSONL line (bytes). Returns (format, key or None); raises LineError."""
+    if len(line) > MAX_LINE_BYTES:
+        raise LineError("line_too_large", f"line is {len(line)} bytes (limit {MAX_LINE_BYTES}).")
+    try:
+        data = _loads(line)
+    except (_DecodeError, UnicodeDecodeError) as e:
+        raise LineError("invalid_json", f"invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise LineError("invalid_json", "line must be a JSON object.")
+
+    key = None
+    if "request" in data:
+        line_format = "batch"
+        if set(data) != {"request", "key"}:
+            raise LineError("bad_top_level", f"batch lines need exactly 'request' and 'key', got {sorted(data)}.")
+        key = data["key"]
+        if not isinstance(key, str) or not key:
+            raise LineError("bad_key", "'key' must be a non-empty string.")
+        if not isinstance(data["request"], dict):
+            raise LineError("bad_contents", "'request' must be an object.")
+        turns = _check_contents(data["request"].get("contents"), "request.contents")
+        if turns[-1][0] != "user":
+            raise LineError("bad_turns", "a batch request must end with a 'user' turn.")
+    elif "contents" in data:
+        line_format = "contents"
+        turns = _check_contents(data["contents"], "contents")
+        _check_tuning_turns(turns, line_format)
+    elif "messages" in data:
+        line_format = "messages"
+        turns = _check_messages(data["messages"])
+        _check_tuning_turns(turns, line_format)
+    else:
+        raise LineError("unknown_format", "line has none of 'request', 'contents' or 'messages'.")
+
+    prompt_tokens = sum(estimate_tokens(text) for role, text in turns if role == "user")
+    if prompt_tokens > MAX_PROMPT_TOKENS:
+        raise LineError("prompt_too_long", f"prompt is ~{prompt_tokens} tokens (limit {MAX_PROMPT_TOKENS}).")
+    return line_format, key
+
+
+# --- Chunked, parallel driver ---
+
+def plan_chunks(path, chunk_bytes=CHUNK_BYTES):
+    """[(path, start, end)] byte ranges that each end just after a newline."""
+    if path.endswith(".gz"):
+        return [(path, 0, -1)]  # compressed shards cannot be split; one chunk each
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()  # move the boundary past the next newline
+                end = f.tell()
+            chunks.append((path, start, end))
+            start = end
+    return chunks
+
+
+def read_chunk(path, start, end):
+    if end < 0:
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def validate_chunk(chunk):
+    """Worker: validates one chunk. Line numbers are relative to the chunk."""
+    path, start, end = chunk
+    data = read_chunk(path, start, end)
+    lines = data.split(b"\n")
+    if lines and lines[-1] == b"":
+        lines.pop()
+    formats, keys, errors = {}, [], []
+    offset = start
+    for line_index, line in enumerate(lines):
+        byte_offset = offset if end >= 0 else None  # offsets inside a .gz shard are meaningless
+        if line.strip():
             try:
-                data = json.loads(line)
-                # Check top-level keys
-                if "contents" not in data:
-                    print(f"Error on line {line_num}: Missing 'contents' key.")
-                    continue
-                # Check contents structure (simplified)
-                if not isinstance(data["contents"], list) or not data["contents"]:
-                     print(f"Error on line {line_num}: 'contents' must be a non-empty list.")
-                     continue
-                # Add more specific checks here if needed (e.g., role="user", parts, text)
-                
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON on line {line_num}: {e}")
-            except Exception as e:
-                print(f"An unexpected error occurred on line {line_num}: {e}")
-    print("Validation finished.")
-
-# Replace 'your_input_file.jsonl' with the path to your file
-validate_gemini_jsonl('full_commit_jsonl/FULL_commit_toclassify.jsonl')
+                line_format, key = check_line(line)
+                formats[line_format] = formats.get(line_format, 0) + 1
+                if key is not None:
+                    keys.append((key, line_index, byte_offset))
+            except LineError as e:
+                errors.append({"code": e.code, "message": str(e), "line_index": line_index, "byte_offset": byte_offset})
+        else:
+            errors.append({"code": "empty_line", "message": "empty line.", "line_index": line_index, "byte_offset": byte_offset})
+        offset += len(line) + 1
+    return {"path": path, "lines": len(lines), "formats": formats, "keys": keys, "errors": errors}
+
+
+def input_files(path):
+    """A JSONL file, or every shard listed in a jsonl_shards manifest."""
+    if path.endswith(MANIFEST_SUFFIX):
+        return [shard["local_path"] for shard in read_manifest(path)["shards"]]
+    return [path]
+
+
+def validate_gemini_jsonl(file_path=INPUT_JSONL, report_path=REPORT_PATH, num_workers=NUM_WORKERS):
+    """Validates a JSONL file (or manifest of shards) and writes the JSON report. Returns the report."""
+    start_time = time.perf_counter()
+    files = input_files(file_path)
+    chunks = [chunk for path in files for chunk in plan_chunks(path)]
+    print(f"Validating {len(files)} file(s) in {len(chunks)} chunks with {num_workers} workers...")
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        results = list(pool.map(validate_chunk, chunks))
+
+    # Chunks come back in file order, so line numbers are running totals per file.
+    error_counts, formats, errors = {}, {}, []
+    first_seen = {}
+    lines_before = {path: 0 for path in files}
+    total_lines = 0
+
+    def report(error):
+        error_counts[error["code"]] = error_counts.get(error["code"], 0) + 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(error)
+
+    for result in results:
+        path, base = result["path"], lines_before[result["path"]]
+        for name, count in result["formats"].items():
+            formats[name] = formats.get(name, 0) + count
+        for error in result["errors"]:
+            report({"file": path, "line": base + error.pop("line_index") + 1, **error})
+        for key, line_index, offset in result["keys"]:
+            location = (path, base + line_index + 1)
+            if key in first_seen:
+                report({"file": path, "line": location[1], "byte_offset": offset, "code": "duplicate_key",
+                        "message": f"key {key} already used at {first_seen[key][0]}:{first_seen[key][1]}."})
+            else:
+                first_seen[key] = location
+        lines_before[path] += result["lines"]
+        total_lines += result["lines"]
+
+    errors.sort(key=lambda error: (files.index(error["file"]), error["line"]))
+    report_data = {
+        "input": file_path,
+        "files": files,
+        "lines": total_lines,
+        "formats": formats,
+        "valid": not error_counts,
+        "error_counts": error_counts,
+        "errors": errors,
+        "errors_truncated": sum(error_counts.values()) > len(errors),
+        "seconds": round(time.perf_counter() - start_time, 3),
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report_data, f, indent=2)
 
+    print(f"Checked {total_lines} lines ({', '.join(f'{n} {name}' for name, n in formats.items()) or 'none valid'}) "
+          f"in {report_data['seconds']}s.")
+    for code, count in sorted(error_counts.items()):
+        print(f"- {code}: {count}")
+    print(f"Validation finished: {'OK' if report_data['valid'] else 'ERRORS FOUND'}. Report: {report_path}")
+    return report_data
 
 
+if __name__ == "__main__":
+    # Usage: python jsonl_check.py [file.jsonl | shards.manifest.json] [report.json]
+    target = sys.argv[1] if len(sys.argv) > 1 else INPUT_JSONL
+    result = validate_gemini_jsonl(target, sys.argv[2] if len(sys.argv) > 2 else REPORT_PATH)
+    sys.exit(0 if result["valid"] else 1)
@@ -0,0 +1,190 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import hashlib
+import posixpath
+
+# --- Sharded JSONL output ---
+# Splits a JSONL output into numbered shards, each capped by line count
+# and/or (uncompressed) byte size and optionally gzip-compressed, so every
+# file stays under batch prediction input limits and can be uploaded,
+# retried and processed on its own. Lines are never split across shards.
+#
+#   FULL_commit_toclassify-00000.jsonl[.gz]
+#   FULL_commit_toclassify-00001.jsonl[.gz]
+#   FULL_commit_toclassify.manifest.json
+#
+# The manifest lists every shard with its row count, sizes and the md5 of the
+# file exactly as stored on disk (the same digest GCS reports for an object).
+
+MANIFEST_SUFFIX = ".manifest.json"
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def manifest_path_for(base_path):
+    """FULL_commit_toclassify.jsonl -> FULL_commit_toclassify.manifest.json"""
+    return os.path.splitext(base_path)[0] + MANIFEST_SUFFIX
+
+
+def shard_path_for(base_path, shard_index, compress=False):
+    stem, ext = os.path.splitext(base_path)
+    return f"{stem}-{shard_index:05d}{ext or '.jsonl'}{'.gz' if compress else ''}"
+
+
+class _HashingFile:
+    """Write-only file wrapper that keeps an md5 of everything written through it."""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER_SIZE)
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ShardedJsonlWriter:
+    """
+    Drop-in for a binary JSONL file handle (write(line_bytes) / close(), usable
+    as a context manager). Pass max_lines and/or max_bytes (0 = no cap) and
+    compress=True for .jsonl.gz shards. The manifest is written on close().
+    """
+
+    def __init__(self, base_path, max_lines=0, max_bytes=0, compress=False):
+        self.base_path = base_path
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.shards = []
+        self.current = None
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        # Shards left over from a previous, larger run would otherwise look current.
+        stem, ext = os.path.splitext(base_path)
+        for stale in glob.glob(f"{glob.escape(stem)}-[0-9][0-9][0-9][0-9][0-9]{ext}*"):
+            os.remove(stale)
+
+    def _open_shard(self):
+        path = shard_path_for(self.base_path, len(self.shards), self.compress)
+        raw = _HashingFile(path)
+        # mtime=0 keeps the gzip output (and so its md5) identical across runs.
+        stream = gzip.GzipFile(filename="", mode='wb', fileobj=raw, mtime=0) if self.compress else raw
+        self.current = {"path": path, "raw": raw, "stream": stream, "rows": 0, "bytes": 0}
+
+    def _close_shard(self):
+        shard = self.current
+        if self.compress:
+            shard["stream"].close()
+        shard["raw"].close()
+        self.shards.append({
+            "path": os.path.basename(shard["path"]),
+            "rows": shard["rows"],
+            "uncompressed_bytes": shard["bytes"],
+            "bytes": shard["raw"].size,
+            "md5": shard["raw"].md5.hexdigest(),
+        })
+        self.current = None
+
+    def write(self, line):
+        shard = self.current
+        if shard is not None and shard["rows"] and (
+            (self.max_lines and shard["rows"] >= self.max_lines)
+            or (self.max_bytes and shard["bytes"] + len(line) > self.max_bytes)
+        ):
+            self._close_shard()
+            shard = None
+        if shard is None:
+            self._open_shard()
+            shard = self.current
+        shard["stream"].write(line)
+        shard["rows"] += 1
+        shard["bytes"] += len(line)
+
+    def close(self):
+        if self.current is not None:
+            self._close_shard()
+        manifest = {
+            "base_path": os.path.basename(self.base_path),
+            "compression": "gzip" if self.compress else None,
+            "max_lines": self.max_lines,
+            "max_bytes": self.max_bytes,
+            "total_rows": sum(shard["rows"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        with open(manifest_path_for(self.base_path), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Wrote {manifest['total_rows']} rows in {len(self.shards)} shards; manifest: {manifest_path_for(self.base_path)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_manifest(manifest_path):
+    """Loads a shard manifest; shard paths are resolved relative to the manifest."""
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(manifest_path)
+    for shard in manifest["shards"]:
+        shard["local_path"] = os.path.join(base_dir, shard["path"])
+    return manifest
+
+
+def file_md5(path, chunk_size=WRITE_BUFFER_SIZE):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def verify_shards(manifest_path):
+    """Returns the shards whose file is missing or whose md5 does not match the manifest."""
+    bad = []
+    for shard in read_manifest(manifest_path)["shards"]:
+        if not os.path.exists(shard["local_path"]) or file_md5(shard["local_path"]) != shard["md5"]:
+            bad.append(shard)
+    return bad
+
+
+def shard_blob_names(manifest, destination_blob):
+    """Object names of the manifest's shards when uploaded next to destination_blob."""
+    prefix = posixpath.dirname(destination_blob)
+    return [posixpath.join(prefix, shard["path"]) for shard in manifest["shards"]]
+
+
+def batch_source_uris(backend, destination_blob):
+    """
+    URIs of the batch input 02_jsonl_uploader.py put at destination_blob:
+    every shard listed in the uploaded manifest, or the single file when no
+    manifest was uploaded. The manifest lists exactly the shards of the last
+    upload, unlike a wildcard, which would also match leftover shards of an
+    earlier, larger run.
+    """
+    manifest_blob = manifest_path_for(destination_blob)
+    if backend.stat(manifest_blob) is None:
+        return [backend.uri(destination_blob)]
+    with backend.open_read(manifest_blob) as f:
+        manifest = json.loads(f.read())
+    return [backend.uri(name) for name in shard_blob_names(manifest, destination_blob)]
+
+
+if __name__ == "__main__":
+    # Usage: python jsonl_shards.py <manifest.json>  -- checks every shard against its md5
+    if len(sys.argv) != 2:
+        exit("Usage: python jsonl_shards.py <manifest.json>")
+    bad = verify_shards(sys.argv[1])
+    for shard in bad:
+        print(f"MISMATCH: {shard['path']}")
+    print("All shards verified." if not bad else f"{len(bad)} shard(s) missing or corrupt.")
@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import binascii
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# --- Indexed join of predictions with commit metadata ---
+# The commit table (full_commit_<repo>.csv) is converted once into a Parquet
+# index sorted by the commit hash stored as a 20-byte binary key:
+#
+#   metadata_index/<table name>.parquet   key (binary 20) + every column except diff
+#
+# The source table's size and mtime go into the file's metadata, and the
+# index is rebuilt automatically when the table changes. A join converts the
+# prediction keys to the same 20-byte form, finds them with
+# np.searchsorted, and reads only the requested columns from the index. Its
+# memory is the projected columns plus 20 bytes per key, never the full
+# table or its diffs.
+METADATA_INDEX_DIR = "metadata_index"
+INDEX_BUILD_CHUNK_ROWS = 50000
+JOIN_CHUNK_ROWS = 500000
+SKIP_COLUMNS = {"diff"}
+
+
+def hex_to_keys(hex_values):
+    """
+    40-character hex commit ids -> (np.ndarray of dtype S20, valid mask).
+    Anything that is not a full hex sha (None, NaN, short ids) is invalid and
+    never matches.
+    """
+    if hasattr(hex_values, "tolist"):
+        hex_values = hex_values.tolist()  # iterating a Series value by value is far slower
+    values = [value if isinstance(value, str) else "" for value in hex_values]
+    valid = np.fromiter(map(len, values), dtype=np.int64, count=len(values)) == 40
+    candidates = [value for value, ok in zip(values, valid) if ok] if not valid.all() else values
+    try:
+        raw = binascii.unhexlify("".join(candidates))
+    except binascii.Error:
+        # Some 40-character id is not hex: find which ones with a regex, then convert the rest.
+        is_hex = pd.Series(candidates, dtype=object).str.fullmatch(r"[0-9a-fA-F]{40}").to_numpy(dtype=bool)
+        valid[np.flatnonzero(valid)[~is_hex]] = False
+        raw = binascii.unhexlify("".join(value for value, ok in zip(candidates, is_hex) if ok))
+    keys = np.zeros(len(values), dtype="S20")
+    keys[valid] = np.frombuffer(raw, dtype="S20")
+    return keys, valid
+
+
+def _keys_from_arrow(column):
+    """Fixed-size binary Arrow column -> S20 array without copying per value."""
+    array = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    return np.frombuffer(array.buffers()[1], dtype="S20", count=len(array), offset=array.offset * 20)
+
+
+def _key_prefixes(keys):
+    """First 8 bytes of each key as a native uint64; sorted keys give sorted prefixes."""
+    strided = np.ndarray(shape=(len(keys),), dtype=">u8", buffer=keys, strides=(20,)) if len(keys) else np.array([], dtype=">u8")
+    return strided.astype(np.uint64)
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def metadata_index_path(table_path, index_dir=METADATA_INDEX_DIR):
+    return os.path.join(index_dir, os.path.splitext(os.path.basename(table_path))[0] + ".parquet")
+
+
+def build_metadata_index(table_path, index_path, key_column="commit_id"):
+    """Converts the commit table into the sorted, diff-free Parquet index."""
+    header = pd.read_csv(table_path, nrows=0).columns
+    usecols = [column for column in header if column not in SKIP_COLUMNS]
+    keys, frames = [], []
+    for chunk in pd.read_csv(table_path, usecols=usecols, chunksize=INDEX_BUILD_CHUNK_ROWS, keep_default_na=False, dtype=str):
+        chunk_keys, valid = hex_to_keys(chunk[key_column])
+        keys.append(chunk_keys[valid])
+        frames.append(chunk[valid])
+    all_keys = np.concatenate(keys) if keys else np.array([], dtype="S20")
+    metadata = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=usecols)
+    order = np.argsort(all_keys, kind="stable")
+
+    table = pa.Table.from_pandas(metadata.iloc[order].reset_index(drop=True), preserve_index=False)
+    sorted_keys = np.ascontiguousarray(all_keys[order])
+    key_array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(20), len(sorted_keys), [None, pa.py_buffer(sorted_keys.tobytes())])
+    table = table.add_column(0, "key", key_array)
+    table = table.replace_schema_metadata({b"source_fingerprint": _fingerprint(table_path).encode()})
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    pq.write_table(table, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    print(f"Built metadata index for {len(all_keys)} commits: {index_path}")
+
+
+class MetadataIndex:
+    """Sorted 20-byte commit keys plus lazily read, projected metadata columns."""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.parquet = pq.ParquetFile(index_path)
+        self.columns = [name for name in self.parquet.schema_arrow.names if name != "key"]
+        self.keys = _keys_from_arrow(self.parquet.read(columns=["key"]).column("key"))
+        self.prefixes = _key_prefixes(self.keys)
+        self._projected = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, name):
+        """One metadata column in index (sorted key) order, read on first use."""
+        if name not in self._projected:
+            self._projected[name] = self.parquet.read(columns=[name]).column(name).to_numpy(zero_copy_only=False)
+        return self._projected[name]
+
+    def find(self, hex_values):
+        """Index positions of the given commit ids and a found mask."""
+        keys, valid = hex_to_keys(hex_values)
+        # Binary search over 8-byte integer prefixes is much faster than over
+        # 20-byte strings. The rare query whose prefix is shared by several
+        # index keys is searched again on the full key.
+        query_prefixes = _key_prefixes(keys)
+        order = np.argsort(query_prefixes)  # sorted queries keep the search cache-friendly
+        positions = np.empty(len(keys), dtype=np.intp)
+        positions[order] = np.searchsorted(self.prefixes, query_prefixes[order])
+        in_range = positions < len(self.keys)
+        found = valid & in_range
+        found[found] = self.keys[positions[found]] == keys[found]
+        retry = valid & in_range & ~found
+        retry[retry] = self.prefixes[positions[retry]] == query_prefixes[retry]
+        if retry.any():
+            positions[retry] = np.searchsorted(self.keys, keys[retry])
+            hit = positions[retry] < len(self.keys)
+            retry_found = np.zeros(hit.shape, dtype=bool)
+            retry_found[hit] = self.keys[positions[retry][hit]] == keys[retry][hit]
+            found[retry] = retry_found
+        return positions, found
+
+    def lookup(self, hex_values, columns):
+        """
+        Metadata for each given commit id, aligned with the input (a
+        prediction-side left join). Missing commits get None.
+        """
+        positions, found = self.find(hex_values)
+        result = {}
+        for name in columns:
+            values = np.full(len(positions), None, dtype=object)
+            values[found] = self.column(name)[positions[found]]
+            result[name] = values
+        return pd.DataFrame(result, index=getattr(hex_values, "index", None))
+
+    def attach(self, predictions, key_column, columns):
+        """
+        Every commit in the index with the projected metadata columns and the
+        prediction columns (a metadata-side left join). If a commit has more
+        than one prediction, the last one wins.
+        """
+        result = pd.DataFrame({name: self.column(name) for name in columns})
+        positions, found = self.find(predictions[key_column])
+        for name in predictions.columns:
+            if name == key_column or name in result.columns:
+                continue
+            values = np.full(len(self.keys), None, dtype=object)
+            values[positions[found]] = predictions[name].to_numpy(dtype=object)[found]
+            result[name] = values
+        return result
+
+
+def load_metadata_index(table_path, index_dir=METADATA_INDEX_DIR):
+    """The index for table_path, built (or rebuilt after the table changed) on first use."""
+    index_path = metadata_index_path(table_path, index_dir)
+    stale = True
+    if os.path.exists(index_path):
+        stored = (pq.read_schema(index_path).metadata or {}).get(b"source_fingerprint", b"").decode()
+        stale = stored != _fingerprint(table_path)
+    if stale:
+        build_metadata_index(table_path, index_path)
+    return MetadataIndex(index_path)
+
+
+def join_csv(predictions_csv, table_path, output_csv, columns, key_column="key", chunksize=JOIN_CHUNK_ROWS):
+    """Streams a predictions CSV through the index, writing it with the projected metadata columns added."""
+    index = load_metadata_index(table_path)
+    rows = matched = 0
+    with open(output_csv, 'w', newline='') as out:
+        for i, chunk in enumerate(pd.read_csv(predictions_csv, chunksize=chunksize)):
+            metadata = index.lookup(chunk[key_column], columns)
+            matched += int(metadata[columns[0]].notna().sum()) if columns else 0
+            rows += len(chunk)
+            chunk.join(metadata.drop(columns=[c for c in columns if c in chunk.columns])).to_csv(out, header=(i == 0), index=False)
+    return rows, matched
+
+
+if __name__ == "__main__":
+    # Usage: python metadata_join.py <predictions.csv> <commit table.csv> <output.csv> <col,col,...>
+    if len(sys.argv) != 5:
+        exit("Usage: python metadata_join.py <predictions.csv> <commit table.csv> <output.csv> <col,col,...>")
+    start = time.perf_counter()
+    rows, matched = join_csv(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4].split(","))
+    print(f"Joined {rows} predictions ({matched} matched) in {time.perf_counter() - start:.2f}s -> {sys.argv[3]}")
@@ -0,0 +1,173 @@
+import os
+import sys
+import csv
+import time
+import shutil
+import importlib
+from itertools import zip_longest
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from git import Repo
+from commit_extraction import commit_to_record, split_into_shards
+from commit_index import load_commit_index, COMMIT_INDEX_DIR
+from diff_budget import apply_diff_budget
+from prompt_builder import batch_request_line, open_jsonl
+
+# 01_data_prepare.py is the single source of the table columns and the diff budget setting.
+data_prepare = importlib.import_module("01_data_prepare")
+
+# --- Configuration ---
+# Runs extraction (commit table + batch JSONL, same as 01_data_prepare.py) for
+# every repository in a manifest through one bounded process pool.
+#
+# Manifest: a CSV with a header row and the columns
+#   name        short name used for the output directory (and as CURRENT_LANGUAGE_REPO)
+#   local_path  path to an existing local clone
+#
+# Every repository's history is cut into shards of SHARD_SIZE commits and the
+# shards of all repositories are queued round-robin, so a huge repository
+# cannot hold the pool while small ones wait behind it.
+MANIFEST_CSV = os.getenv("REPO_MANIFEST", "repos_manifest.csv")
+OUTPUT_ROOT = os.getenv("MULTI_REPO_OUTPUT_ROOT", "multi_repo_output")
+MAX_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+SHARD_SIZE = 250
+PARTS_DIR = "_parts"
+
+
+def read_manifest(manifest_path):
+    """Returns [(name, local_path)] from the manifest CSV."""
+    with open(manifest_path, 'r', newline='') as f:
+        repos = [(row['name'].strip(), row['local_path'].strip()) for row in csv.DictReader(f)]
+    names = [name for name, _ in repos]
+    if len(names) != len(set(names)):
+        raise ValueError(f"FATAL: Repository names in {manifest_path} must be unique.")
+    return repos
+
+
+def repo_output_paths(name):
+    """Isolated output locations for one repository, mirroring 01_data_prepare.py's layout."""
+    repo_root = os.path.join(OUTPUT_ROOT, name)
+    return {
+        "root": repo_root,
+        "parts": os.path.join(repo_root, PARTS_DIR),
+        "table": os.path.join(repo_root, "full_commit_with_author_data", f"full_commit_{name}.csv"),
+        "jsonl": os.path.join(repo_root, "full_commit_jsonl", "FULL_commit_toclassify.jsonl"),
+    }
+
+
+# --- Worker side ---
+
+# One Repo handle per repository per worker process, opened on first use.
+_worker_repos = {}
+
+
+def _extract_shard(name, repo_path, shard_index, shas):
+    """Extracts one shard and writes it as numbered part files; returns its stats."""
+    start = time.perf_counter()
+    repo = _worker_repos.get(repo_path)
+    if repo is None:
+        repo = _worker_repos[repo_path] = Repo(repo_path)
+
+    paths = repo_output_paths(name)
+    part_base = os.path.join(paths["parts"], f"{shard_index:06d}")
+    with open(part_base + ".csv", 'w', newline='', encoding='utf-8') as table_part, \
+            open_jsonl(part_base + ".jsonl") as jsonl_part:
+        writer = csv.DictWriter(table_part, fieldnames=data_prepare.COMMIT_COLUMNS, extrasaction='ignore', lineterminator='\n')
+        for sha in shas:
+            record = commit_to_record(repo.commit(sha))
+            writer.writerow(record)
+            prompt_diff = record['diff']
+            if data_prepare.DIFF_TOKEN_BUDGET > 0:
+                prompt_diff = apply_diff_budget(prompt_diff, record['diff_files'], data_prepare.DIFF_TOKEN_BUDGET)
+            jsonl_part.write(batch_request_line(record['commit_id'], record['message'], prompt_diff, repo_name=name))
+    return name, shard_index, len(shas), time.perf_counter() - start
+
+
+# --- Scheduler side ---
+
+def _assemble_outputs(name, shard_count):
+    """Concatenates a finished repository's part files, in rev-list order."""
+    paths = repo_output_paths(name)
+    os.makedirs(os.path.dirname(paths["table"]), exist_ok=True)
+    os.makedirs(os.path.dirname(paths["jsonl"]), exist_ok=True)
+    with open(paths["table"], 'w', newline='', encoding='utf-8') as table, open_jsonl(paths["jsonl"]) as jsonl:
+        csv.writer(table, lineterminator='\n').writerow(data_prepare.COMMIT_COLUMNS)
+        for shard_index in range(shard_count):
+            part_base = os.path.join(paths["parts"], f"{shard_index:06d}")
+            with open(part_base + ".csv", 'r', encoding='utf-8') as part:
+                shutil.copyfileobj(part, table)
+            with open(part_base + ".jsonl", 'rb') as part:
+                shutil.copyfileobj(part, jsonl)
+    shutil.rmtree(paths["parts"])
+
+
+def plan_shards(repos):
+    """
+    Lists every repository's commits and returns the shard queue, interleaved
+    round-robin across repositories, plus per-repo bookkeeping.
+    """
+    per_repo_tasks = []
+    status = {}
+    for name, repo_path in repos:
+        paths = repo_output_paths(name)
+        shas = load_commit_index(repo_path, index_dir=os.path.join(paths["root"], COMMIT_INDEX_DIR))['commit_id'].tolist()
+        shards = split_into_shards(shas, SHARD_SIZE)
+        status[name] = {"commits": len(shas), "shards": len(shards), "done": 0,
+                        "cpu_seconds": 0.0, "started": None, "finished": None}
+        shutil.rmtree(paths["parts"], ignore_errors=True)
+        os.makedirs(paths["parts"], exist_ok=True)
+        per_repo_tasks.append([(name, repo_path, i, shard) for i, shard in enumerate(shards)])
+
+    queue = [task for round_ in zip_longest(*per_repo_tasks) for task in round_ if task is not None]
+    return queue, status
+
+
+def print_summary(status, wall_seconds):
+    print("\n--- Multi-Repository Extraction Summary ---")
+    print(f"{'repository':<24} {'commits':>8} {'shards':>7} {'wall s':>8} {'cpu s':>8} {'commits/s':>10}")
+    for name, s in status.items():
+        wall = (s["finished"] - s["started"]) if s["started"] and s["finished"] else 0.0
+        rate = s["commits"] / wall if wall else 0.0
+        print(f"{name:<24} {s['commits']:>8} {s['shards']:>7} {wall:>8.1f} {s['cpu_seconds']:>8.1f} {rate:>10.1f}")
+    total = sum(s["commits"] for s in status.values())
+    print(f"Total: {total} commits from {len(status)} repositories in {wall_seconds:.1f}s "
+          f"({total / wall_seconds if wall_seconds else 0.0:.1f} commits/s)")
+
+
+def run_all(repos, max_workers=MAX_WORKERS):
+    queue, status = plan_shards(repos)
+    total_commits = sum(s["commits"] for s in status.values())
+    print(f"Scheduling {len(queue)} shards ({total_commits} commits) from {len(repos)} repositories on {max_workers} workers...")
+
+    for name, s in status.items():
+        if s["shards"] == 0:
+            _assemble_outputs(name, 0)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        for task in queue:
+            futures.append(pool.submit(_extract_shard, *task))
+        with tqdm(total=total_commits, desc="Extracting (all repos)") as progress:
+            for future in as_completed(futures):
+                name, shard_index, commits, cpu_seconds = future.result()
+                s = status[name]
+                now = time.perf_counter()
+                s["started"] = s["started"] or (now - cpu_seconds)
+                s["done"] += 1
+                s["cpu_seconds"] += cpu_seconds
+                progress.update(commits)
+                if s["done"] == s["shards"]:
+                    _assemble_outputs(name, s["shards"])
+                    s["finished"] = now
+                    finished = sum(1 for st in status.values() if st["finished"])
+                    progress.set_postfix_str(f"{finished}/{len(status)} repos done, last: {name}")
+
+    print_summary(status, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    manifest = sys.argv[1] if len(sys.argv) > 1 else MANIFEST_CSV
+    if not os.path.exists(manifest):
+        exit(f"Error: Repository manifest not found at '{manifest}'.")
+    run_all(read_manifest(manifest))
@@ -0,0 +1,181 @@
+import os
+import sys
+import gzip
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from tqdm import tqdm
+from jsonl_check import plan_chunks
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = lambda obj: orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
+
+# --- Streaming, parallel prediction parser ---
+# Turns batch prediction results (prediction.results-*.jsonl) into one record
+# per line:
+#
+#   original_line_num, key, is_bug_fix, category, reasoning,
+#   parsing_error_type, parsing_error_payload
+#
+# Every file is cut into newline-aligned byte chunks, and the chunks are
+# parsed in a process pool. A worker reads its chunk one line at a time and
+# keeps only the record columns, so memory per line stays constant no matter
+# how large the prompt or the file is. The echoed request (prompt plus diff)
+# is never copied: failed lines keep the model's text or, when there is
+# none, the line without its request.
+#
+# The answer's JSON object is located with find/rfind: it spans the first
+# '{' through the last '}'. That is the same span the old greedy regex
+# r'\{.*\}' matched, but it takes linear time and cannot backtrack. If that
+# span does not parse, the first balanced {...} object is tried, which
+# handles answers followed by stray braces.
+NUM_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+CHUNK_BYTES = 32 * 1024 * 1024
+PAYLOAD_LIMIT = 4000  # characters of an unparseable line kept for inspection
+RECORD_COLUMNS = [
+    'original_line_num', 'key', 'is_bug_fix', 'category', 'reasoning',
+    'parsing_error_type', 'parsing_error_payload',
+]
+
+
+def _balanced_object(text, start):
+    """End index (exclusive) of the {...} object starting at text[start], or -1."""
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def extract_json_object(text):
+    """Parses the JSON object embedded in the model's text; raises ValueError if there is none."""
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError("Could not find a JSON object within the text.")
+    try:
+        return json.loads(text[start:end + 1], strict=False)
+    except json.JSONDecodeError:
+        balanced_end = _balanced_object(text, start)
+        if balanced_end == -1 or balanced_end == end + 1:
+            raise
+        return json.loads(text[start:balanced_end], strict=False)
+
+
+def _error_payload(line, data):
+    if isinstance(data, dict):
+        try:
+            return data['response']['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError, TypeError):
+            return _dumps({k: v for k, v in data.items() if k != 'request'})
+    return line.strip()[:PAYLOAD_LIMIT].decode('utf-8', errors='replace')
+
+
+def parse_line(line):
+    """Returns (key, is_bug_fix, category, reasoning, error_type, error_payload) for one result line."""
+    data = None
+    try:
+        data = _loads(line)
+        key = data.get('key')
+        # This handles cases where the 'response' or 'candidates' keys are missing
+        if 'response' not in data or 'candidates' not in data['response'] or not data['response']['candidates']:
+            raise KeyError("Path to 'response' or 'candidates' not found.")
+        raw_text = data['response']['candidates'][0]['content']['parts'][0]['text']
+        parsed_text = extract_json_object(raw_text)
+        return key, parsed_text.get('is_bug_fix'), parsed_text.get('category'), parsed_text.get('reasoning'), None, None
+    except Exception as e:
+        key = data.get('key') if isinstance(data, dict) else None
+        return key, None, None, None, type(e).__name__, _error_payload(line, data)
+
+
+def _iter_chunk_lines(path, start, end):
+    if end < 0:
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def _parse_chunk(chunk):
+    """Worker: parses one chunk into record columns (line numbers relative to the chunk)."""
+    columns = {name: [] for name in RECORD_COLUMNS}
+    error_summary = {}
+    line_index = 0
+    for line in _iter_chunk_lines(*chunk):
+        line_index += 1
+        if not line.strip():
+            continue
+        key, is_bug_fix, category, reasoning, error_type, payload = parse_line(line)
+        columns['original_line_num'].append(line_index)
+        columns['key'].append(key)
+        columns['is_bug_fix'].append(is_bug_fix)
+        columns['category'].append(category)
+        columns['reasoning'].append(reasoning)
+        columns['parsing_error_type'].append(error_type)
+        columns['parsing_error_payload'].append(payload)
+        if error_type is not None:
+            error_summary[error_type] = error_summary.get(error_type, 0) + 1
+    return columns, line_index, error_summary
+
+
+def parse_predictions(paths, num_workers=NUM_WORKERS):
+    """
+    Parses one or more prediction result files (plain or .gz). Line numbers
+    run on across the files in the order given. Returns (DataFrame with
+    RECORD_COLUMNS, error_summary by exception type).
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    chunks = [chunk for path in paths for chunk in plan_chunks(path, CHUNK_BYTES)]
+    frames, error_summary = [], {}
+    lines_before = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for columns, line_count, chunk_errors in tqdm(pool.map(_parse_chunk, chunks), total=len(chunks), desc="Parsing Predictions"):
+            frame = pd.DataFrame(columns, columns=RECORD_COLUMNS)
+            frame['original_line_num'] += lines_before
+            frames.append(frame)
+            lines_before += line_count
+            for error_type, count in chunk_errors.items():
+                error_summary[error_type] = error_summary.get(error_type, 0) + count
+    records = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=RECORD_COLUMNS)
+    return records, error_summary
+
+
+if __name__ == "__main__":
+    # Usage: python prediction_parser.py <prediction.results.jsonl> [...]  -- parse and report only
+    if len(sys.argv) < 2:
+        exit("Usage: python prediction_parser.py <prediction.results.jsonl> [...]")
+    start = time.perf_counter()
+    records, errors = parse_predictions(sys.argv[1:])
+    elapsed = time.perf_counter() - start
+    print(f"Parsed {len(records)} lines in {elapsed:.2f}s ({len(records) / max(elapsed, 1e-9):.0f} lines/s).")
+    print(f"Successfully processed records: {len(records) - sum(errors.values())}")
+    for error_type, count in sorted(errors.items()):
+        print(f"- {error_type}: {count} times")
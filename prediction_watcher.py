@@ -0,0 +1,174 @@
+import os
+import re
+import sys
+import json
+import time
+from storage_backends import backend_from_env, download_many
+from prediction_parser import parse_predictions, RECORD_COLUMNS
+
+# --- Incremental result ingestion ---
+# Watches a batch job's output prefix while the job is still running. Each
+# prediction.results-*.jsonl shard is downloaded, parsed and appended to the
+# classified CSV as soon as it appears, so results are usable long before
+# the job ends. Shards appear atomically (a GCS object exists only once
+# finalized; the local backend publishes on close), so a listed shard is
+# always complete.
+#
+# The ledger (JSON next to the CSV) lists every ingested shard with its size,
+# row count and the CSV's size after its rows were appended. On start the CSV
+# is cut back to the last recorded size. Rows from an append that crashed
+# before reaching the ledger are dropped and the shard is simply ingested
+# again, so a shard is never counted twice however often the watcher restarts.
+#
+# Batch jobs write into their own subfolder of the results prefix. Only the
+# newest folder is ingested (folder names end in the job's timestamp), and the
+# ledger records which one it is. If a newer job's folder shows up later, the
+# rows of the older job are dropped and ingestion starts over from the new
+# folder, so results of two runs are never mixed.
+#
+# Shard names end in -of-NNNNN, so complete() can tell when every shard of
+# the job has been ingested and the watch can stop without waiting out
+# WATCH_IDLE_MINUTES.
+#
+# original_line_num is the line number within the shard.
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "30"))
+WATCH_IDLE_MINUTES = float(os.getenv("WATCH_IDLE_MINUTES", "30"))  # standalone mode: stop after this long without new shards
+WATCH_DOWNLOAD_DIR = "CLASSIFED_FULL_JSONL/shards"
+LEDGER_SUFFIX = ".ingested.json"
+SHARD_COUNT_RE = re.compile(r"prediction\.results-\d+-of-(\d+)")
+
+
+def ledger_path_for(output_csv):
+    return os.path.splitext(output_csv)[0] + LEDGER_SUFFIX
+
+
+def is_result_shard(name):
+    return "prediction.results" in name and name.endswith(".jsonl")
+
+
+def job_folder_of(name):
+    return name.rsplit("/", 1)[0] if "/" in name else ""
+
+
+class ShardIngestor:
+    """Appends each new result shard under a prefix to output_csv exactly once."""
+
+    def __init__(self, output_csv, backend=None, download_dir=WATCH_DOWNLOAD_DIR, ledger_path=None):
+        self.backend = backend or backend_from_env()
+        self.output_csv = output_csv
+        self.download_dir = download_dir
+        self.ledger_path = ledger_path or ledger_path_for(output_csv)
+        self.ledger = {"shards": {}, "csv_bytes": 0, "job_folder": None}
+        if os.path.exists(self.ledger_path):
+            with open(self.ledger_path, 'r') as f:
+                self.ledger = json.load(f)
+        self._truncate_to_ledger()
+
+    def _truncate_to_ledger(self):
+        os.makedirs(os.path.dirname(self.output_csv) or ".", exist_ok=True)
+        if (not self.ledger["shards"] or not os.path.exists(self.output_csv)
+                or os.path.getsize(self.output_csv) < self.ledger["csv_bytes"]):  # CSV rewritten by someone else
+            self._reset(self.ledger.get("job_folder"))
+        elif os.path.getsize(self.output_csv) != self.ledger["csv_bytes"]:
+            print(f"Dropping rows appended after the last ledger entry in {self.output_csv}")
+            with open(self.output_csv, 'r+b') as f:
+                f.truncate(self.ledger["csv_bytes"])
+
+    def _reset(self, job_folder):
+        """Starts the CSV and the ledger over, empty, for job_folder."""
+        with open(self.output_csv, 'w') as f:
+            f.write(",".join(RECORD_COLUMNS) + "\n")
+        self.ledger = {"shards": {}, "csv_bytes": os.path.getsize(self.output_csv), "job_folder": job_folder}
+        self._save_ledger()
+
+    def _save_ledger(self):
+        tmp_path = self.ledger_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.ledger, f, indent=2)
+        os.replace(tmp_path, self.ledger_path)
+
+    def pending(self, prefix):
+        """Result shards of the newest job folder under prefix that are not in the ledger yet."""
+        shards = [obj for obj in self.backend.list(prefix) if is_result_shard(obj["name"])]
+        if not shards:
+            return []
+        newest = max(job_folder_of(obj["name"]) for obj in shards)
+        current = self.ledger.get("job_folder")
+        if current is None or newest > current:
+            if self.ledger["shards"]:
+                print(f"Results of a newer job in {newest}; dropping the {len(self.ledger['shards'])} "
+                      f"shard(s) ingested from {current} and starting over.")
+            self._reset(newest)
+        return [obj for obj in shards
+                if job_folder_of(obj["name"]) == self.ledger["job_folder"] and obj["name"] not in self.ledger["shards"]]
+
+    def ingest(self, obj):
+        """Downloads, parses and appends one shard; returns (rows, error_summary)."""
+        local_path = os.path.join(self.download_dir, obj["name"].replace("/", "__"))
+        summary = download_many(self.backend, [(obj["name"], local_path)], max_workers=1)
+        if summary["failed"]:
+            raise IOError(f"Download of {obj['name']} failed: {summary['failed'][obj['name']]}")
+        records, error_summary = parse_predictions([local_path])
+        self.append_rows(records, obj["name"], size=obj["size"], errors=error_summary)
+        os.remove(local_path)  # the rows live in the CSV now
+        return len(records), error_summary
+
+    def append_rows(self, records, entry_name, size=None, errors=None):
+        """Appends records (RECORD_COLUMNS) to the CSV and records them in the ledger under entry_name."""
+        with open(self.output_csv, 'ab') as f:
+            records[RECORD_COLUMNS].to_csv(f, header=False, index=False)
+            csv_bytes = f.tell()
+        self.ledger["shards"][entry_name] = {
+            "size": size, "rows": len(records), "errors": errors or {}, "ingested_at": time.time(),
+        }
+        self.ledger["csv_bytes"] = csv_bytes
+        self._save_ledger()
+
+    def complete(self):
+        """True once every prediction.results-*-of-NNNNN shard of the current job folder is in the ledger."""
+        shard_counts = [int(match.group(1)) for match in map(SHARD_COUNT_RE.search, self.ledger["shards"]) if match]
+        return bool(shard_counts) and len(set(shard_counts)) == 1 and len(shard_counts) == shard_counts[0]
+
+    def sweep(self, prefix):
+        """Ingests every pending shard once; returns how many were ingested."""
+        new_shards = self.pending(prefix)
+        for obj in new_shards:
+            rows, error_summary = self.ingest(obj)
+            print(f"Ingested {obj['name']}: {rows} rows, {sum(error_summary.values())} parse errors "
+                  f"({len(self.ledger['shards'])} shards so far)")
+        return len(new_shards)
+
+    def watch(self, prefix, is_done=None, poll_seconds=WATCH_POLL_SECONDS, idle_minutes=WATCH_IDLE_MINUTES):
+        """
+        Sweeps prefix every poll_seconds. Stops after a final sweep once
+        is_done() returns True, or, without is_done, after idle_minutes
+        without a new shard.
+        """
+        print(f"Watching {self.backend.uri(prefix)} for result shards...")
+        last_new = time.monotonic()
+        while True:
+            done = is_done() if is_done is not None else False  # checked before the sweep so no shard is missed
+            if self.sweep(prefix):
+                last_new = time.monotonic()
+            if done or (is_done is None and time.monotonic() - last_new > idle_minutes * 60):
+                break
+            time.sleep(poll_seconds)
+        return self.totals()
+
+    def totals(self):
+        shards = self.ledger["shards"].values()
+        error_summary = {}
+        for shard in shards:
+            for error_type, count in shard["errors"].items():
+                error_summary[error_type] = error_summary.get(error_type, 0) + count
+        return {"shards": len(self.ledger["shards"]), "rows": sum(shard["rows"] for shard in shards), "errors": error_summary}
+
+
+if __name__ == "__main__":
+    # Usage: python prediction_watcher.py <results prefix> <classified.csv>
+    # Runs alongside a batch job; stops once every shard of the job is ingested.
+    if len(sys.argv) != 3:
+        exit("Usage: python prediction_watcher.py <results prefix> <classified.csv>")
+    ingestor = ShardIngestor(sys.argv[2])
+    totals = ingestor.watch(sys.argv[1], is_done=ingestor.complete)
+    print(f"Ingested {totals['rows']} rows from {totals['shards']} shards; errors: {totals['errors'] or 'none'}")
@@ -0,0 +1,178 @@
+import json
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder produces the same JSON, just slower
+    orjson = None
+
+# --- Shared prompt / JSONL builder ---
+# The single home for the classification prompts and the JSONL formats built
+# from them:
+#
+#   batch requests     {"request": {"contents": [user prompt]}, "key": commit id}
+#   training contents  {"contents": [user prompt, model answer]}       (Gemini tuning)
+#   training messages  {"messages": [user prompt, assistant answer]}   (chat-style tuning)
+#
+# Everything that is the same for every row (instructions, the category list,
+# the JSON scaffolding around the prompt) is rendered and JSON-escaped once at
+# import time. Per row only the commit message, diff and key are escaped and
+# the pieces are joined as bytes, so no dict is built or re-serialized per row.
+
+ALL_CATEGORIES = [
+    # Bug-Fix Categories
+    "Parser Logic", "Memory", "General Logic Error", "API Logic",
+    "Security Vulnerability (CVE)", "Integer", "Error Handling",
+    "Concurrency", "Type System", "State Management", "Performance",
+    "Incorrect Output/Calculation", "Standard Library Misuse",
+    # Non-Bug-Fix Categories
+    "Build/CI/Tests", "Refactoring", "Documentation",
+    "Feature/Enhancement", "Non-Maintenance"
+]
+
+# The prompts name the repository being classified. The single-repo scripts
+# classify libxml2; multi_repo_scheduler.py passes each repository's name.
+DEFAULT_REPO_NAME = "libxml2"
+# Commit message + code diff (batch classification and diff-based tuning data).
+DIFF_PROMPT_TEMPLATE = (
+    "You are a world-class software engineering analyst specializing in the {repo_name} library. "
+    "Analyze the following commit message and code diff, then classify it. "
+    "Respond ONLY with a valid JSON object containing 'is_bug_fix', 'category', and 'reasoning'.\n\n"
+    f"AVAILABLE CATEGORIES:\n{json.dumps(ALL_CATEGORIES)}\n\n"
+    "--- COMMIT MESSAGE ---\n"
+)
+CODE_DIFF_MARKER = "--- CODE DIFF ---\n"
+# Commit message only (message-based tuning data and the tuned-endpoint classifier).
+MESSAGE_PROMPT_TEMPLATE = (
+    "You are a world-class software engineering analyst specializing in the {repo_name} library. "
+    "Analyze the following commit message and classify it. Respond ONLY with a valid JSON object "
+    "containing three keys: a boolean 'is_bug_fix', the string 'category', and a one-sentence 'reasoning'.\n\n"
+    f"AVAILABLE CATEGORIES:\n{json.dumps(ALL_CATEGORIES)}\n\n"
+    "--- COMMIT MESSAGE ---\n"
+)
+DIFF_PROMPT_PREFIX = DIFF_PROMPT_TEMPLATE.format(repo_name=DEFAULT_REPO_NAME)
+MESSAGE_PROMPT_PREFIX = MESSAGE_PROMPT_TEMPLATE.format(repo_name=DEFAULT_REPO_NAME)
+
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+# --- Escaping ---
+
+def _escape_ascii(text):
+    """Body of a JSON string literal (no quotes), as json.dumps would write it."""
+    return encode_basestring_ascii(text)[1:-1].encode('ascii')
+
+
+def _escape(text):
+    """Body of a JSON string literal (no quotes) as UTF-8 bytes."""
+    if not isinstance(text, str):
+        text = f"{text}"  # NaN cells render as "nan", like the old f-string templates
+    if orjson is not None:
+        try:
+            return orjson.dumps(text)[1:-1]
+        except orjson.JSONEncodeError:  # lone surrogates; the stdlib escapes them
+            pass
+    return _escape_ascii(text)
+
+
+def _answer_text(is_bug_fix, category, reasoning):
+    """The model answer for a training row, exactly as json.dumps(dict) renders it."""
+    return (
+        f'{{"is_bug_fix": {json.dumps(bool(is_bug_fix))}, '
+        f'"category": {json.dumps(category)}, "reasoning": {json.dumps(reasoning)}}}'
+    )
+
+
+def render_diff_prompt(commit_message, diff_text, repo_name=DEFAULT_REPO_NAME):
+    return f"{DIFF_PROMPT_TEMPLATE.format(repo_name=repo_name)}{commit_message}{CODE_DIFF_MARKER}{diff_text}"
+
+
+def render_message_prompt(commit_message, repo_name=DEFAULT_REPO_NAME):
+    return f"{MESSAGE_PROMPT_TEMPLATE.format(repo_name=repo_name)}{commit_message}"
+
+
+# Static fragments, escaped once (the prefixes once per repository name).
+@lru_cache(maxsize=None)
+def _prefixes(repo_name):
+    return (_escape_ascii(DIFF_PROMPT_TEMPLATE.format(repo_name=repo_name)),
+            _escape_ascii(MESSAGE_PROMPT_TEMPLATE.format(repo_name=repo_name)))
+
+
+_CODE_DIFF_MARKER = _escape_ascii(CODE_DIFF_MARKER)
+_REQUEST_OPEN = b'{"request": {"contents": [{"role": "user", "parts": [{"text": "'
+_REQUEST_KEY = b'"}]}]}, "key": "'
+_CONTENTS_OPEN = b'{"contents": [{"role": "user", "parts": [{"text": "'
+_CONTENTS_ANSWER = b'"}]}, {"role": "model", "parts": [{"text": "'
+_CONTENTS_CLOSE = b'"}]}]}\n'
+_MESSAGES_OPEN = b'{"messages": [{"role": "user", "content": "'
+_MESSAGES_ANSWER = b'"}, {"role": "assistant", "content": "'
+_MESSAGES_CLOSE = b'"}]}\n'
+
+
+def _user_prompt(commit_message, diff_text, repo_name=DEFAULT_REPO_NAME):
+    diff_prefix, message_prefix = _prefixes(repo_name)
+    if diff_text is None:
+        return message_prefix + _escape(commit_message)
+    return diff_prefix + _escape(commit_message) + _CODE_DIFF_MARKER + _escape(diff_text)
+
+
+# --- Line builders (one JSONL line as bytes, newline included) ---
+
+def batch_request_line(commit_id, commit_message, diff_text, repo_name=DEFAULT_REPO_NAME):
+    """One batch-prediction request for a single commit of repo_name."""
+    return _REQUEST_OPEN + _user_prompt(commit_message, diff_text, repo_name) + _REQUEST_KEY + _escape(commit_id) + b'"}\n'
+
+
+def training_contents_line(commit_message, is_bug_fix, category, reasoning, diff_text=None):
+    """One Gemini tuning example. Without diff_text the message-only prompt is used."""
+    answer = _answer_text(is_bug_fix, category, reasoning)
+    return _CONTENTS_OPEN + _user_prompt(commit_message, diff_text) + _CONTENTS_ANSWER + _escape(answer) + _CONTENTS_CLOSE
+
+
+def training_messages_line(commit_message, is_bug_fix, category, reasoning, diff_text=None):
+    """One chat-style ("messages") tuning example."""
+    answer = _answer_text(is_bug_fix, category, reasoning)
+    return _MESSAGES_OPEN + _user_prompt(commit_message, diff_text) + _MESSAGES_ANSWER + _escape(answer) + _MESSAGES_CLOSE
+
+
+# --- DataFrame writers ---
+
+def _columns(df, *names):
+    """Iterates the given columns row-wise over the underlying arrays (no per-row Series)."""
+    return zip(*(df[name].to_numpy() for name in names))
+
+
+def open_jsonl(output_filename, append=False):
+    """Binary JSONL output with a large write buffer; write the *_line() bytes to it."""
+    return open(output_filename, 'ab' if append else 'wb', buffering=WRITE_BUFFER_SIZE)
+
+
+def write_batch_requests(df, output_filename, key_col='commit_id', message_col='message', diff_col='diff'):
+    """Batch-prediction JSONL, one request per row. Returns the number of rows written."""
+    with open_jsonl(output_filename) as f:
+        for key, message, diff in _columns(df, key_col, message_col, diff_col):
+            f.write(batch_request_line(key, message, diff))
+    return len(df)
+
+
+def write_training_contents(df, output_filename, message_col='message', category_col='category',
+                            reasoning_col='reasoning', is_bug_col='is_bug_fix', diff_col=None):
+    """Gemini "contents" tuning JSONL. Pass diff_col to use the message + diff prompt."""
+    with open_jsonl(output_filename) as f:
+        if diff_col is None:
+            for message, is_bug, category, reasoning in _columns(df, message_col, is_bug_col, category_col, reasoning_col):
+                f.write(training_contents_line(message, is_bug, category, reasoning))
+        else:
+            for message, is_bug, category, reasoning, diff in _columns(df, message_col, is_bug_col, category_col, reasoning_col, diff_col):
+                f.write(training_contents_line(message, is_bug, category, reasoning, diff))
+    return len(df)
+
+
+def write_training_messages(df, output_filename, message_col='message', category_col='category',
+                            reasoning_col='reasoning', is_bug_col='is_bug_fix'):
+    """Chat-style "messages" tuning JSONL with the message-only prompt."""
+    with open_jsonl(output_filename) as f:
+        for message, is_bug, category, reasoning in _columns(df, message_col, is_bug_col, category_col, reasoning_col):
+            f.write(training_messages_line(message, is_bug, category, reasoning))
+    return len(df)
@@ -0,0 +1,175 @@
+import os
+import csv
+import sqlite3
+import hashlib
+import pandas as pd
+from datetime import datetime, timezone
+from prompt_builder import DIFF_PROMPT_PREFIX, CODE_DIFF_MARKER
+
+# --- Classification result cache ---
+# Remembers every successfully parsed prediction, keyed by
+#
+#   sha256(model resource name + "\n" + full prompt text)
+#
+# so a commit is only sent for classification again when its prompt (commit
+# message, budgeted diff, prompt template) or the model changes.
+#
+#   01_data_prepare.py  leaves cached requests out of the batch JSONL and writes
+#                       REQUEST_KEYS_CSV (commit_id -> request_key) for every commit
+#   05_data_merge_analysis.py  stores the new predictions under those keys and
+#                       re-attaches the cached results for the commits left out
+
+RESULT_CACHE_DB = "result_cache/classifications.sqlite"
+REQUEST_KEYS_CSV = "full_commit_jsonl/request_keys.csv"
+# Written by the tuning step; 04_model_evaluation.py reads the same file.
+MODEL_RESOURCE_FILE = f"FINETUNED_RESOURCENAME/{os.getenv('CURRENT_LANGUAGE_REPO')}"
+
+
+def read_model_resource_name(path=MODEL_RESOURCE_FILE):
+    """The tuned model's resource name, or None if it has not been recorded yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return f.read().strip() or None
+
+
+def request_key(model_name, commit_message, diff_text):
+    """Cache key of the diff prompt prompt_builder renders for this commit."""
+    digest = hashlib.sha256(f"{model_name}\n".encode('utf-8'))
+    for part in (DIFF_PROMPT_PREFIX, f"{commit_message}", CODE_DIFF_MARKER, f"{diff_text}"):
+        digest.update(part.encode('utf-8', errors='surrogatepass'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """sqlite-backed store of parsed classification results."""
+
+    def __init__(self, db_path=RESULT_CACHE_DB):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                request_key TEXT PRIMARY KEY,
+                commit_id   TEXT NOT NULL,
+                model       TEXT,
+                is_bug_fix  INTEGER,
+                category    TEXT,
+                reasoning   TEXT,
+                cached_at   TEXT
+            )
+        """)
+
+    def keys(self):
+        """Every cached request key (small enough to hold as a set)."""
+        return {row[0] for row in self.conn.execute("SELECT request_key FROM results")}
+
+    def put_many(self, rows):
+        """rows: iterable of (request_key, commit_id, model, is_bug_fix, category, reasoning)."""
+        now = datetime.now(timezone.utc).isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((*row, now) for row in rows),
+            )
+
+    def get_many(self, request_keys):
+        """{request_key: (is_bug_fix, category, reasoning)} for the keys that are cached."""
+        found = {}
+        request_keys = list(request_keys)
+        for start in range(0, len(request_keys), 900):  # stay under sqlite's bound-parameter limit
+            batch = request_keys[start:start + 900]
+            placeholders = ",".join("?" * len(batch))
+            for key, is_bug_fix, category, reasoning in self.conn.execute(
+                f"SELECT request_key, is_bug_fix, category, reasoning FROM results WHERE request_key IN ({placeholders})",
+                batch,
+            ):
+                if isinstance(is_bug_fix, int):  # sqlite stores booleans as 0/1
+                    is_bug_fix = bool(is_bug_fix)
+                found[key] = (is_bug_fix, category, reasoning)
+        return found
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RequestKeyWriter:
+    """Streams the commit_id -> request_key sidecar written next to the batch JSONL."""
+
+    def __init__(self, path=REQUEST_KEYS_CSV):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.writer.writerow(['commit_id', 'request_key', 'model'])
+
+    def write(self, commit_id, key, model_name):
+        self.writer.writerow([commit_id, key, model_name])
+
+    def close(self):
+        self.file.close()
+
+
+def read_request_keys(path=REQUEST_KEYS_CSV):
+    """{commit_id: (request_key, model)} from the sidecar; later rows win."""
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return {row['commit_id']: (row['request_key'], row['model']) for row in csv.DictReader(f)}
+
+
+_BOOL_SPELLINGS = {True: True, False: False, "True": True, "False": False, "true": True, "false": False}
+
+
+def _as_bool(value):
+    """True/False for bools and their CSV spellings; None for anything else."""
+    try:
+        return _BOOL_SPELLINGS.get(value)
+    except TypeError:  # unhashable
+        return None
+
+
+def store_and_reattach(records, request_keys_path=REQUEST_KEYS_CSV, db_path=RESULT_CACHE_DB):
+    """
+    Stores the successfully parsed predictions (the records DataFrame from
+    prediction_parser.py: key, is_bug_fix, category, reasoning,
+    parsing_error_type, ...) in the cache and returns them plus one row per
+    commit in the sidecar that was served from the cache instead of being
+    predicted in this batch.
+    """
+    request_keys = read_request_keys(request_keys_path)
+    parsed = records[records['parsing_error_type'].isna() & records['category'].notna()]
+    new_rows = []
+    for commit_id, is_bug_fix, category, reasoning in zip(parsed['key'], parsed['is_bug_fix'], parsed['category'], parsed['reasoning']):
+        if commit_id in request_keys:
+            key, model_name = request_keys[commit_id]
+            new_rows.append((key, commit_id, model_name, _as_bool(is_bug_fix), category, reasoning))
+    predicted = set(records['key'])
+
+    with ResultCache(db_path) as cache:
+        cache.put_many(new_rows)
+        missing = {commit_id: key for commit_id, (key, _) in request_keys.items() if commit_id not in predicted}
+        cached = cache.get_many(missing.values())
+
+    reattached = []
+    for commit_id, key in missing.items():
+        if key not in cached:
+            continue
+        is_bug_fix, category, reasoning = cached[key]
+        reattached.append({
+            'original_line_num': None,  # not in this batch's output
+            'key': commit_id,
+            'is_bug_fix': is_bug_fix,
+            'category': category,
+            'reasoning': reasoning,
+            'parsing_error_type': None,
+            'parsing_error_payload': None,
+        })
+    print(f"Result cache: stored {len(new_rows)} new results, re-attached {len(reattached)} cached results "
+          f"({len(missing) - len(reattached)} commits have neither).")
+    if not reattached:
+        return records
+    return pd.concat([records, pd.DataFrame(reattached, columns=records.columns)], ignore_index=True)
@@ -0,0 +1,402 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import gzip
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import pandas as pd
+from dotenv import load_dotenv
+from diff_store import DiffStore, DIFF_STORE_DIR
+from diff_budget import apply_diff_budget
+from metadata_join import load_metadata_index
+from prompt_builder import batch_request_line, open_jsonl
+from prediction_parser import parse_line, parse_predictions, RECORD_COLUMNS
+from prediction_watcher import ledger_path_for
+from jsonl_check import input_files
+from jsonl_shards import manifest_path_for
+from result_cache import ResultCache, request_key, read_model_resource_name, read_request_keys, _as_bool, REQUEST_KEYS_CSV, MODEL_RESOURCE_FILE
+from storage_backends import backend_from_env, upload_many
+from commit_warehouse import write_classified, WAREHOUSE_DIR
+from batch_emulator import emulate_line
+
+# --- Retry queue for failed and missing predictions ---
+# After a batch run, some commits have no usable classification: their line
+# failed to parse (parsing_error_type is set, e.g. a truncated answer or an
+# error status), or the job dropped them altogether. Instead of rebuilding
+# and re-running the full batch, each retry round
+#
+#   1. collects the failed keys (no successfully parsed row in the classified
+#      CSV) and the missing keys (submitted by the last 01 run, i.e. in its
+#      batch JSONL or request key sidecar, but not in the CSV; after an
+#      incremental run that is only the new commits, not the whole table),
+#   2. regenerates only those requests: the message from the metadata index,
+#      the diff from the diff store, or from the commit table when the store
+#      is absent or does not have the commit (DIFF_TOKEN_BUDGET as in 01),
+#   3. classifies them, either online (RETRY_CONCURRENCY calls in flight) or,
+#      for more than RETRY_ONLINE_MAX requests, as a small batch job through
+#      the job_orchestrator.py services,
+#   4. patches the results into the classified CSV: a retried commit's rows
+#      are replaced by one row holding the new result, and missing commits are
+#      appended. The file is rewritten to a temporary name and moved into place.
+#
+# Rounds repeat until nothing is left to retry, RETRY_ROUNDS is reached, or a
+# round makes no progress. The rest of the CSV is only copied, never
+# reclassified. Retried rows have no original_line_num, like the rows the
+# result cache re-attaches. Successful retries also go into the result cache
+# when 01 wrote a request key sidecar.
+load_dotenv()
+PROJECT_ID = os.getenv("PROJECT_ID")
+REGION = os.getenv("REGION")
+CURRENT_LANGUAGE_REPO = os.getenv("CURRENT_LANGUAGE_REPO")
+WAREHOUSE_FORMAT = os.getenv("WAREHOUSE_FORMAT", "csv")
+DIFF_TOKEN_BUDGET = int(os.getenv("DIFF_TOKEN_BUDGET", "0"))  # must match the budget the batch was built with
+RETRY_MODE = os.getenv("RETRY_MODE", "auto")  # "online", "batch", or "auto" (online up to RETRY_ONLINE_MAX requests)
+RETRY_ONLINE_MAX = int(os.getenv("RETRY_ONLINE_MAX", "2000"))
+RETRY_CONCURRENCY = int(os.getenv("RETRY_CONCURRENCY", "16"))
+RETRY_ROUNDS = int(os.getenv("RETRY_ROUNDS", "3"))
+RETRY_CALL_ATTEMPTS = 3
+RETRY_JSONL = "full_commit_jsonl/retry_requests.jsonl"
+BATCH_JSONL = "full_commit_jsonl/FULL_commit_toclassify.jsonl"  # written by 01_data_prepare.py
+# Where the retry batch goes in the bucket; "{repo}" is replaced like in job_orchestrator.py.
+BLOB_RETRY_DESTINATION = os.getenv("BLOB_RETRY_DESTINATION", "batching/{repo}/retry/requests.jsonl")
+BLOB_RETRY_RESULTS = os.getenv("BLOB_RETRY_RESULTS", "batching/{repo}/retry/results/")
+RETRY_PREDICTIONS_DIR = "CLASSIFED_FULL_JSONL/retry"
+
+
+def _succeeded(records):
+    return records['parsing_error_type'].isna() & records['category'].notna()
+
+
+def submitted_keys(batch_jsonl=BATCH_JSONL, request_keys_path=REQUEST_KEYS_CSV):
+    """
+    Commit ids the last batch covered: the keys of the batch JSONL (or of
+    the shards in its manifest) plus the commits in the request key sidecar,
+    which with RESULT_CACHE=1 also lists the cached commits left out of the
+    JSONL. None when neither file exists.
+    """
+    manifest_path = manifest_path_for(batch_jsonl)
+    source = manifest_path if os.path.exists(manifest_path) else batch_jsonl
+    if not os.path.exists(source) and not os.path.exists(request_keys_path):
+        return None
+    keys = set()
+    if os.path.exists(source):
+        for path in input_files(source):
+            with (gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')) as f:
+                keys.update(json.loads(line)['key'] for line in f if line.strip())
+    if os.path.exists(request_keys_path):
+        keys.update(read_request_keys(request_keys_path))
+    return keys
+
+
+def collect_retry_keys(classified_csv, table_path, submitted=None):
+    """
+    (failed, missing, unknown): commits with rows but no successful one,
+    submitted commits of the table (every commit of the table when submitted
+    is None) with no row at all, and failed keys that are not in the table
+    (they cannot be rebuilt).
+    """
+    commit_ids = load_metadata_index(table_path).column('commit_id')
+    if os.path.exists(classified_csv):
+        classified = pd.read_csv(classified_csv, usecols=['key', 'category', 'parsing_error_type'])
+    else:
+        classified = pd.DataFrame(columns=['key', 'category', 'parsing_error_type'])
+    classified = classified[classified['key'].notna()]
+    done = set(classified.loc[_succeeded(classified), 'key'].tolist())
+    seen = set(classified['key'].tolist())
+    known = set(commit_ids.tolist())
+    failed = sorted((seen - done) & known)
+    missing = sorted((known if submitted is None else known & submitted) - seen)
+    unknown = sorted(seen - done - known)
+    return failed, missing, unknown
+
+
+def _table_rows(table_path, commit_ids):
+    """{commit_id: (message, diff)} for the given commits, in one streaming pass over the table."""
+    csv.field_size_limit(sys.maxsize)  # diff cells can be many megabytes
+    found = {}
+    with open(table_path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['commit_id'] in commit_ids:
+                found[row['commit_id']] = (row['message'], row['diff'])
+                if len(found) == len(commit_ids):
+                    break
+    return found
+
+
+def build_retry_requests(commit_ids, table_path, output_path=RETRY_JSONL, diff_store_dir=DIFF_STORE_DIR, model_name=None):
+    """
+    Writes the batch requests for commit_ids to output_path. Returns
+    {commit_id: request_key} (None without model_name) for the requests written.
+    """
+    index = load_metadata_index(table_path)
+    messages = index.lookup(pd.Series(commit_ids), ['message'])['message'].tolist()
+    diffs = {}
+    if os.path.exists(diff_store_dir):
+        with DiffStore(diff_store_dir, read_only=True) as store:
+            for commit_id in commit_ids:
+                if commit_id in store:
+                    diffs[commit_id] = store.get(commit_id)
+    from_table = {commit_id for commit_id in commit_ids if commit_id not in diffs}
+    if from_table:
+        print(f"Reading {len(from_table)} diffs from {table_path}...")
+        table_rows = _table_rows(table_path, from_table)
+        diffs.update({commit_id: diff for commit_id, (_, diff) in table_rows.items()})
+
+    request_keys = {}
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open_jsonl(output_path) as f:
+        for commit_id, message in zip(commit_ids, messages):
+            if commit_id not in diffs or message is None:
+                print(f"Warning: commit {commit_id} is not in the commit store, skipping.")
+                continue
+            prompt_diff = diffs[commit_id]
+            if DIFF_TOKEN_BUDGET > 0:
+                prompt_diff = apply_diff_budget(prompt_diff, None, DIFF_TOKEN_BUDGET)
+            f.write(batch_request_line(commit_id, message, prompt_diff))
+            request_keys[commit_id] = request_key(model_name, message, prompt_diff) if model_name is not None else None
+    return request_keys
+
+
+# --- Online classification ---
+# predict(request_line) -> result line, both as bytes. A result line has the
+# layout of a batch job's output, so it goes through the same parser.
+
+class VertexOnlineClient:
+    """Calls the tuned model's endpoint one request at a time."""
+
+    def __init__(self, project_id, region, model_name):
+        import vertexai
+        from google.cloud import aiplatform
+        from vertexai.generative_models import GenerativeModel
+        vertexai.init(project=project_id, location=region)
+        aiplatform.init(project=project_id, location=region)
+        # Tuned Gemini models are served from the endpoint they were deployed to.
+        endpoint = aiplatform.Model(model_name=model_name).gca_resource.deployed_models[0].endpoint
+        self.model = GenerativeModel(endpoint)
+
+    def predict(self, request_line):
+        data = json.loads(request_line)
+        response = self.model.generate_content(data['request']['contents'])
+        return json.dumps({"key": data['key'], "response": response.to_dict()}).encode('utf-8')
+
+
+class EmulatorClient:
+    """Offline stand-in that answers like batch_emulator.py, including its failure rates."""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+
+    def predict(self, request_line):
+        line, outcome = emulate_line(request_line, self.rng, datetime.now(timezone.utc).isoformat())
+        if line is None:
+            raise IOError("emulated dropped request")
+        return line
+
+
+def _predict_with_retries(client, request_line, attempts=RETRY_CALL_ATTEMPTS):
+    for attempt in range(1, attempts + 1):
+        try:
+            return client.predict(request_line)
+        except Exception as e:
+            if attempt == attempts:
+                # Recorded as a failed line, so the commit is retried in the next round.
+                return json.dumps({"key": json.loads(request_line)['key'], "status": f"{type(e).__name__}: {e}"}).encode('utf-8')
+            time.sleep(2 ** attempt * random.uniform(0.5, 1.0))
+
+
+def classify_online(requests_path, client, concurrency=RETRY_CONCURRENCY):
+    """
+    Sends every request in requests_path with at most `concurrency` calls in
+    flight (and only a few times that many lines read ahead). Returns the
+    records DataFrame.
+    """
+    rows = []
+    with open(requests_path, 'rb') as f, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        for line in f:
+            if not line.strip():
+                continue
+            in_flight.add(pool.submit(_predict_with_retries, client, line))
+            if len(in_flight) >= concurrency * 4:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                rows.extend(parse_line(future.result()) for future in finished)
+        finished, _ = wait(in_flight)
+        rows.extend(parse_line(future.result()) for future in finished)
+    records = pd.DataFrame(rows, columns=RECORD_COLUMNS[1:])
+    records.insert(0, 'original_line_num', None)
+    return records
+
+
+# --- Batch classification ---
+
+def classify_batch(requests_path, repo, model_name, service, backend=None):
+    """
+    Uploads requests_path and runs it as a batch job through a
+    job_orchestrator.py service (VertexJobService or FakeJobService). The job
+    is recorded in the orchestrator state under "<repo>:retry:<md5>", so a
+    restart with the same retry set re-attaches to the running job.
+    """
+    import job_orchestrator
+    backend = backend or backend_from_env()
+    with open(requests_path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:12]
+    source_blob = job_orchestrator.repo_blob(BLOB_RETRY_DESTINATION, repo)
+    summary = upload_many(backend, [(requests_path, source_blob)], max_workers=1)
+    if summary["failed"]:
+        raise IOError(f"Upload of {requests_path} failed: {summary['failed'][source_blob]}")
+
+    spec = {
+        **job_orchestrator.repo_job_spec(repo),
+        "repo": f"{repo}:retry:{digest}",
+        "source_blob": source_blob,
+        "source_uris": [backend.uri(source_blob)],
+        "output_prefix": f"{job_orchestrator.repo_blob(BLOB_RETRY_RESULTS, repo).rstrip('/')}/{digest}/",
+        "predictions_dir": os.path.join(RETRY_PREDICTIONS_DIR, repo, digest),
+        "model": model_name,
+    }
+    poll = (0.5, 2.0) if isinstance(service, job_orchestrator.FakeJobService) else (job_orchestrator.POLL_INITIAL_SECONDS, job_orchestrator.POLL_MAX_SECONDS)
+    orchestrator = job_orchestrator.JobOrchestrator(service, backend=backend, poll_initial=poll[0], poll_max=poll[1])
+    batch = asyncio.run(orchestrator.run_job(spec["repo"], "batch", spec))
+    prediction_files = job_orchestrator.download_predictions(spec, batch["output_prefix"], backend)
+    records, _ = parse_predictions(prediction_files)
+    records['original_line_num'] = None  # line numbers of the retry output, not of the original batch
+    return records
+
+
+# --- Patching ---
+
+def patch_classified(classified_csv, retried):
+    """
+    Replaces the rows of every retried commit with its new record (at the
+    position of its first row) and appends the commits that had no row.
+    Returns the number of retried commits that now have a successful result.
+    """
+    retried = retried[retried['key'].notna()].drop_duplicates('key', keep='last').set_index('key', drop=False)
+    if os.path.exists(classified_csv):
+        classified = pd.read_csv(classified_csv)
+    else:
+        classified = pd.DataFrame(columns=RECORD_COLUMNS)
+    is_retried = classified['key'].isin(retried.index)
+    first = is_retried & ~classified['key'].duplicated()
+    drop = is_retried & ~first
+
+    patched = classified.astype(object)
+    new_values = retried.loc[patched.loc[first, 'key'], RECORD_COLUMNS].astype(object)
+    patched.loc[first, RECORD_COLUMNS] = new_values.to_numpy()
+    # Compared against the (few) patched keys; isin over the whole key column is slow for string arrays.
+    appended = retried[~retried.index.isin(patched.loc[first, 'key'].tolist())][RECORD_COLUMNS]
+    patched = pd.concat([patched[~drop], appended.reset_index(drop=True)], ignore_index=True)
+
+    os.makedirs(os.path.dirname(classified_csv) or ".", exist_ok=True)
+    tmp_path = classified_csv + ".tmp"
+    patched.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, classified_csv)
+    if os.path.exists(ledger_path_for(classified_csv)):
+        os.remove(ledger_path_for(classified_csv))  # the file no longer matches what the shard watcher appended
+    if WAREHOUSE_FORMAT == "parquet":
+        write_classified(patched, WAREHOUSE_DIR)
+    return int(_succeeded(retried).sum())
+
+
+def _cache_successes(retried, request_keys, model_name):
+    """Stores the successful retries in the result cache under their request keys."""
+    good = retried[_succeeded(retried)]
+    rows = [(request_keys[commit_id], commit_id, model_name, _as_bool(is_bug_fix), category, reasoning)
+            for commit_id, is_bug_fix, category, reasoning in zip(good['key'], good['is_bug_fix'], good['category'], good['reasoning'])
+            if request_keys.get(commit_id)]
+    with ResultCache() as cache:
+        cache.put_many(rows)
+
+
+# --- Rounds ---
+
+def retry_until_converged(classified_csv, table_path, repo=CURRENT_LANGUAGE_REPO, mode=RETRY_MODE,
+                          rounds=RETRY_ROUNDS, client=None, service=None, backend=None,
+                          model_resource_file=MODEL_RESOURCE_FILE, batch_jsonl=BATCH_JSONL,
+                          request_keys_path=REQUEST_KEYS_CSV):
+    """
+    Runs retry rounds over classified_csv until every submitted commit (see
+    submitted_keys) has a successful result, `rounds` rounds have run, or a
+    round fixes nothing. client (online) and service (batch) default to the
+    Vertex AI ones. Returns {"rounds", "retried", "fixed", "remaining", "unknown"}.
+    """
+    model_name = read_model_resource_name(model_resource_file)
+    submitted = submitted_keys(batch_jsonl, request_keys_path)
+    if submitted is None:
+        print(f"Note: neither {batch_jsonl} nor {request_keys_path} exists; every commit of {table_path} counts as submitted.")
+    summary = {"rounds": 0, "retried": 0, "fixed": 0, "remaining": 0, "unknown": 0}
+    for round_number in range(1, rounds + 1):
+        failed, missing, unknown = collect_retry_keys(classified_csv, table_path, submitted)
+        summary["remaining"], summary["unknown"] = len(failed) + len(missing), len(unknown)
+        if not failed and not missing:
+            break
+        print(f"\nRetry round {round_number}: {len(failed)} failed and {len(missing)} missing commits "
+              f"({len(unknown)} failed keys are not in the commit table).")
+        request_keys = build_retry_requests(failed + missing, table_path, model_name=model_name)
+        if not request_keys:
+            break
+
+        round_mode = mode if mode != "auto" else ("online" if len(request_keys) <= RETRY_ONLINE_MAX else "batch")
+        start = time.perf_counter()
+        if round_mode == "online":
+            client = client or VertexOnlineClient(PROJECT_ID, REGION, model_name)
+            retried = classify_online(RETRY_JSONL, client)
+        else:
+            if service is None:
+                import job_orchestrator
+                service = job_orchestrator.VertexJobService(PROJECT_ID, REGION)
+            retried = classify_batch(RETRY_JSONL, repo, model_name, service, backend)
+        fixed = patch_classified(classified_csv, retried)
+        if model_name is not None and os.path.exists(request_keys_path):
+            _cache_successes(retried, request_keys, model_name)
+
+        summary["rounds"] = round_number
+        summary["retried"] += len(request_keys)
+        summary["fixed"] += fixed
+        summary["remaining"] = len(failed) + len(missing) - fixed
+        print(f"Retry round {round_number} ({round_mode}): {fixed} of {len(request_keys)} commits fixed "
+              f"in {time.perf_counter() - start:.1f}s; patched {classified_csv}")
+        if fixed == 0:
+            print("No progress in this round; stopping.")
+            break
+    return summary
+
+
+def print_retry_summary(summary):
+    print("\n--- Retry Queue Summary ---")
+    print(f"Rounds run: {summary['rounds']}")
+    print(f"Requests retried: {summary['retried']}")
+    print(f"Commits fixed: {summary['fixed']}")
+    print(f"Commits still without a result: {summary['remaining']}")
+    if summary["unknown"]:
+        print(f"Failed keys not in the commit table: {summary['unknown']}")
+
+
+if __name__ == "__main__":
+    # Usage: python retry_queue.py [--fake] <classified.csv> <commit table.csv>
+    # --fake answers with batch_emulator.py (EmulatorClient, or FakeJobService
+    # in batch mode); run it with STORAGE_BACKEND=local.
+    args = sys.argv[1:]
+    use_fake = "--fake" in args
+    args = [arg for arg in args if arg != "--fake"]
+    if len(args) != 2:
+        exit("Usage: python retry_queue.py [--fake] <classified.csv> <commit table.csv>")
+    if not use_fake and read_model_resource_name() is None:
+        exit(f"Error: no model resource name in {MODEL_RESOURCE_FILE}.")
+
+    client = service = backend = None
+    if use_fake:
+        import job_orchestrator
+        backend = backend_from_env()
+        client = EmulatorClient()
+        service = job_orchestrator.FakeJobService(
+            on_batch_done=lambda spec, output_prefix: job_orchestrator.emulate_batch(spec, output_prefix, backend))
+    summary = retry_until_converged(args[0], args[1], repo=CURRENT_LANGUAGE_REPO or "repo",
+                                    client=client, service=service, backend=backend)
+    print_retry_summary(summary)
+    sys.exit(1 if summary["remaining"] else 0)
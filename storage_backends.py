@@ -0,0 +1,370 @@
+import os
+import sys
+import base64
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import google_crc32c  # installed with google-cloud-storage
+except ImportError:
+    google_crc32c = None
+
+# --- Object storage backends ---
+# Every upload goes through one backend object, so a run reuses a single
+# storage client, and a local directory can stand in for the bucket when
+# testing offline:
+#
+#   STORAGE_BACKEND=gcs    gs://<bucket>/<name> (google-cloud-storage)
+#   STORAGE_BACKEND=local  <LOCAL_STORAGE_ROOT>/<bucket>/<name>
+#
+# Backends share one small interface: stat / list (by name prefix) /
+# open_read / open_write (streaming) / upload_file / download_file.
+#
+# upload_many() pushes many files concurrently. It skips any file whose
+# remote copy already has the same md5 (or crc32c when the object has no md5,
+# as with composite objects), so re-running after a partial failure only
+# transfers what is missing. Files above RESUMABLE_THRESHOLD_BYTES are sent as
+# resumable uploads in RESUMABLE_CHUNK_BYTES chunks. download_many() is the
+# reverse: it skips local files that already match the object and continues
+# interrupted downloads from their .partial file.
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcs")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", "local_storage")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+RESUMABLE_CHUNK_BYTES = 32 * 1024 * 1024  # GCS wants a multiple of 256 KiB
+RESUMABLE_THRESHOLD_BYTES = 8 * 1024 * 1024
+READ_BUFFER_SIZE = 8 * 1024 * 1024
+PARTIAL_SUFFIX = ".partial"
+
+
+# --- Checksums (hex digests, the format the shard manifests use) ---
+
+def local_checksums(path, want_crc32c=True):
+    """{"size", "md5", "crc32c"} of a local file; crc32c is None without google_crc32c."""
+    md5 = hashlib.md5()
+    crc = google_crc32c.Checksum() if (want_crc32c and google_crc32c is not None) else None
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+            md5.update(chunk)
+            if crc is not None:
+                crc.update(chunk)
+            size += len(chunk)
+    return {"size": size, "md5": md5.hexdigest(), "crc32c": crc.digest().hex() if crc is not None else None}
+
+
+def is_identical(local, remote):
+    """True when the remote object provably holds the same bytes as the local file."""
+    if remote is None or remote["size"] != local["size"]:
+        return False
+    if remote.get("md5") and local.get("md5"):
+        return remote["md5"] == local["md5"]
+    if remote.get("crc32c") and local.get("crc32c"):
+        return remote["crc32c"] == local["crc32c"]
+    return False  # nothing to compare against; upload again to be safe
+
+
+def _b64_to_hex(value):
+    return base64.b64decode(value).hex() if value else None
+
+
+# --- Backends ---
+
+class GCSBackend:
+    """A GCS bucket behind one shared, thread-safe storage.Client."""
+
+    def __init__(self, project_id, bucket_name):
+        from google.cloud import storage
+        self.project_id = project_id
+        self.bucket_name = bucket_name
+        self.client = storage.Client(project=project_id)
+        self.bucket = self.client.bucket(bucket_name)
+
+    def __reduce__(self):
+        # Process pools get a fresh client in each worker instead of a pickled one.
+        return (GCSBackend, (self.project_id, self.bucket_name))
+
+    def uri(self, name):
+        return f"gs://{self.bucket_name}/{name}"
+
+    def stat(self, name):
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        return self._info(blob)
+
+    @staticmethod
+    def _info(blob):
+        return {"name": blob.name, "size": blob.size, "md5": _b64_to_hex(blob.md5_hash), "crc32c": _b64_to_hex(blob.crc32c)}
+
+    def list(self, prefix=""):
+        """Objects whose name starts with prefix, sorted by name."""
+        return sorted((self._info(blob) for blob in self.client.list_blobs(self.bucket_name, prefix=prefix)),
+                      key=lambda info: info["name"])
+
+    def open_read(self, name):
+        return self.bucket.blob(name).open('rb', chunk_size=RESUMABLE_CHUNK_BYTES)
+
+    def open_write(self, name):
+        return self.bucket.blob(name, chunk_size=RESUMABLE_CHUNK_BYTES).open('wb')
+
+    def delete(self, name):
+        """Removes the object if it exists."""
+        blob = self.bucket.get_blob(name)
+        if blob is not None:
+            blob.delete()
+
+    def download_file(self, name, local_path, start=0):
+        if start == 0:
+            # download_to_filename checks the md5/crc32c the server sends back.
+            self.bucket.blob(name).download_to_filename(local_path)
+            return
+        # A ranged request appends the rest of the object to a partial file;
+        # download_many() checks the whole file afterwards.
+        with open(local_path, 'ab') as f:
+            self.bucket.blob(name).download_to_file(f, start=start)
+
+    def upload_file(self, local_path, name, chunk_size=RESUMABLE_CHUNK_BYTES):
+        # With chunk_size set the client opens a resumable session and retries
+        # failed chunks instead of restarting the whole file.
+        resumable = os.path.getsize(local_path) > RESUMABLE_THRESHOLD_BYTES
+        blob = self.bucket.blob(name, chunk_size=chunk_size if resumable else None)
+        blob.upload_from_filename(local_path)
+
+
+class LocalBackend:
+    """A directory tree standing in for a bucket: <root>/<bucket>/<name>."""
+
+    def __init__(self, root, bucket_name):
+        self.bucket_name = bucket_name
+        self.base_dir = os.path.join(root, bucket_name)
+
+    def uri(self, name):
+        return os.path.abspath(self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, *name.split("/"))
+
+    def stat(self, name):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            return None
+        return {"name": name, **local_checksums(path)}
+
+    def list(self, prefix=""):
+        """
+        Objects whose name starts with prefix (a plain string prefix, as on
+        GCS), sorted by name. Checksums are left out; stat() computes them.
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(self.base_dir):
+            for filename in filenames:
+                if filename.endswith(PARTIAL_SUFFIX):
+                    continue  # an upload in progress is not an object yet
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    found.append({"name": name, "size": os.path.getsize(path), "md5": None, "crc32c": None})
+        return sorted(found, key=lambda info: info["name"])
+
+    def open_read(self, name):
+        return open(self._path(name), 'rb')
+
+    def open_write(self, name):
+        return _LocalObjectWriter(self._path(name))
+
+    def delete(self, name):
+        """Removes the object if it exists."""
+        if os.path.isfile(self._path(name)):
+            os.remove(self._path(name))
+
+    def download_file(self, name, local_path, start=0):
+        if start == 0:
+            shutil.copyfile(self._path(name), local_path)
+            return
+        with open(self._path(name), 'rb') as src, open(local_path, 'ab') as out:
+            src.seek(start)
+            shutil.copyfileobj(src, out, READ_BUFFER_SIZE)
+
+    def upload_file(self, local_path, name, chunk_size=RESUMABLE_CHUNK_BYTES):
+        # Mirrors a resumable upload: chunks go to a .partial file that a
+        # later run continues from, and the object only appears once complete.
+        dest = self._path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if os.path.getsize(local_path) <= RESUMABLE_THRESHOLD_BYTES:
+            shutil.copyfile(local_path, dest + PARTIAL_SUFFIX)
+        else:
+            partial = dest + PARTIAL_SUFFIX
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            with open(local_path, 'rb') as src, open(partial, 'ab') as out:
+                src.seek(offset)
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    out.write(chunk)
+                    out.flush()
+        os.replace(dest + PARTIAL_SUFFIX, dest)
+
+
+class _LocalObjectWriter:
+    """Streams into <object>.partial and publishes the object on a clean close()."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.file = open(path + PARTIAL_SUFFIX, 'wb', buffering=READ_BUFFER_SIZE)
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.replace(self.path + PARTIAL_SUFFIX, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()  # leave the .partial behind; the object never appears
+
+
+def get_backend(project_id, bucket_name, kind=STORAGE_BACKEND, local_root=LOCAL_STORAGE_ROOT):
+    if kind == "gcs":
+        return GCSBackend(project_id, bucket_name)
+    if kind == "local":
+        return LocalBackend(local_root, bucket_name)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{kind}' (expected 'gcs' or 'local').")
+
+
+def backend_from_env():
+    """The backend for PROJECT_ID / GCS_BUCKET_NAME / STORAGE_BACKEND from the environment."""
+    return get_backend(os.getenv("PROJECT_ID"), os.getenv("GCS_BUCKET_NAME"))
+
+
+# --- Parallel uploads ---
+
+def _upload_one(backend, local_path, name, known_md5, attempts):
+    local = {"size": os.path.getsize(local_path), "md5": known_md5, "crc32c": None}
+    if local["md5"] is None:
+        local = local_checksums(local_path)
+    remote = backend.stat(name)
+    if remote is not None and not remote.get("md5") and local["crc32c"] is None:
+        local = local_checksums(local_path)  # composite objects only carry a crc32c
+    if is_identical(local, remote):
+        return "skipped"
+    for attempt in range(1, attempts + 1):
+        try:
+            backend.upload_file(local_path, name)
+            break
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            print(f"Warning: upload of {local_path} failed (attempt {attempt}). Error: {e}")
+    remote = backend.stat(name)
+    if not is_identical(local, remote):
+        raise IOError(f"Checksum mismatch after uploading {local_path} to {backend.uri(name)}.")
+    return "uploaded"
+
+
+def upload_many(backend, files, max_workers=UPLOAD_WORKERS, attempts=3):
+    """
+    Uploads [(local_path, object_name)] or [(local_path, object_name, md5_hex)]
+    concurrently. Passing the md5 (e.g. from a shard manifest) saves re-hashing
+    the file. Returns {"uploaded": [...], "skipped": [...], "failed": {name: error}}.
+    """
+    summary = {"uploaded": [], "skipped": [], "failed": {}}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for entry in files:
+            local_path, name = entry[0], entry[1]
+            known_md5 = entry[2] if len(entry) > 2 else None
+            futures[pool.submit(_upload_one, backend, local_path, name, known_md5, attempts)] = (local_path, name)
+        for future in as_completed(futures):
+            local_path, name = futures[future]
+            try:
+                outcome = future.result()
+                summary[outcome].append(name)
+                print(f"{'Uploaded' if outcome == 'uploaded' else 'Unchanged, skipped'}: {local_path} -> {backend.uri(name)}")
+            except Exception as e:
+                summary["failed"][name] = str(e)
+                print(f"FAILED: {local_path} -> {backend.uri(name)}. Error: {e}")
+    print(f"Uploads: {len(summary['uploaded'])} transferred, {len(summary['skipped'])} unchanged, "
+          f"{len(summary['failed'])} failed.")
+    return summary
+
+
+# --- Parallel downloads ---
+
+def _download_one(backend, name, local_path, attempts):
+    remote = backend.stat(name)
+    if remote is None:
+        raise FileNotFoundError(f"{backend.uri(name)} does not exist.")
+    if os.path.exists(local_path) and is_identical(local_checksums(local_path, want_crc32c=not remote.get("md5")), remote):
+        return "skipped"
+    os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+    partial = local_path + PARTIAL_SUFFIX
+    for attempt in range(1, attempts + 1):
+        # A .partial left by an interrupted download is continued from where it stopped.
+        start = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if start > remote["size"]:
+            os.remove(partial)  # belongs to some other version of the object
+            start = 0
+        try:
+            if start < remote["size"] or remote["size"] == 0:
+                backend.download_file(name, partial, start=start)
+            if is_identical(local_checksums(partial, want_crc32c=not remote.get("md5")), remote):
+                break
+            os.remove(partial)  # the resumed bytes do not add up to this object; start over
+            raise IOError(f"Checksum mismatch after downloading {backend.uri(name)}.")
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            print(f"Warning: download of {backend.uri(name)} failed (attempt {attempt}). Error: {e}")
+    os.replace(partial, local_path)
+    return "downloaded"
+
+
+def download_many(backend, files, max_workers=DOWNLOAD_WORKERS, attempts=3):
+    """
+    Downloads [(object_name, local_path)] concurrently, skipping local files
+    that already match the object. Each file is written under a .partial name
+    and only moved into place once its size and checksum match; a .partial
+    left by an interrupted run is resumed with a ranged read.
+    Returns {"downloaded": [...], "skipped": [...], "failed": {name: error}}.
+    """
+    summary = {"downloaded": [], "skipped": [], "failed": {}}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_download_one, backend, name, local_path, attempts): (name, local_path)
+                   for name, local_path in files}
+        for future in as_completed(futures):
+            name, local_path = futures[future]
+            try:
+                outcome = future.result()
+                summary[outcome].append(name)
+                print(f"{'Downloaded' if outcome == 'downloaded' else 'Unchanged, skipped'}: {backend.uri(name)} -> {local_path}")
+            except Exception as e:
+                summary["failed"][name] = str(e)
+                print(f"FAILED: {backend.uri(name)} -> {local_path}. Error: {e}")
+    print(f"Downloads: {len(summary['downloaded'])} transferred, {len(summary['skipped'])} unchanged, "
+          f"{len(summary['failed'])} failed.")
+    return summary
+
+
+if __name__ == "__main__":
+    # Usage: python storage_backends.py upload <bucket> <prefix> <file> [<file> ...]
+    #        python storage_backends.py ls <bucket> [<prefix>]
+    if len(sys.argv) < 3 or sys.argv[1] not in ("upload", "ls") or (sys.argv[1] == "upload" and len(sys.argv) < 5):
+        exit("Usage: python storage_backends.py upload <bucket> <prefix> <file> [<file> ...]\n"
+             "       python storage_backends.py ls <bucket> [<prefix>]")
+    backend = get_backend(os.getenv("PROJECT_ID"), sys.argv[2])
+    if sys.argv[1] == "ls":
+        for info in backend.list(sys.argv[3] if len(sys.argv) > 3 else ""):
+            print(f"{info['size']:>14}  {info['name']}")
+        sys.exit(0)
+    prefix, paths = sys.argv[3].strip("/"), sys.argv[4:]
+    result = upload_many(backend, [(path, f"{prefix}/{os.path.basename(path)}" if prefix else os.path.basename(path)) for path in paths])
+    sys.exit(1 if result["failed"] else 0)
@@ -0,0 +1,164 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import job_orchestrator as jo
+from prompt_builder import batch_request_line
+from result_cache import ResultCache, RequestKeyWriter
+from storage_backends import LocalBackend
+
+# run_all() end to end with FakeJobService, batch_emulator.py and the local
+# storage backend: every stage runs for real, only the Vertex AI jobs are faked.
+
+REPOS = ["libxml2", "zlib"]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jo, "BLOB_TRAINING_DESTINATION", "training/{repo}.jsonl")
+    monkeypatch.setattr(jo, "BLOB_BATCHING_TO_CLASSIFY_DESTINATION", "batching/{repo}/FULL_commit_toclassify.jsonl")
+    monkeypatch.setattr(jo, "BLOB_BATCHING_RESULTS", "batching/{repo}/results/")
+    monkeypatch.setattr(jo, "REQUEST_KEYS_PATH", "{repo}/request_keys.csv")
+    backend = LocalBackend(str(tmp_path / "storage"), "bucket")
+    for repo in REPOS:
+        upload_requests(backend, repo, 20)
+    return backend, str(tmp_path / "state.json")
+
+
+def commit_ids(repo, count):
+    return [f"{repo[:4]}{i:036x}" for i in range(count)]
+
+
+def upload_requests(backend, repo, count):
+    path = f"{repo}-requests.jsonl"
+    with open(path, 'wb') as f:
+        for commit_id in commit_ids(repo, count):
+            f.write(batch_request_line(commit_id, f"Fix {commit_id}", "@@ -1 +1 @@\n-a\n+b\n", repo_name=repo))
+    backend.upload_file(path, jo.repo_blob(jo.BLOB_BATCHING_TO_CLASSIFY_DESTINATION, repo))
+
+
+def make_service(backend, fail=(), batch_seconds=0.1):
+    return jo.FakeJobService(durations={"tuning": 0.1, "batch": batch_seconds}, fail=fail,
+                             on_batch_done=lambda spec, output_prefix: jo.emulate_batch(spec, output_prefix, backend))
+
+
+def run_all(service, backend, state_path, repos=REPOS):
+    orchestrator = jo.JobOrchestrator(service, state=jo.JobStateStore(state_path), backend=backend,
+                                      run_tuning=True, poll_initial=0.05, poll_max=0.1)
+    return asyncio.run(orchestrator.run_all(repos))
+
+
+def submitted(service, kind):
+    return [job for job in service.jobs.values() if job["kind"] == kind]
+
+
+def classified(repo):
+    return pd.read_csv(jo.repo_job_spec(repo)["classified_csv"])
+
+
+def test_run_all_runs_every_stage_for_every_repo(env):
+    backend, state_path = env
+    service = make_service(backend)
+
+    results = run_all(service, backend, state_path)
+
+    assert {repo: result["records"] for repo, result in results.items()} == {"libxml2": 20, "zlib": 20}
+    state = jo.JobStateStore(state_path)
+    for repo in REPOS:
+        assert [state.get(repo, stage)["state"] for stage in jo.STAGES] == ["succeeded"] * 4
+        assert sorted(classified(repo)["key"]) == commit_ids(repo, 20)
+        with open(jo.repo_job_spec(repo)["model_resource_file"]) as f:
+            assert f.read() == f"projects/fake/locations/local/models/{repo}"
+
+
+def test_rerun_on_same_inputs_submits_nothing(env):
+    backend, state_path = env
+    service = make_service(backend)
+    run_all(service, backend, state_path)
+
+    results = run_all(service, backend, state_path)
+
+    assert len(service.jobs) == 4  # one tuning and one batch job per repository
+    assert results["libxml2"]["records"] == 20
+
+
+def test_restart_reattaches_to_the_running_batch_job(env):
+    backend, state_path = env
+    service = make_service(backend, batch_seconds=2.0)
+
+    async def interrupted():
+        orchestrator = jo.JobOrchestrator(service, state=jo.JobStateStore(state_path), backend=backend,
+                                          poll_initial=0.05, poll_max=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(orchestrator.run_all(REPOS), timeout=0.8)
+
+    asyncio.run(interrupted())
+    state = jo.JobStateStore(state_path)
+    running = {repo: state.get(repo, "batch") for repo in REPOS}
+    assert all(entry["state"] == "running" for entry in running.values())
+
+    # A new orchestrator with the same state file polls the recorded jobs.
+    results = run_all(service, backend, state_path)
+
+    assert len(submitted(service, "batch")) == 2
+    assert {repo: jo.JobStateStore(state_path).get(repo, "batch")["job_id"] for repo in REPOS} == \
+        {repo: entry["job_id"] for repo, entry in running.items()}
+    assert results["zlib"]["records"] == 20
+
+
+def test_new_batch_input_runs_batch_download_and_merge_again(env):
+    backend, state_path = env
+    service = make_service(backend)
+    run_all(service, backend, state_path)
+    first_run = jo.JobStateStore(state_path).get("zlib", "merge")["run_id"]
+
+    upload_requests(backend, "zlib", 30)
+    results = run_all(service, backend, state_path)
+
+    state = jo.JobStateStore(state_path)
+    assert len(submitted(service, "batch")) == 3  # zlib's batch ran again, libxml2's did not
+    assert len(submitted(service, "tuning")) == 2  # the training data did not change
+    assert state.get("zlib", "merge")["run_id"] != first_run
+    assert state.get("zlib", "merge")["run_id"] == state.get("zlib", "batch")["run_id"]
+    assert results["zlib"]["records"] == 30
+    assert len(classified("zlib")) == 30
+
+
+def test_failed_job_is_reported_and_retried_on_the_next_run(env):
+    backend, state_path = env
+    failing = make_service(backend, fail={("batch", "zlib")})
+
+    results = run_all(failing, backend, state_path)
+
+    assert isinstance(results["zlib"], jo.JobFailed)
+    assert results["libxml2"]["records"] == 20  # one failing repository does not stop the others
+    state = jo.JobStateStore(state_path)
+    assert state.get("zlib", "batch")["state"] == "failed"
+    assert state.get("zlib", "download") == {}
+
+    results = run_all(make_service(backend), backend, state_path)
+
+    assert results["zlib"]["records"] == 20
+    assert jo.JobStateStore(state_path).get("zlib", "merge")["state"] == "succeeded"
+
+
+def test_merge_reattaches_results_served_from_the_cache(env):
+    backend, state_path = env
+    cached_ids = [f"cafe{i:036x}" for i in range(3)]
+    writer = RequestKeyWriter(jo.repo_job_spec("libxml2")["request_keys_csv"])
+    for commit_id in commit_ids("libxml2", 20):
+        writer.write(commit_id, f"key-{commit_id}", "model")
+    for commit_id in cached_ids:
+        writer.write(commit_id, f"key-{commit_id}", "model")
+    writer.close()
+    with ResultCache() as cache:
+        cache.put_many([(f"key-{commit_id}", commit_id, "model", True, "Memory Safety", "cached")
+                        for commit_id in cached_ids])
+
+    results = run_all(make_service(backend), backend, state_path)
+
+    assert results["libxml2"]["records"] == 23
+    assert set(cached_ids) <= set(classified("libxml2")["key"])
+    assert len(classified("zlib")) == 20  # no sidecar for zlib, nothing re-attached
@@ -1,4 +1,5 @@
 import os
+import sys
 import requests
 import pandas as pd
 from git import Repo
@@ -7,10 +8,20 @@ from dotenv import load_dotenv
 import datetime
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diff_store import DiffStore, DIFF_STORE_DIR
+
 # --- (Import your classifier and diff functions as before) ---
 # For demonstration, we use placeholders
 
 def get_commit_diff_only(repo, commit_hash):
+    # Diffs already indexed by 01_data_prepare.py are read from the diff store
+    # instead of being re-diffed through git.
+    if os.path.isdir(DIFF_STORE_DIR):
+        with DiffStore(DIFF_STORE_DIR, read_only=True) as diff_store:
+            stored_diff = diff_store.get(commit_hash)
+        if stored_diff is not None:
+            return stored_diff
     try:
         commit = repo.commit(commit_hash)
         if not commit.parents: return ""
@@ -1,13 +1,16 @@
 import os
 import re
+import sys
 import time
 import json
 import pandas as pd
-from git import Repo, GitCommandError
 from tqdm import tqdm
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from commit_index import load_commit_index
+
 load_dotenv()
 
 # --- Configuration ---
@@ -186,9 +189,7 @@ def classify_with_llm(commit_message):
 
 # --- Main Execution with NEW Logic ---
 if __name__ == "__main__":
-    repo = Repo(LOCAL_REPO_PATH)
-    commits = list(repo.iter_commits())
-    df = pd.DataFrame([{"commit_hash": c.hexsha, "message": c.message} for c in tqdm(commits, desc="Extracting Commits")])
+    df = load_commit_index(LOCAL_REPO_PATH)[['commit_id', 'message']].rename(columns={'commit_id': 'commit_hash'})
     
     if SAMPLE_SIZE: df = df.head(SAMPLE_SIZE)
 
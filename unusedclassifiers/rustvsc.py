@@ -1,8 +1,11 @@
 import os
 import re
+import sys
 import pandas as pd
 from git import Repo, GitCommandError
-from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from commit_index import load_commit_index
 
 # --- Configuration ---
 # Official libxml2 git mirror
@@ -97,16 +100,10 @@ if __name__ == "__main__":
         print(f"Error interacting with the repository: {e}")
         exit()
 
-    # 2. Extract Data: Load all commits into a list
-    print("Extracting commit history... (this may take a moment)")
+    # 2. Extract Data: Load all commits from the cached commit index
+    print("Loading commit history from the commit index...")
     try:
-        commits = list(repo.iter_commits())
-        commit_data = [{
-            "commit_hash": c.hexsha,
-            "message": c.message
-        } for c in tqdm(commits, desc="Processing commits")]
-        
-        df = pd.DataFrame(commit_data)
+        df = load_commit_index(LOCAL_REPO_PATH)[['commit_id', 'message']].rename(columns={'commit_id': 'commit_hash'})
         print(f"Extracted a total of {len(df)} commits.")
     except Exception as e:
         print(f"Failed to extract commits: {e}")